@@ -1,38 +1,160 @@
-from django.contrib import admin
-from .models import User, Profile, Category, Post, Comment, Like, Bookmark
+import os
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from .models import User, Profile, Category, Post, Comment, Like, Bookmark, Notification, Job, JobSchedule, RequestStat, RequestProfile
+from .bulk import update_posts
+from .changelists import AutocompleteFilter, LargeTableAdmin
+from .profiling import summarize
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('username', 'email', 'role', 'is_staff')
     list_filter = ('role', 'is_staff', 'is_superuser')
+    search_fields = ('username', 'email')
+    ordering = ('username',)
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'is_subscribed', 'subscription_end_date')
+    list_select_related = ('user',)
+    raw_id_fields = ('user', 'follows')
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'slug')
     prepopulated_fields = {'slug': ('name',)}
+    search_fields = ('name',)
+
+class PostActionForm(ActionForm):
+    category = forms.ModelChoiceField(Category.objects.all(), required=False, help_text='For "Move to category"')
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'status', 'access_level', 'publish_date', 'view_count')
-    list_filter = ('status', 'access_level', 'author', 'category')
+class PostAdmin(LargeTableAdmin):
+    list_display = ('title', 'author', 'category', 'status', 'access_level', 'publish_date', 'view_count')
+    list_filter = ('status', 'access_level', ('author', AutocompleteFilter), ('category', AutocompleteFilter))
+    list_select_related = ('author', 'category')
     search_fields = ('title', 'body')
     prepopulated_fields = {'slug': ('title',)}
+    raw_id_fields = ('author',)
+    action_form = PostActionForm
+    actions = ('publish', 'unpublish', 'recategorise')
+
+    def save_model(self, request, obj, form, change):
+        obj._editor = request.user
+        super().save_model(request, obj, form, change)
+
+    @admin.action(description='Publish selected posts')
+    def publish(self, request, queryset):
+        self.message_user(request, f'{update_posts(queryset, status="published")} posts published.')
+
+    @admin.action(description='Unpublish selected posts')
+    def unpublish(self, request, queryset):
+        self.message_user(request, f'{update_posts(queryset, status="draft")} posts moved to drafts.')
+
+    @admin.action(description='Move selected posts to category')
+    def recategorise(self, request, queryset):
+        try:
+            category = Category.objects.get(pk=request.POST.get('category'))
+        except (Category.DoesNotExist, ValueError):
+            self.message_user(request, 'Choose a category to move the posts to.', messages.WARNING)
+            return
+        self.message_user(request, f'{update_posts(queryset, category_id=category.pk)} posts moved to {category}.')
 
 @admin.register(Bookmark)
-class BookmarkAdmin(admin.ModelAdmin):
+class BookmarkAdmin(LargeTableAdmin):
     list_display = ('user', 'post', 'created_date')
-    list_filter = ('created_date',)
+    list_filter = ('created_date', ('user', AutocompleteFilter), ('post', AutocompleteFilter))
+    list_select_related = ('user', 'post')
+    raw_id_fields = ('user', 'post')
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ('author', 'post', 'created_date')
-    list_filter = ('created_date',)
+    list_filter = ('created_date', ('author', AutocompleteFilter), ('post', AutocompleteFilter))
+    list_select_related = ('author', 'post')
+    raw_id_fields = ('author', 'post', 'parent')
 
 @admin.register(Like)
-class LikeAdmin(admin.ModelAdmin):
+class LikeAdmin(LargeTableAdmin):
     list_display = ('user', 'post', 'created_date')
-    list_filter = ('created_date',)
\ No newline at end of file
+    list_filter = ('created_date', ('user', AutocompleteFilter), ('post', AutocompleteFilter))
+    list_select_related = ('user', 'post')
+    raw_id_fields = ('user', 'post')
+
+@admin.register(Notification)
+class NotificationAdmin(LargeTableAdmin):
+    list_display = ('recipient', 'kind', 'actor', 'post', 'is_read', 'created_date')
+    list_filter = ('kind', 'is_read', ('recipient', AutocompleteFilter))
+    list_select_related = ('recipient', 'actor', 'post')
+    raw_id_fields = ('recipient', 'actor', 'post', 'comment')
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'claimed_by', 'finished_date')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'last_error')
+    readonly_fields = ('claimed_by', 'claimed_at', 'created_date', 'finished_date', 'last_error')
+    actions = ('retry',)
+
+    @admin.action(description='Retry selected jobs now')
+    def retry(self, request, queryset):
+        queryset.exclude(status='running').update(status='queued', run_at=timezone.now(), attempts=0, last_error='')
+
+@admin.register(JobSchedule)
+class JobScheduleAdmin(admin.ModelAdmin):
+    list_display = ('name', 'interval', 'enabled', 'next_run_at', 'last_run_at')
+    list_editable = ('enabled',)
+
+@admin.register(RequestStat)
+class RequestStatAdmin(admin.ModelAdmin):
+    list_display = ('url_name', 'hits', 'avg_ms', 'avg_db_ms', 'avg_render_ms', 'avg_queries', 'max_queries', 'duplicate_queries', 'last_seen')
+    search_fields = ('url_name',)
+    readonly_fields = [f.name for f in RequestStat._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_date', 'url_name', 'method', 'path', 'status_code', 'duration_ms', 'trigger', 'download_link')
+    list_filter = ('trigger', 'url_name')
+    search_fields = ('path', 'url_name')
+    date_hierarchy = 'created_date'
+    readonly_fields = [f.name for f in RequestProfile._meta.fields] + ['download_link', 'summary']
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view), name='blog_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download_view(self, request, pk):
+        if not self.has_view_permission(request):
+            raise Http404
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        if not os.path.exists(profile.file_path):
+            raise Http404('Profile file is missing')
+        return FileResponse(open(profile.file_path, 'rb'), as_attachment=True, filename=profile.filename)
+
+    @admin.display(description='File')
+    def download_link(self, obj):
+        return format_html('<a href="{}">Download .prof</a>', reverse('admin:blog_requestprofile_download', args=[obj.pk]))
+
+    @admin.display(description='Top functions (cumulative)')
+    def summary(self, obj):
+        if not os.path.exists(obj.file_path):
+            return 'Profile file is missing.'
+        return format_html('<pre style="font-size:11px;white-space:pre">{}</pre>', summarize(obj.file_path))
+
+    def delete_queryset(self, request, queryset):
+        for profile in queryset:
+            profile.delete()
@@ -0,0 +1,200 @@
+"""
+Views, likes, comments and bookmarks per post over time, for the author dashboard.
+
+Events are counted in a per-process buffer, keyed by post and hour, and added to the
+hourly PostStatBucket rows every ANALYTICS_FLUSH_INTERVAL seconds with one upsert, so
+serving a post never writes more than the ``view_count`` it already did. Likes,
+comments and bookmarks count +1 when added and -1 when removed, once their transaction
+commits. A background thread flushes the buffer once an interval has passed even when
+no more events come, and again when the process exits, so only a process killed
+outright loses counts, at most one interval of them.
+
+``compact()`` (hourly through the job queue, or ``manage.py compact_analytics``) folds
+hourly buckets older than ANALYTICS_HOURLY_DAYS into one daily bucket per post. Charts
+read both kinds, truncated to days, so a post's history costs one query however far
+back it goes.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from .db import thread_connections
+from .jobs import job
+from .models import Post, PostStatBucket
+
+logger = logging.getLogger('blog.analytics')
+
+KINDS = ('views', 'likes', 'comments', 'bookmarks')
+
+# (post id, hour, kind) -> count
+_buffer = Counter()
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+_flusher = None
+
+
+def hour_of(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def day_of(when):
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def record(post_id, kind, count=1):
+    """Count ``count`` events of ``kind`` for a post in the current hour."""
+    global _last_flush, _flusher
+    with _lock:
+        _buffer[post_id, hour_of(timezone.now()), kind] += count
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='analytics-flusher', daemon=True)
+            _flusher.start()
+            atexit.register(_flush_quietly)
+        if time.monotonic() - _last_flush < settings.ANALYTICS_FLUSH_INTERVAL:
+            return
+        pending = dict(_buffer)
+        _buffer.clear()
+        _last_flush = time.monotonic()
+    flush(pending)
+
+
+def record_on_commit(post_id, kind, count=1):
+    transaction.on_commit(lambda: record(post_id, kind, count))
+
+
+def flush(pending=None):
+    """Add buffered counts to the hourly buckets; returns how many buckets changed."""
+    global _last_flush
+    if pending is None:
+        with _lock:
+            pending = dict(_buffer)
+            _buffer.clear()
+            _last_flush = time.monotonic()
+    buckets = {}
+    for (post_id, hour, kind), count in pending.items():
+        buckets.setdefault((post_id, hour), dict.fromkeys(KINDS, 0))[kind] += count
+    # Posts deleted since their events were counted
+    existing = set(Post.objects.filter(pk__in={post_id for post_id, _ in buckets}).values_list('pk', flat=True))
+    return add('hour', {key: counts for key, counts in buckets.items() if key[0] in existing})
+
+
+def _flush_quietly():
+    try:
+        flush()
+    except DatabaseError:
+        logger.exception('Could not add buffered post analytics to the database')
+
+
+def _flush_loop():
+    # Flushes what record() left behind when no event came after the interval passed
+    while True:
+        time.sleep(max(_last_flush + settings.ANALYTICS_FLUSH_INTERVAL - time.monotonic(), 1))
+        if _buffer and time.monotonic() - _last_flush >= settings.ANALYTICS_FLUSH_INTERVAL:
+            thread_connections(_flush_quietly)()
+
+
+def add(period, buckets):
+    """
+    Add ``buckets``, {(post id, start): {kind: count}}, to the ``period`` rows with one
+    INSERT ... ON CONFLICT statement, so concurrent flushes never lose counts.
+    """
+    if not buckets:
+        return 0
+    quote = connection.ops.quote_name
+    table = quote(PostStatBucket._meta.db_table)
+    columns = ', '.join(quote(name) for name in ('post_id', 'period', 'start') + KINDS)
+    updates = ', '.join(f'{quote(kind)} = {table}.{quote(kind)} + excluded.{quote(kind)}' for kind in KINDS)
+    sql = (
+        f'INSERT INTO {table} ({columns}) VALUES ({", ".join(["%s"] * (3 + len(KINDS)))}) '
+        f'ON CONFLICT ({quote("post_id")}, {quote("period")}, {quote("start")}) DO UPDATE SET {updates}'
+    )
+    rows = [
+        (post_id, period, connection.ops.adapt_datetimefield_value(start), *(counts[kind] for kind in KINDS))
+        for (post_id, start), counts in sorted(buckets.items())
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+    return len(rows)
+
+
+def compact(cutoff=None):
+    """Fold hourly buckets before ``cutoff`` (a day boundary) into daily ones; returns how many were folded."""
+    cutoff = cutoff or day_of(timezone.now()) - timedelta(days=settings.ANALYTICS_HOURLY_DAYS)
+    days = {}
+    with transaction.atomic():
+        # Locked, so a concurrent flush into one of these hours waits and its counts are not deleted with it
+        hourly = list(
+            PostStatBucket.objects.select_for_update().filter(period='hour', start__lt=cutoff)
+            .values_list('pk', 'post_id', 'start', *KINDS)
+        )
+        for pk, post_id, start, *counts in hourly:
+            day = days.setdefault((post_id, day_of(timezone.localtime(start))), dict.fromkeys(KINDS, 0))
+            for kind, count in zip(KINDS, counts):
+                day[kind] += count
+        add('day', days)
+        pks = [row[0] for row in hourly]
+        for i in range(0, len(pks), 500):
+            PostStatBucket.objects.filter(pk__in=pks[i:i + 500]).delete()
+    return len(hourly)
+
+
+@job(every=3600)
+def compact_stats():
+    compact()
+
+
+def history(posts, days=None):
+    """Totals per day for ``posts`` over the last ``days`` days, oldest first, missing days included; one query."""
+    days = days or settings.ANALYTICS_DASHBOARD_DAYS
+    today = day_of(timezone.localtime())
+    since = today - timedelta(days=days - 1)
+    rows = (
+        PostStatBucket.objects.filter(post__in=posts, start__gte=since)
+        .annotate(day=TruncDay('start')).order_by().values('day')
+        .annotate(**{kind: Sum(kind) for kind in KINDS})
+    )
+    by_day = {row['day'].date(): row for row in rows}
+    series = []
+    for i in range(days):
+        day = (since + timedelta(days=i)).date()
+        row = by_day.get(day, {})
+        series.append({'day': day, **{kind: row.get(kind) or 0 for kind in KINDS}})
+    return series
+
+
+def top_posts(author, days=None, limit=10):
+    """The author's posts with the most views over the last ``days`` days, with their totals; one query."""
+    since = day_of(timezone.localtime()) - timedelta(days=(days or settings.ANALYTICS_DASHBOARD_DAYS) - 1)
+    return list(
+        PostStatBucket.objects.filter(post__author=author, start__gte=since)
+        .values('post_id', 'post__title', 'post__slug')
+        .annotate(**{kind: Sum(kind) for kind in KINDS}).order_by('-views', 'post_id')[:limit]
+    )
+
+
+def dashboard(author, post_id=None):
+    """
+    Context for the author dashboard: the top posts, and the daily history of all the
+    author's posts, or of ``post_id`` when it is one of them, with bar heights.
+    """
+    top = top_posts(author)
+    selected = next((row for row in top if row['post_id'] == post_id), None)
+    if post_id and selected is None:
+        selected = Post.objects.filter(pk=post_id, author=author).values('pk', 'title', 'slug').first()
+        selected = selected and {'post_id': selected['pk'], 'post__title': selected['title'], 'post__slug': selected['slug']}
+    posts = [selected['post_id']] if selected else Post.objects.filter(author=author).values('pk')
+    series = history(posts)
+    peak = max(day['views'] for day in series) or 1
+    for day in series:
+        day['height'] = round(100 * max(day['views'], 0) / peak)
+    totals = {kind: sum(day[kind] for day in series) for kind in KINDS}
+    return {'top': top, 'selected': selected, 'series': series, 'totals': totals, 'days': len(series)}
@@ -0,0 +1,108 @@
+"""
+Date archive: published posts per month (ArchiveMonth), kept in step with posts by the
+signals in blog/signals.py.
+
+Publishing, unpublishing, re-dating or deleting a post recounts only the months it
+left and entered, with one query that reads just those ranges of the (status,
+publish_date) index; the sidebar list is served from the cache. Archive pages walk the same index from a
+``(publish_date, pk)`` cursor, so deep pages cost no OFFSET scan.
+"""
+import functools
+import operator
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import feed
+from .models import ArchiveMonth, Post
+
+MONTHS_KEY = 'blog:archive-months'
+
+
+def month_of(date):
+    date = timezone.localtime(date)
+    return date.year, date.month
+
+
+def month_range(year, month=None):
+    """Aware [start, end) datetimes of a month, or of a whole year."""
+    start = datetime(year, month or 1, 1)
+    end = datetime(year + 1, 1, 1) if month in (None, 12) else datetime(year, month + 1, 1)
+    return timezone.make_aware(start), timezone.make_aware(end)
+
+
+def refresh(months):
+    """Recount the given (year, month) pairs from the posts table, in one query."""
+    months = set(months)
+    if not months:
+        return
+    ranges = [Q(publish_date__gte=start, publish_date__lt=end) for start, end in (month_range(*key) for key in months)]
+    counts = dict.fromkeys(months, 0)
+    counts.update(
+        (month_of(m), n) for m, n in per_month(Post.objects.filter(functools.reduce(operator.or_, ranges), status='published'))
+    )
+    empty = [Q(year=year, month=month) for (year, month), n in counts.items() if not n]
+    with transaction.atomic():
+        if empty:
+            ArchiveMonth.objects.filter(functools.reduce(operator.or_, empty)).delete()
+        ArchiveMonth.objects.bulk_create(
+            [ArchiveMonth(year=year, month=month, post_count=n) for (year, month), n in counts.items() if n],
+            update_conflicts=True, unique_fields=['year', 'month'], update_fields=['post_count'],
+        )
+    transaction.on_commit(invalidate)
+
+
+def per_month(posts):
+    return posts.annotate(m=TruncMonth('publish_date')).order_by().values('m').annotate(n=Count('pk')).values_list('m', 'n')
+
+
+def posts_changed(post_ids):
+    """Recount the months of these posts, e.g. after a bulk status change."""
+    refresh({month_of(date) for date in Post.objects.filter(pk__in=post_ids).values_list('publish_date', flat=True)})
+
+
+def rebuild():
+    """Recount every month; returns the number of months with posts."""
+    rows = per_month(Post.objects.filter(status='published'))
+    with transaction.atomic():
+        ArchiveMonth.objects.all().delete()
+        ArchiveMonth.objects.bulk_create([ArchiveMonth(year=month_of(m)[0], month=month_of(m)[1], post_count=n) for m, n in rows])
+    transaction.on_commit(invalidate)
+    return ArchiveMonth.objects.count()
+
+
+def months():
+    """Years with posts, newest first: dicts with year, count and their months; cached."""
+    years = cache.get(MONTHS_KEY)
+    if years is None:
+        years = []
+        for row in ArchiveMonth.objects.filter(post_count__gt=0).order_by('-year', '-month'):
+            if not years or years[-1]['year'] != row.year:
+                years.append({'year': row.year, 'count': 0, 'months': []})
+            years[-1]['count'] += row.post_count
+            years[-1]['months'].append({'month': row.month, 'date': datetime(row.year, row.month, 1), 'count': row.post_count})
+        cache.set(MONTHS_KEY, years, settings.ARCHIVE_CACHE_TIMEOUT)
+    return years
+
+
+def invalidate():
+    cache.delete(MONTHS_KEY)
+
+
+def page(queryset, year, month=None, cursor=None, size=None):
+    """Return ``(posts, next cursor or None)``: published posts of the period older than ``cursor``."""
+    size = size or settings.ARCHIVE_PAGE_SIZE
+    start, end = month_range(year, month)
+    qs = queryset.filter(status='published', publish_date__gte=start, publish_date__lt=end)
+    if cursor:
+        ts, pk = cursor
+        date = feed.EPOCH + ts * feed.MICROSECOND
+        qs = qs.filter(Q(publish_date__lt=date) | Q(publish_date=date, pk__lt=pk))
+    posts = list(qs.order_by('-publish_date', '-pk')[:size + 1])
+    next_cursor = feed.encode_cursor(feed.entry_key(posts[size - 1])) if len(posts) > size else None
+    return posts[:size], next_cursor
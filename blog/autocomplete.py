@@ -0,0 +1,235 @@
+"""
+Search-as-you-type suggestions served from an in-process prefix index.
+
+Each worker keeps a sorted list of ``(key, pk)`` entries per kind, one for every
+word-suffix of a label, and answers a prefix with ``bisect`` in each list, so the many
+posts under a prefix never crowd out its categories, tags and authors: no database
+query, and at most one cache read per AUTOCOMPLETE_CHECK_INTERVAL to check the version.
+
+Signals reload the changed rows (``changed()``) once the transaction commits and
+publish them under a new version number in the shared cache. Other workers replay
+the published changes when they notice the new version, or rebuild from scratch
+when they are too far behind or a change has expired.
+"""
+import bisect
+import functools
+import heapq
+import threading
+import time
+import unicodedata
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.urls import reverse
+
+from .models import Post, Category, TagCount, User
+
+VERSION_KEY = 'blog:autocomplete:version'
+CHANGE_KEY = 'blog:autocomplete:change:{}'
+CHANGE_TIMEOUT = 3600
+MAX_REPLAY = 50
+MAX_SCAN = 200
+# Suggestion order among equally good matches
+KIND_ORDER = {'category': 0, 'tag': 1, 'author': 2, 'post': 3}
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).split())
+
+
+def index_keys(*terms):
+    """Every suffix of each term that starts at a word boundary."""
+    keys = set()
+    for term in terms:
+        words = normalize(term).split()
+        keys.update(' '.join(words[i:]) for i in range(len(words)))
+    return keys
+
+
+# Loaders yield (pk, label, weight, url argument, terms to index) for all rows, or only ``pks``
+
+def load_posts(pks=None):
+    qs = Post.objects.filter(status='published')
+    if pks is not None:
+        qs = qs.filter(pk__in=pks)
+    for pk, title, slug, views in qs.values_list('pk', 'title', 'slug', 'view_count').iterator():
+        yield pk, title, views, slug, (title,)
+
+
+def load_tags(pks=None):
+    qs = TagCount.objects.filter(post_count__gt=0)
+    if pks is not None:
+        qs = qs.filter(tag_id__in=pks)
+    for pk, name, count in qs.values_list('tag_id', 'tag__name', 'post_count').iterator():
+        yield pk, name, count, name, (name,)
+
+
+def load_categories(pks=None):
+    qs = Category.objects.annotate(n=Count('posts', filter=Q(posts__status='published')))
+    if pks is not None:
+        qs = qs.filter(pk__in=pks)
+    for pk, name, slug, count in qs.values_list('pk', 'name', 'slug', 'n'):
+        yield pk, name, count, slug, (name,)
+
+
+def load_authors(pks=None):
+    qs = User.objects.filter(blog_posts__status='published').annotate(n=Count('blog_posts'))
+    if pks is not None:
+        qs = qs.filter(pk__in=pks)
+    rows = qs.values_list('pk', 'username', 'first_name', 'last_name', 'n')
+    for pk, username, first, last, count in rows.iterator():
+        name = f'{first} {last}'.strip()
+        yield pk, name or username, count, username, (name, username)
+
+
+LOADERS = {'post': load_posts, 'tag': load_tags, 'category': load_categories, 'author': load_authors}
+
+
+@functools.lru_cache(maxsize=4096)
+def url_for(kind, arg):
+    if kind == 'post':
+        return reverse('post_detail', args=[arg])
+    if kind == 'category':
+        return reverse('category_posts', args=[arg])
+    return f'{reverse("post_list")}?{urlencode({kind: arg})}'
+
+
+class PrefixIndex:
+    def __init__(self):
+        # ({kind: sorted entries}, {(kind, pk): (label, weight, url arg, keys, normalized label)}),
+        # replaced as a whole so readers never need the lock
+        self.state = ({kind: [] for kind in LOADERS}, {})
+        self.version = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def load(self, kind, pks=None):
+        return {
+            (kind, pk): (label, weight, arg, index_keys(*terms), normalize(label))
+            for pk, label, weight, arg, terms in LOADERS[kind](pks)
+        }
+
+    def build(self):
+        items = {}
+        for kind in LOADERS:
+            items.update(self.load(kind))
+        entries = {kind: [] for kind in LOADERS}
+        for (kind, pk), item in items.items():
+            entries[kind].extend((key, pk) for key in item[3])
+        for kind_entries in entries.values():
+            kind_entries.sort()
+        self.state = (entries, items)
+
+    def apply(self, changes):
+        """Reload the given {kind: pks or None} from the database."""
+        entries, items = self.state
+        items = dict(items)
+        stale = set()
+        for kind, pks in changes.items():
+            idents = [i for i in items if i[0] == kind] if pks is None else [(kind, pk) for pk in pks]
+            for ident in idents:
+                old = items.pop(ident, None)
+                if old:
+                    stale.update((ident[0], key, ident[1]) for key in old[3])
+        fresh = {}
+        for kind, pks in changes.items():
+            fresh.update(self.load(kind, pks))
+        items.update(fresh)
+        entries = {
+            kind: [(key, pk) for key, pk in kind_entries if (kind, key, pk) not in stale] if kind in changes else kind_entries
+            for kind, kind_entries in entries.items()
+        }
+        for (kind, pk), item in fresh.items():
+            for key in item[3]:
+                bisect.insort(entries[kind], (key, pk))
+        self.state = (entries, items)
+
+    def refresh(self):
+        """Catch up with the shared version, at most once per AUTOCOMPLETE_CHECK_INTERVAL."""
+        now = time.monotonic()
+        if self.version is not None and now - self.checked_at < settings.AUTOCOMPLETE_CHECK_INTERVAL:
+            return
+        # Until the first build every request has to wait; afterwards stale results are fine
+        if not self.lock.acquire(blocking=self.version is None):
+            return
+        try:
+            self.checked_at = now
+            remote = current_version()
+            if remote == self.version:
+                return
+            behind = remote - self.version if self.version is not None else 0
+            if 0 < behind <= MAX_REPLAY:
+                keys = [CHANGE_KEY.format(v) for v in range(self.version + 1, remote + 1)]
+                changes = cache.get_many(keys)
+                if len(changes) == len(keys):
+                    for key in keys:
+                        self.apply(changes[key])
+                    self.version = remote
+                    return
+            self.build()
+            self.version = remote
+        finally:
+            self.lock.release()
+
+    def search(self, query, limit):
+        q = normalize(query)
+        if not q:
+            return []
+        entries, items = self.state
+        found = set()
+        for kind, kind_entries in entries.items():
+            start = bisect.bisect_left(kind_entries, (q,))
+            for key, pk in kind_entries[start:start + MAX_SCAN]:
+                if not key.startswith(q):
+                    break
+                found.add((kind, pk))
+
+        def rank(ident):
+            label, weight, _, _, label_key = items[ident]
+            return not label_key.startswith(q), KIND_ORDER[ident[0]], -weight, label_key
+
+        return [
+            {'type': kind, 'label': items[kind, pk][0], 'url': url_for(kind, items[kind, pk][2])}
+            for kind, pk in heapq.nsmallest(limit, found, key=rank)
+        ]
+
+
+index = PrefixIndex()
+
+
+def suggest(query, limit=8):
+    index.refresh()
+    return index.search(query, limit)
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock so a flushed cache never reuses an old version number
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def changed(**changes):
+    """
+    Reload rows after the current transaction commits, e.g. ``changed(post=[1], author=[3])``.
+    Pass None instead of a list of pks to reload every row of that kind.
+    """
+    changes = {kind: None if pks is None else sorted({pk for pk in pks if pk is not None}) for kind, pks in changes.items()}
+    transaction.on_commit(lambda: publish(changes))
+
+
+def publish(changes):
+    with index.lock:
+        current_version()
+        version = cache.incr(VERSION_KEY)
+        cache.set(CHANGE_KEY.format(version), changes, CHANGE_TIMEOUT)
+        if index.version is not None:
+            index.apply(changes)
+            if index.version == version - 1:
+                index.version = version
@@ -0,0 +1,311 @@
+"""
+Benchmark scenarios for ``manage.py benchmark``.
+
+A scenario is a function registered with ``@scenario`` that receives a
+``BenchmarkContext`` and returns a callable. The callable is invoked once per
+iteration with the iteration number and must return an HTTP status code (or
+None for non-HTTP scenarios). Run against a database filled by
+``manage.py seed_synthetic``.
+"""
+import math
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core import signals
+from django.db import close_old_connections
+from django.db.models import Count
+from django.test import Client
+
+from . import jobs, metrics
+from .db import close_thread_connections
+
+SCENARIOS = {}
+
+# Applied for the whole run: sampled instrumentation would add writes and profiling
+# overhead to a random few iterations and skew the percentiles, and one client
+# liking in a loop is over any rate limit within the first second
+RUN_SETTINGS = {'REQUEST_TIMING_SAMPLE_RATE': 0, 'PROFILE_SAMPLE_RATE': 0, 'RATELIMIT_ENABLED': False}
+
+
+def scenario(name, group='http'):
+    def register(fn):
+        fn.benchmark_group = group
+        SCENARIOS[name] = fn
+        return fn
+    return register
+
+
+class BenchmarkContext:
+    def __init__(self, seed=42):
+        from blog.models import Post, User
+
+        self.rng = random.Random(seed)
+        published = Post.objects.filter(status='published')
+        self.post_slugs = list(published.order_by('-view_count').values_list('slug', flat=True)[:500])
+        if not self.post_slugs:
+            raise ValueError('No published posts found; run "manage.py seed_synthetic" first.')
+        self.category_slug = (
+            published.values_list('category__slug', flat=True)
+            .annotate(n=Count('pk')).order_by('-n').first()
+        )
+        self.tag_name = (
+            published.values_list('tags__name', flat=True)
+            .exclude(tags__name=None).annotate(n=Count('pk')).order_by('-n').first()
+        )
+        self.search_term = 'cache'
+        self.user = User.objects.filter(is_active=True, role='reader').order_by('pk').first()
+
+    def client(self, login=False):
+        client = Client()
+        if login and self.user is not None:
+            client.force_login(self.user)
+        return client
+
+    def slug(self):
+        return self.rng.choice(self.post_slugs)
+
+
+@scenario('post_list')
+def post_list(ctx):
+    client = ctx.client()
+    return lambda i: client.get('/', {'page': i % 5 + 1}).status_code
+
+
+@scenario('post_list_search')
+def post_list_search(ctx):
+    client = ctx.client()
+    return lambda i: client.get('/', {'q': ctx.search_term}).status_code
+
+
+@scenario('post_list_search_drill_down')
+def post_list_search_drill_down(ctx):
+    client = ctx.client()
+    filters = [{}, {'access': 'premium'}, {'category': ctx.category_slug}, {'tag': ctx.tag_name}]
+    return lambda i: client.get('/', {'q': ctx.search_term, **filters[i % len(filters)]}).status_code
+
+
+@scenario('post_list_category')
+def post_list_category(ctx):
+    client = ctx.client()
+    return lambda i: client.get('/', {'category': ctx.category_slug}).status_code
+
+
+@scenario('post_list_tag')
+def post_list_tag(ctx):
+    client = ctx.client()
+    return lambda i: client.get('/', {'tag': ctx.tag_name}).status_code
+
+
+@scenario('post_detail')
+def post_detail(ctx):
+    client = ctx.client()
+    return lambda i: client.get(f'/post/{ctx.slug()}/').status_code
+
+
+@scenario('like_post')
+def like_post(ctx):
+    client = ctx.client(login=True)
+    return lambda i: client.post(f'/api/post/{ctx.slug()}/like/').status_code
+
+
+@scenario('toggle_bookmark')
+def toggle_bookmark(ctx):
+    client = ctx.client(login=True)
+    return lambda i: client.post(f'/api/post/{ctx.slug()}/bookmark/').status_code
+
+
+def _admin_client():
+    from blog.models import User
+
+    admin = User.objects.filter(is_superuser=True).order_by('pk').first()
+    if admin is None:
+        raise ValueError('No superuser found; run "manage.py create_superuser_if_none" first.')
+    client = Client()
+    client.force_login(admin)
+    return client
+
+
+# Admin pages need collected static files ("manage.py collectstatic")
+
+@scenario('admin_comment_keyset', group='admin')
+def admin_comment_keyset(ctx):
+    """Follows the comment changelist's "Older" links, 50 pages deep."""
+    client = _admin_client()
+    url = '/admin/blog/comment/'
+    state = {'query': ''}
+
+    def run(i):
+        response = client.get(url + state['query'] if i % 50 else url)
+        match = re.search(rb'href="(\?after=\d+)"', response.content)
+        state['query'] = match.group(1).decode() if match else ''
+        return response.status_code
+    return run
+
+
+@scenario('admin_comment_offset', group='admin')
+def admin_comment_offset(ctx):
+    """The same depth through numbered pages, which the stock changelist reads with OFFSET."""
+    client = _admin_client()
+    return lambda i: client.get('/admin/blog/comment/', {'p': i % 50 + 1}).status_code
+
+
+def _request_cycle():
+    # What Django does around a view: drop stale connections, query, then close the
+    # connection (or keep it for CONN_MAX_AGE, or hand it back to the pool)
+    from blog.models import Post
+
+    signals.request_started.send(sender=None)
+    Post.objects.filter(status='published').values_list('pk', flat=True).first()
+    signals.request_finished.send(sender=None)
+
+
+@scenario('db_request_fresh_thread', group='db')
+def db_request_fresh_thread(ctx):
+    """One query per request, each request in a new thread as under Daphne."""
+    def run(i):
+        thread = threading.Thread(target=_request_cycle)
+        thread.start()
+        thread.join()
+    return run
+
+
+@scenario('db_request_same_thread', group='db')
+def db_request_same_thread(ctx):
+    """One query per request, all requests in one thread as under a WSGI worker."""
+    return lambda i: _request_cycle()
+
+
+@scenario('job_enqueue', group='jobs')
+def job_enqueue(ctx):
+    """Insert one job row, as a view does next to its own write."""
+    return lambda i: jobs.noop.enqueue() and None
+
+
+@scenario('job_claim_run', group='jobs')
+def job_claim_run(ctx):
+    """Enqueue, claim and run one job; with --concurrency the workers contend for rows."""
+    worker_id = f'bench-{threading.get_ident()}'
+
+    def run(i):
+        jobs.noop.enqueue()
+        for job_id in jobs.claim(worker_id, 1):
+            jobs.run_job(job_id)
+    return run
+
+
+@scenario('job_worker_drain', group='jobs')
+def job_worker_drain(ctx):
+    """A worker (JOB_POOL, JOB_CONCURRENCY) draining a batch of JOB_DRAIN_SIZE queued jobs."""
+    from blog.models import Job
+
+    def run(i):
+        Job.objects.bulk_create([Job(name=jobs.noop.job_name) for _ in range(JOB_DRAIN_SIZE)])
+        jobs.Worker(poll_interval=0).run(once=True)
+    return run
+
+
+JOB_DRAIN_SIZE = 100
+
+
+def _manage(*commands):
+    for command in commands:
+        subprocess.run([sys.executable, 'manage.py', *command.split()], cwd=settings.BASE_DIR, check=True, stdout=subprocess.DEVNULL)
+
+
+@scenario('startup_prepare', group='startup')
+def startup_prepare(ctx):
+    """A container restart with ``manage.py prepare``: one process, every step already done."""
+    return lambda i: _manage('prepare')
+
+
+@scenario('startup_legacy', group='startup')
+def startup_legacy(ctx):
+    """The same restart as entrypoint.sh did it before, one process per step."""
+    return lambda i: _manage(
+        'migrate --noinput', 'collectstatic --noinput', 'create_superuser_if_none', 'load_initial_data',
+    )
+
+
+def _connections_created():
+    return sum(value for _, value in metrics.DB_CONNECTIONS_CREATED.samples())
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_scenario(ctx, name, iterations, warmup=0, concurrency=1):
+    factory = SCENARIOS[name]
+
+    def worker(count, offset):
+        call = factory(ctx)
+        timings, errors = [], 0
+        for i in range(count):
+            start = time.perf_counter()
+            status = call(offset + i)
+            timings.append(time.perf_counter() - start)
+            if status is not None and status >= 400:
+                errors += 1
+        if concurrency > 1:
+            close_thread_connections()
+        else:
+            close_old_connections()
+        return timings, errors
+
+    if warmup:
+        worker(warmup, 0)
+
+    connections_before = _connections_created()
+    share = [iterations // concurrency + (1 if n < iterations % concurrency else 0) for n in range(concurrency)]
+    start = time.perf_counter()
+    if concurrency == 1:
+        results = [worker(iterations, warmup)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(worker, share, [warmup + n * iterations for n in range(concurrency)]))
+    wall = time.perf_counter() - start
+
+    timings = sorted(t for r in results for t in r[0])
+    return {
+        'iterations': len(timings),
+        'errors': sum(r[1] for r in results),
+        'concurrency': concurrency,
+        'wall_s': round(wall, 4),
+        'throughput_rps': round(len(timings) / wall, 2) if wall else 0.0,
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3) if timings else 0.0,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'db_connections': _connections_created() - connections_before,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare ``results`` with ``baseline`` (both {scenario: stats}). A scenario
+    regresses when its p95 grows, or its throughput drops, by more than ``tolerance``.
+    Returns a list of (scenario, metric, baseline, current, change, regressed).
+    """
+    rows = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, higher_is_worse in (('p50_ms', True), ('p95_ms', True), ('p99_ms', True), ('throughput_rps', False)):
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change > tolerance if higher_is_worse else change < -tolerance
+            rows.append((name, metric, old, new, change, regressed and metric in ('p95_ms', 'throughput_rps')))
+    return rows
@@ -0,0 +1,37 @@
+"""
+Changes to many posts at once, as one UPDATE statement.
+
+``QuerySet.update()`` and ``bulk_create()`` send no ``post_save``, so ``update_posts``
+and ``posts_created`` send ``posts_bulk_updated`` instead, and the receivers in
+blog/signals.py bring the tag index, suggestions, cached cards and feeds up to date
+for all the posts in one go.
+"""
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Post
+
+# Sent with ``rows``, the (pk, status, author id, category id) of each post before the
+# update (status None for new posts), ``values``, the field values it was given, and
+# ``created``, true for posts that were just inserted
+posts_bulk_updated = Signal()
+
+
+def update_posts(queryset, **values):
+    """Set ``values`` on the posts in ``queryset`` that differ; returns how many changed."""
+    with transaction.atomic():
+        rows = list(queryset.exclude(**values).values_list('pk', 'status', 'author_id', 'category_id'))
+        if rows:
+            Post.objects.filter(pk__in=[row[0] for row in rows]).update(**values, updated_date=timezone.now())
+            posts_bulk_updated.send(sender=Post, rows=rows, values=values, created=False)
+    return len(rows)
+
+
+def posts_created(posts):
+    """Send ``posts_bulk_updated`` for ``posts`` inserted with ``bulk_create`` and tagged."""
+    by_status = {}
+    for post in posts:
+        by_status.setdefault(post.status, []).append((post.pk, None, post.author_id, post.category_id))
+    for status, rows in by_status.items():
+        posts_bulk_updated.send(sender=Post, rows=rows, values={'status': status}, created=True)
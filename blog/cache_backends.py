@@ -0,0 +1,41 @@
+"""Django cache backends that report hit/miss counts to blog.metrics."""
+import threading
+
+from django.core.cache.backends import locmem, redis
+
+from .metrics import CACHE_REQUESTS
+
+_local = threading.local()
+
+
+class MeteredCacheMixin:
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        if not getattr(_local, 'in_get_many', False):
+            CACHE_REQUESTS.inc(backend=self.metrics_backend, result='miss' if value is _missing else 'hit')
+        return default if value is _missing else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        # BaseCache.get_many() is a loop over get(); count the batch once
+        _local.in_get_many = True
+        try:
+            found = super().get_many(keys, version)
+        finally:
+            _local.in_get_many = False
+        if found:
+            CACHE_REQUESTS.inc(len(found), backend=self.metrics_backend, result='hit')
+        if len(keys) > len(found):
+            CACHE_REQUESTS.inc(len(keys) - len(found), backend=self.metrics_backend, result='miss')
+        return found
+
+
+_missing = object()
+
+
+class LocMemCache(MeteredCacheMixin, locmem.LocMemCache):
+    metrics_backend = 'locmem'
+
+
+class RedisCache(MeteredCacheMixin, redis.RedisCache):
+    metrics_backend = 'redis'
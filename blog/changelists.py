@@ -0,0 +1,137 @@
+"""
+Admin changelists for tables with millions of rows.
+
+``LargeTableAdmin`` swaps the parts of a stock changelist that touch every row:
+
+* counts are exact only up to ADMIN_EXACT_COUNT_LIMIT; an unfiltered table is
+  estimated (PostgreSQL statistics, elsewhere the highest primary key) and a filtered
+  one is counted no further than the limit, and the second "N total" count is skipped;
+* foreign key filters search with the admin autocomplete instead of listing every
+  related row (``('author', AutocompleteFilter)``);
+* while the list is ordered by primary key, "Older" links carry the last id shown
+  (``?after=``) instead of a page number, so deep pages cost no OFFSET scan.
+"""
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.options import ShowFacets
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+from django.utils.translation import gettext as _
+
+AFTER_VAR = 'after'
+
+
+def estimate_rows(model, using):
+    """A cheap row count estimate that never scans the table."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table has been analyzed
+        if row and row[0] >= 0:
+            return int(row[0])
+    return model._default_manager.using(using).aggregate(n=Max('pk'))['n'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    # True when ``count`` is an estimate or a lower bound
+    estimated = False
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        qs = self.object_list
+        if not qs.query.where:
+            estimate = estimate_rows(qs.model, qs.db)
+            if estimate > limit:
+                self.estimated = True
+                return estimate
+        count = qs.order_by()[:limit + 1].count()
+        if count > limit:
+            self.estimated = True
+            return limit
+        return count
+
+
+class KeysetChangeList(ChangeList):
+    def __init__(self, request, *args, **kwargs):
+        try:
+            self.after = int(request.GET[AFTER_VAR])
+        except (KeyError, ValueError):
+            self.after = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(AFTER_VAR, None)
+        return params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Sorting, filtering and searching always start again from the newest row
+        return super().get_query_string({AFTER_VAR: None, **(new_params or {})}, remove)
+
+    def get_results(self, request):
+        super().get_results(request)
+        # The admin repeats the pk tie-breaker, hence the set
+        self.keyset = self.multi_page and not self.show_all and set(self.queryset.query.order_by) == {'-pk'}
+        if not self.keyset:
+            return
+        if self.after is not None:
+            self.result_list = self.queryset.filter(pk__lt=self.after)[:self.list_per_page]
+        rows = list(self.result_list)
+        self.next_url = self.get_query_string({AFTER_VAR: rows[-1].pk}) if len(rows) == self.list_per_page else None
+        self.first_url = self.get_query_string() if self.after is not None else None
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """A foreign key filter with a search box instead of a link per related row."""
+    template = 'admin/blog/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.attname}__exact'
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.lookup_val = self.used_parameters.get(self.lookup_kwarg)
+        # Clearing the box drops the parameter rather than submitting an empty id
+        self.widget = AutocompleteSelect(field, model_admin.admin_site, attrs={
+            'data-width': '100%', 'onchange': 'this.disabled = !this.value; this.form.submit()',
+        })
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        # The other active filters, search and ordering travel along with the form
+        self.hidden_params = [
+            (name, value) for name, values in sorted(changelist.filter_params.items())
+            if name not in (self.lookup_kwarg, AFTER_VAR) for value in values
+        ]
+        formfield = self.field.formfield(widget=self.widget, required=False)
+        self.rendered_widget = formfield.widget.render(self.lookup_kwarg, self.lookup_val[-1] if self.lookup_val else None)
+        yield {
+            'selected': not self.lookup_val,
+            'query_string': changelist.get_query_string(remove=[self.lookup_kwarg]),
+            'display': _('All'),
+        }
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = ShowFacets.NEVER
+    ordering = ('-pk',)
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    @property
+    def media(self):
+        media = super().media
+        for spec in self.list_filter:
+            if isinstance(spec, tuple) and spec[1] is AutocompleteFilter:
+                media += AutocompleteSelect(self.model._meta.get_field(spec[0]), self.admin_site).media
+        return media
@@ -1,23 +1,40 @@
 import json
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from .metrics import COMMENT_SOCKETS
+from .models import Post
+
 class CommentConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.post_slug = self.scope['url_route']['kwargs']['post_slug']
         self.room_group_name = f'comments_{self.post_slug}'
+        if not await self.post_exists():
+            await self.close()
+            return
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         await self.accept()
+        COMMENT_SOCKETS.inc(post=self.post_slug)
+        self.counted = True
 
     async def disconnect(self, close_code):
+        if getattr(self, 'counted', False):
+            COMMENT_SOCKETS.dec(post=self.post_slug)
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
+    @database_sync_to_async
+    def post_exists(self):
+        # database_sync_to_async closes stale connections around the call, so the
+        # thread does not keep one checked out for the lifetime of the socket
+        return Post.objects.filter(slug=self.post_slug, status='published').exists()
+
     # This method receives messages from the group and sends them to the client
     async def comment_message(self, event):
         comment = event['comment']
@@ -25,4 +42,22 @@ class CommentConsumer(AsyncWebsocketConsumer):
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
             'comment': comment
-        }))
\ No newline at end of file
+        }))
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.room_group_name = f'notifications_{user.pk}'
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'room_group_name'):
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+
+    async def notification_message(self, event):
+        await self.send(text_data=json.dumps({'notification': event['notification']}))
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def notifications(request):
+    # Without live delivery nothing is ever pushed, so pages open no socket for it
+    return {'notification_live': settings.NOTIFICATION_LIVE}
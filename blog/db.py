@@ -0,0 +1,31 @@
+"""
+Connection hygiene for code that runs outside the request cycle.
+
+Django only closes stale connections when a request starts or finishes. Code that
+runs in reused worker threads (executors, background workers) has to do the same
+itself, or a thread may sit on a broken connection, or hold a pooled one forever.
+"""
+from functools import wraps
+
+from django.db import close_old_connections, connections
+
+
+def thread_connections(fn):
+    """
+    Drop unusable or expired connections before and after ``fn``, the way
+    ``channels.db.database_sync_to_async`` does for consumers. With DB_CONN_MAX_AGE=0
+    or DB_POOL the connection is closed (returned to the pool) afterwards.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+def close_thread_connections():
+    """Close every connection of the current thread; call before a thread exits."""
+    connections.close_all()
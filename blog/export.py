@@ -0,0 +1,254 @@
+"""
+Static HTML export of the pages anonymous readers see, for a front proxy to serve
+without reaching Python.
+
+``manage.py export_static`` renders every public page through the normal middleware
+and views as an anonymous visitor, so premium posts come out as their paywalled
+preview: post pages, the home and category listings page by page, and the RSS feeds.
+Pages are rendered in chunks across STATIC_EXPORT_PROCESSES processes, and every file
+gets precompressed ``.gz`` and (with the brotli package installed) ``.br`` siblings.
+
+``manifest.json`` keeps a content hash per URL, so unchanged pages are never rewritten.
+Once it exists, post, comment and category changes queue an ``export_changed`` job that
+renders only the affected pages: the post itself, the listing pages showing it (every
+page of a listing whose set of posts changed), the feeds, and the category's post pages
+when the post is one of the newest there, since their related-post boxes show it.
+View counts, likes, the featured post and the tag cloud catch up on the next full export.
+
+Files mirror URLs: ``/post/<slug>/`` is ``post/<slug>/index.html``, ``/?page=3`` is
+``page-3.html`` and ``/feed/`` is ``feed/index.xml``. Serve them only to requests without
+a session cookie and without query parameters other than ``page``.
+"""
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.urls import reverse
+
+from . import handlers, processes
+from .jobs import job
+from .models import Category, Post
+from .views import EXPORT_META, PostListView
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger('blog.export')
+
+MANIFEST = 'manifest.json'
+CHUNK_SIZE = 50
+PAGE_SIZE = PostListView.paginate_by
+# related_posts() shows the three newest other posts of the category
+RELATED_DEPTH = 4
+
+
+def enabled():
+    """Whether changes should be exported: only after a first full export."""
+    return bool(settings.STATIC_EXPORT_DIR) and os.path.exists(os.path.join(settings.STATIC_EXPORT_DIR, MANIFEST))
+
+
+def page_url(base, page):
+    return base if page == 1 else f'{base}?page={page}'
+
+
+def listing_urls(base, count):
+    return [page_url(base, page) for page in range(1, max(1, math.ceil(count / PAGE_SIZE)) + 1)]
+
+
+# Target maps are {url: owner}; the owner ("home", "category:<pk>" or "post:<pk>") says
+# which pages to drop when they are no longer rendered
+
+def home_targets():
+    count = Post.objects.filter(status='published').count()
+    return dict.fromkeys(listing_urls(reverse('post_list'), count) + [reverse('post_feed')], 'home')
+
+
+def category_targets(category_ids):
+    targets = {}
+    categories = Category.objects.filter(pk__in=category_ids).annotate(n=Count('posts', filter=Q(posts__status='published')))
+    for category in categories:
+        urls = listing_urls(category.get_absolute_url(), category.n) + [reverse('category_feed', args=[category.slug])]
+        targets.update(dict.fromkeys(urls, f'category:{category.pk}'))
+    return targets
+
+
+def post_targets(post_ids=None):
+    qs = Post.objects.filter(status='published')
+    if post_ids is not None:
+        qs = qs.filter(pk__in=post_ids)
+    return {reverse('post_detail', args=[slug]): f'post:{pk}' for pk, slug in qs.values_list('pk', 'slug').iterator()}
+
+
+def output_file(url, content_type):
+    parts = urlsplit(url)
+    page = parse_qs(parts.query).get('page', ['1'])[0]
+    name = 'index' if page == '1' else f'page-{page}'
+    return os.path.join(parts.path.strip('/'), name + ('.xml' if 'xml' in content_type else '.html'))
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    variants = {path: content, path + '.gz': gzip.compress(content, 9, mtime=0)}
+    if brotli is not None:
+        variants[path + '.br'] = brotli.compress(content)
+    for name, data in variants.items():
+        # Readers never see a half-written file
+        tmp = f'{name}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, name)
+
+
+def remove_file(path):
+    for name in (path, path + '.gz', path + '.br'):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def export_pages(urls, previous):
+    """
+    Render ``urls`` and write the pages whose hash differs from ``previous`` ({url: sha}).
+    Returns {url: (status, file, sha, written)}; runs in the render processes.
+    """
+    handler = handlers.Handler()
+    results = {}
+    for url in urls:
+        # A META key rather than a header, so no visitor can make a request look like an export
+        request = handlers.get_request(url, settings.STATIC_EXPORT_HOST, secure=True, **{EXPORT_META: True})
+        response = handler.get_response(request)
+        if response.status_code != 200:
+            results[url] = (response.status_code, None, None, False)
+            continue
+        sha = hashlib.sha256(response.content).hexdigest()
+        file = output_file(url, response['Content-Type'])
+        path = os.path.join(settings.STATIC_EXPORT_DIR, file)
+        written = previous.get(url) != sha or not os.path.exists(path)
+        if written:
+            write_file(path, response.content)
+        results[url] = (200, file, sha, written)
+    return results
+
+
+@contextmanager
+def locked(root):
+    """One export at a time per directory, so manifest updates never interleave."""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def load_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(root, manifest):
+    tmp = os.path.join(root, f'{MANIFEST}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'), sort_keys=True)
+    os.replace(tmp, os.path.join(root, MANIFEST))
+
+
+def export(targets, prune=(), full=False, workers=None):
+    """
+    Render ``targets`` and update the manifest. Pages that now 404, and pages of the
+    owners in ``prune`` (of every owner with ``full``) that are no longer targets, are deleted.
+    """
+    root = settings.STATIC_EXPORT_DIR
+    workers = workers or settings.STATIC_EXPORT_PROCESSES
+    stats = dict.fromkeys(('rendered', 'written', 'removed', 'failed'), 0)
+    with locked(root):
+        manifest = load_manifest(root)
+        urls = sorted(targets)
+        chunks = [urls[i:i + CHUNK_SIZE] for i in range(0, len(urls), CHUNK_SIZE)]
+        previous = [{url: manifest[url]['sha'] for url in chunk if url in manifest} for chunk in chunks]
+        if workers > 1 and len(chunks) > 1:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(min(workers, len(chunks)), mp_context=context, initializer=processes.init) as pool:
+                results = list(pool.map(processes.export_pages, chunks, previous))
+        else:
+            results = [export_pages(chunk, prev) for chunk, prev in zip(chunks, previous)]
+        gone = set()
+        for chunk_results in results:
+            for url, (status, file, sha, written) in chunk_results.items():
+                stats['rendered'] += 1
+                if status == 200:
+                    manifest[url] = {'file': file, 'sha': sha, 'owner': targets[url]}
+                    stats['written'] += written
+                elif status in (404, 410):
+                    gone.add(url)
+                else:
+                    # Keep serving the last good copy
+                    stats['failed'] += 1
+                    logger.warning('Static export of %s failed with status %s', url, status)
+        prune = set(prune)
+        gone.update(url for url, entry in manifest.items() if url not in targets and (full or entry['owner'] in prune))
+        for url in gone:
+            entry = manifest.pop(url, None)
+            if entry:
+                remove_file(os.path.join(root, entry['file']))
+                stats['removed'] += 1
+        save_manifest(root, manifest)
+    return stats
+
+
+def build(workers=None):
+    """Export every public page and drop files of pages that no longer exist."""
+    targets = home_targets()
+    targets.update(category_targets(Category.objects.values_list('pk', flat=True)))
+    targets.update(post_targets())
+    return export(targets, full=True, workers=workers)
+
+
+def changed(posts=(), categories=(), home=False, pages_of=()):
+    """Queue ``export_changed`` in the current transaction when exporting is on."""
+    if enabled():
+        export_changed.enqueue(posts=sorted(set(posts)), categories=sorted(set(categories) - {None}), home=home, pages_of=sorted(set(pages_of)))
+
+
+@job()
+def export_changed(posts=(), categories=(), home=False, pages_of=()):
+    """
+    Re-render the pages of ``posts`` and, with ``home``/``categories``, every page of those
+    listings; for ``pages_of`` only the listing pages that show these posts.
+    """
+    posts = set(posts)
+    targets = {}
+    # Post pages whose related-post box shows a changed post
+    for category_id in set(Post.objects.filter(pk__in=posts).values_list('category_id', flat=True)) - {None}:
+        newest = Post.objects.filter(status='published', category_id=category_id).values_list('pk', flat=True)[:RELATED_DEPTH]
+        if posts & set(newest):
+            targets.update(post_targets(Post.objects.filter(category_id=category_id).values('pk')))
+    targets.update(post_targets(posts))
+    if home:
+        targets.update(home_targets())
+    targets.update(category_targets(categories))
+    for post in Post.objects.filter(pk__in=pages_of, status='published').select_related('category'):
+        newer = Post.objects.filter(status='published', publish_date__gt=post.publish_date)
+        targets.setdefault(page_url(reverse('post_list'), newer.count() // PAGE_SIZE + 1), 'home')
+        targets.setdefault(reverse('post_feed'), 'home')
+        if post.category:
+            owner = f'category:{post.category_id}'
+            base = post.category.get_absolute_url()
+            targets.setdefault(page_url(base, newer.filter(category_id=post.category_id).count() // PAGE_SIZE + 1), owner)
+            targets.setdefault(reverse('category_feed', args=[post.category.slug]), owner)
+    prune = {f'post:{pk}' for pk in posts} | {f'category:{pk}' for pk in categories} | ({'home'} if home else set())
+    return export(targets, prune=prune)
@@ -0,0 +1,142 @@
+"""
+Facet counts for search results: how many matching posts each category, tag, author
+and access level has, given the search and the other active filters.
+
+The matching published posts are read once per normalised query, with one query that
+runs the search condition once, as (category, author, access level, tags) rows. Those
+rows are cached with the version number current when they were read, and every count,
+with or without filters, is worked out from them, so drilling down through the facets
+of a search runs no query for them. Any change to published posts, tags or categories
+bumps the version.
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Post
+
+VERSION_KEY = 'blog:facets:version'
+POSTS_KEY = 'blog:facets:{}'
+# Facet name (also its query parameter) -> heading
+FACETS = {'category': 'Categories', 'tag': 'Tags', 'author': 'Authors', 'access': 'Access'}
+ACCESS_LABELS = dict(Post._meta.get_field('access_level').choices)
+
+
+def clean(query):
+    """The search as run: runs of whitespace collapsed, as they never help a match."""
+    return ' '.join(query.split())
+
+
+def normalize(query):
+    # icontains ignores case, so queries differing only in case share their posts
+    return clean(query).lower()
+
+
+def matching(query):
+    """The search condition of the post list."""
+    return Q(title__icontains=query) | Q(body__icontains=query) | Q(tags__name__icontains=query)
+
+
+def matched(query):
+    """
+    ([(category, author, access, (tag, ...))], {category slug: name}) for the published
+    posts matching ``query``; one query.
+    """
+    ids = Post.objects.filter(matching(query), status='published').values('pk')
+    rows = (
+        Post.objects.filter(pk__in=ids).order_by()
+        .values_list('pk', 'category__slug', 'category__name', 'author__username', 'access_level', 'tag_index__tag__name')
+    )
+    posts, categories = {}, {}
+    for pk, category, name, author, access, tag in rows:
+        post = posts.setdefault(pk, (category, author, access, []))
+        if tag is not None:
+            post[3].append(tag)
+        if category is not None:
+            categories[category] = name
+    return [(*post[:3], tuple(post[3])) for post in posts.values()], categories
+
+
+def posts_for(query):
+    """The cached ``matched()`` of ``query``."""
+    key = POSTS_KEY.format(hashlib.md5(normalize(query).encode(), usedforsecurity=False).hexdigest())
+    cached = cache.get_many([VERSION_KEY, key])
+    version = cached.get(VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.add(VERSION_KEY, version, None)
+    entry = cached.get(key)
+    if entry is None or entry[0] != version:
+        entry = (version, matched(clean(query)))
+        cache.set(key, entry, settings.SEARCH_FACET_TIMEOUT)
+    return entry[1]
+
+
+def count(posts, labels, wanted):
+    """
+    ({facet: [(value, label, count)]}, total) of the ``posts`` rows of ``matched()`` for
+    the {facet: value} filters ``wanted``, tags lowercased.
+    """
+    counts = {facet: {} for facet in FACETS}
+    total = 0
+    for category, author, access, tags in posts:
+        values = {'category': (category,) if category else (), 'tag': tags, 'author': (author,), 'access': (access,)}
+        missed = [
+            facet for facet, value in wanted.items()
+            if value not in ([tag.lower() for tag in tags] if facet == 'tag' else values[facet])
+        ]
+        if not missed:
+            total += 1
+        elif len(missed) > 1:
+            continue
+        # A facet is narrowed by the filters of the others only
+        for facet in missed or FACETS:
+            for value in values[facet]:
+                counts[facet][value] = counts[facet].get(value, 0) + 1
+    return {
+        facet: [
+            (value, labels.get(value, value) if facet == 'category' else value, n)
+            for value, n in sorted(values.items(), key=lambda item: (-item[1], item[0].lower()))[:settings.SEARCH_FACET_SIZE]
+        ]
+        for facet, values in counts.items()
+    }, total
+
+
+def facets(query, active):
+    """
+    Counts per facet value for the posts matching ``query``, each facet filtered by the
+    ``active`` {facet: value} filters of the other facets, as a list of facet dicts, and
+    the number of posts matching all the filters. Tags compare case-insensitively.
+    """
+    active = {name: value for name, value in active.items() if value}
+    wanted = {name: value.lower() if name == 'tag' else value for name, value in active.items()}
+    counts, total = count(*posts_for(query), wanted)
+    result = []
+    for facet, title in FACETS.items():
+        labels = ACCESS_LABELS if facet == 'access' else {}
+        result.append({'name': facet, 'title': title, 'values': [
+            facet_value(facet, value, n, labels.get(value, label), query, active) for value, label, n in counts[facet]
+        ]})
+    return result, total
+
+
+def facet_value(facet, value, count, label, query, active):
+    selected = value.lower() == active.get(facet, '').lower() if facet == 'tag' else value == active.get(facet)
+    # A selected value links to the results without it
+    params = {'q': query, **active, facet: None if selected else value}
+    return {
+        'value': value,
+        'label': label,
+        'count': count,
+        'selected': selected,
+        'url': '?' + urlencode({name: v for name, v in params.items() if v}),
+    }
+
+
+def invalidate():
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, time.time_ns(), None))
@@ -0,0 +1,138 @@
+"""
+The "Following" feed: recent posts by the authors a reader follows.
+
+Nothing is stored per reader except the set of followed author ids. Each author has a
+cached list of their FEED_AUTHOR_DEPTH most recent ``(publish key, post id)`` entries,
+newest first; a feed page fetches the lists of all followed authors with one
+``get_many`` and merges them with ``heapq.merge``. Following or unfollowing only
+edits the cached set, and a post change only drops its author's list, so no reader's
+feed is ever recomputed as a whole.
+
+Pages are addressed by a cursor (the last entry shown) rather than an offset. Once a
+page reaches past the end of a truncated author list, the rest comes from the database.
+"""
+import bisect
+import heapq
+import itertools
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import Post, Profile
+
+FOLLOWING_KEY = 'blog:following:{}'
+AUTHOR_KEY = 'blog:author-posts:{}'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def entry_key(post):
+    # Whole microseconds so the key maps back to the exact publish_date
+    return (post.publish_date - EPOCH) // MICROSECOND, post.pk
+
+
+def encode_cursor(entry):
+    return '{}-{}'.format(*entry)
+
+
+def decode_cursor(value):
+    """``(timestamp, pk)`` from a cursor, or None if it is malformed or out of range."""
+    try:
+        ts, pk = value.split('-')
+        ts, pk = int(ts), int(pk)
+        EPOCH + ts * MICROSECOND
+    except (AttributeError, ValueError, OverflowError):
+        return None
+    # Past a 64-bit integer the database driver refuses the value
+    return (ts, pk) if 0 <= pk < 2 ** 63 else None
+
+
+def following(user):
+    """Ids of the authors ``user`` follows."""
+    key = FOLLOWING_KEY.format(user.pk)
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(Profile.objects.filter(followed_by__user=user).values_list('user_id', flat=True))
+        cache.set(key, ids, settings.FEED_CACHE_TIMEOUT)
+    return ids
+
+
+def follow_changed(user_id, author_ids, followed):
+    """Add or remove authors in a cached following set after the transaction commits."""
+    def update():
+        key = FOLLOWING_KEY.format(user_id)
+        ids = cache.get(key)
+        if ids is not None:
+            ids = ids | author_ids if followed else ids - author_ids
+            cache.set(key, frozenset(ids), settings.FEED_CACHE_TIMEOUT)
+    author_ids = frozenset(author_ids)
+    transaction.on_commit(update)
+
+
+def forget_following(user_ids):
+    keys = [FOLLOWING_KEY.format(pk) for pk in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def author_posts(author_ids):
+    """``{author id: [(publish key, post id), ...]}``, newest first and at most FEED_AUTHOR_DEPTH long."""
+    keys = {author_id: AUTHOR_KEY.format(author_id) for author_id in author_ids}
+    cached = cache.get_many(keys.values())
+    lists = {author_id: cached[key] for author_id, key in keys.items() if key in cached}
+    missing = [author_id for author_id in author_ids if author_id not in lists]
+    if missing:
+        loaded = {author_id: [] for author_id in missing}
+        rows = (
+            Post.objects.filter(status='published', author_id__in=missing)
+            .annotate(rank=Window(RowNumber(), partition_by=F('author_id'), order_by=(F('publish_date').desc(), F('pk').desc())))
+            .filter(rank__lte=settings.FEED_AUTHOR_DEPTH)
+            .order_by('author_id', '-publish_date', '-pk')
+            .only('pk', 'author_id', 'publish_date')
+        )
+        for post in rows:
+            loaded[post.author_id].append(entry_key(post))
+        cache.set_many({keys[author_id]: entries for author_id, entries in loaded.items()}, settings.FEED_CACHE_TIMEOUT)
+        lists.update(loaded)
+    return lists
+
+
+def forget_author_posts(author_ids):
+    keys = [AUTHOR_KEY.format(pk) for pk in author_ids if pk is not None]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def page(user, cursor=None, size=None):
+    """Return ``(post ids, next cursor or None)`` for the entries older than ``cursor``."""
+    size = size or settings.FEED_PAGE_SIZE
+    authors = following(user)
+    if not authors:
+        return [], None
+    lists = author_posts(authors).values()
+    # Below the oldest entry of a truncated list the merge could miss posts
+    floor = max((entries[-1] for entries in lists if len(entries) >= settings.FEED_AUTHOR_DEPTH), default=None)
+    if cursor:
+        # Lists are newest first: skip to the first entry older than the cursor
+        target = (-cursor[0], -cursor[1])
+        lists = [entries[bisect.bisect_right(entries, target, key=lambda e: (-e[0], -e[1])):] for entries in lists]
+    merged = heapq.merge(*lists, reverse=True)
+    if floor:
+        merged = itertools.takewhile(lambda e: e >= floor, merged)
+    entries = list(itertools.islice(merged, size + 1))
+    if len(entries) <= size and floor:
+        entries += older_entries(authors, entries[-1] if entries else cursor, size + 1 - len(entries))
+    next_cursor = encode_cursor(entries[size - 1]) if len(entries) > size else None
+    return [pk for _, pk in entries[:size]], next_cursor
+
+
+def older_entries(authors, cursor, limit):
+    qs = Post.objects.filter(status='published', author_id__in=authors)
+    if cursor:
+        ts, pk = cursor
+        date = EPOCH + ts * MICROSECOND
+        qs = qs.filter(Q(publish_date__lt=date) | Q(publish_date=date, pk__lt=pk))
+    return [entry_key(p) for p in qs.order_by('-publish_date', '-pk').only('pk', 'publish_date')[:limit]]
+
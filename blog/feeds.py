@@ -0,0 +1,56 @@
+from django.contrib.syndication.views import Feed
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+
+from .models import Category, Post
+
+FEED_SIZE = 20
+
+
+def latest_posts(**filters):
+    return Post.objects.filter(status='published', **filters).select_related('author').order_by('-publish_date', '-pk')[:FEED_SIZE]
+
+
+class LatestPostsFeed(Feed):
+    read_from_replica = True
+    title = 'Flavor Blog'
+    description = 'The latest posts on Flavor Blog.'
+
+    def link(self):
+        return reverse('post_list')
+
+    def items(self):
+        return latest_posts()
+
+    def item_title(self, item):
+        return item.title
+
+    def item_description(self, item):
+        # The excerpt only, so premium posts stay behind the paywall
+        return item.excerpt
+
+    def item_pubdate(self, item):
+        return item.publish_date
+
+    def item_updateddate(self, item):
+        return item.updated_date
+
+    def item_author_name(self, item):
+        return item.author.username
+
+
+class CategoryFeed(LatestPostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Category, slug=slug)
+
+    def title(self, obj):
+        return f'Flavor Blog: {obj.name}'
+
+    def description(self, obj):
+        return f'The latest {obj.name} posts on Flavor Blog.'
+
+    def link(self, obj):
+        return obj.get_absolute_url()
+
+    def items(self, obj):
+        return latest_posts(category=obj)
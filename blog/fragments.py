@@ -0,0 +1,49 @@
+"""
+Cached post card markup, keyed by a per-post version number.
+
+A page asks for the version and the cached ``(version, html)`` card of every post it
+shows in a single ``get_many``; a card is reused only while its version matches.
+Signals bump the version when anything a card shows changes (the post, its author or
+category, likes, comments), so stale cards are never served and never need deleting.
+Per-user state such as bookmarks must stay outside the card.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+VERSION_KEY = 'blog:post-version:{}'
+CARD_KEY = 'blog:card:{}:{}'
+
+
+def attach_cards(posts, template):
+    """Set ``card_html`` on each post, rendering only the cards that are missing or stale."""
+    posts = list(posts)
+    if not posts:
+        return
+    keys = [(VERSION_KEY.format(p.pk), CARD_KEY.format(template, p.pk)) for p in posts]
+    cached = cache.get_many([k for pair in keys for k in pair])
+    rendered = {}
+    for post, (version_key, card_key) in zip(posts, keys):
+        version = cached.get(version_key)
+        if version is None:
+            # add() so a concurrent bump is never overwritten with an older version
+            version = time.time_ns()
+            cache.add(version_key, version, None)
+        card = cached.get(card_key)
+        if card is None or card[0] != version:
+            card = (version, render_to_string(template, {'post': post}))
+            rendered[card_key] = card
+        post.card_html = mark_safe(card[1])
+    if rendered:
+        cache.set_many(rendered, settings.FRAGMENT_CACHE_TIMEOUT)
+
+
+def bump(post_ids):
+    """Invalidate the cards of these posts once the current transaction commits."""
+    keys = {VERSION_KEY.format(pk) for pk in post_ids if pk is not None}
+    if keys:
+        transaction.on_commit(lambda: cache.set_many(dict.fromkeys(keys, time.time_ns()), None))
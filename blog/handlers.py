@@ -0,0 +1,41 @@
+"""
+Requests served inside the process, without a socket or ``django.test``.
+
+The static export renders pages through the full middleware stack and URLconf with
+``Handler``, and the query audit builds its views from ``get_request`` requests.
+"""
+import io
+from urllib.parse import unquote_to_bytes, urlsplit
+
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.wsgi import WSGIRequest
+
+
+def get_request(url, host='localhost', secure=False, **meta):
+    """A GET request for ``url`` (a path with an optional query string); ``meta`` adds to its META."""
+    parts = urlsplit(url)
+    return WSGIRequest({
+        'REQUEST_METHOD': 'GET',
+        # WSGI passes the path undecoded from percent-encoding but as latin-1
+        'PATH_INFO': unquote_to_bytes(parts.path or '/').decode('iso-8859-1'),
+        'QUERY_STRING': parts.query,
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '443' if secure else '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': host,
+        'wsgi.input': io.BytesIO(),
+        'wsgi.url_scheme': 'https' if secure else 'http',
+        **meta,
+    })
+
+
+class Handler(BaseHandler):
+    """
+    Runs requests through the middleware and views; errors come back as 500 responses.
+    Unlike the WSGI handler it sends no request_started/request_finished, so callers
+    manage their own connections.
+    """
+    def __init__(self):
+        super().__init__()
+        self.load_middleware()
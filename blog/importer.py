@@ -0,0 +1,340 @@
+"""
+Import of posts from a directory tree of Markdown files with front matter.
+
+A file starts with a block of ``key: value`` lines between ``---`` lines::
+
+    ---
+    title: Caching in Django
+    author: alice
+    category: Python
+    tags: django, caching
+    access: premium
+    status: published
+    date: 2024-03-01 09:30
+    image: images/cache.png
+    ---
+    The body, in Markdown.
+
+Only the title is required. ``slug`` may be given too; ``author`` falls back to the
+command's ``--author``, ``image`` is relative to the file, and ``tags`` may also be a
+``[a, b]`` list or ``- a`` lines.
+
+``manage.py import_markdown`` reads, hashes, parses and renders the files in chunks
+across processes; files whose hash matches their ImportedPost row are not even parsed.
+New posts are written with ``bulk_create`` in batches, with their tags, after looking
+categories, tags and authors up once for the whole run; unknown categories and tags
+are created. A changed file updates its post with a normal ``save()``, so it gets a
+revision like any edit. Bodies are rendered with the markdown package when it is
+installed, otherwise as plain paragraphs, headings and code blocks.
+"""
+import hashlib
+import html
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.files import File
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.text import slugify
+from taggit.models import Tag, TaggedItem
+
+from . import processes
+from .bulk import posts_created
+from .models import Category, ImportedPost, Post, User
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+EXTENSIONS = ('.md', '.markdown')
+CHUNK_SIZE = 50
+STATUSES = dict(Post.STATUS_CHOICES)
+ACCESS_LEVELS = dict(Post.ACCESS_LEVEL_CHOICES)
+
+
+def find_files(root):
+    """Paths of the Markdown files under ``root``, relative to it, sorted."""
+    found = []
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        found.extend(os.path.relpath(os.path.join(directory, name), root) for name in files if name.lower().endswith(EXTENSIONS))
+    return sorted(found)
+
+
+def split_front_matter(text):
+    """({key: value or list}, body) of a file's text."""
+    match = re.match(r'---[ \t]*\r?\n(.*?)\r?\n---[ \t]*(?:\r?\n|$)', text, re.S)
+    if not match:
+        return {}, text
+    meta, key = {}, None
+    for line in match.group(1).splitlines():
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        item = re.match(r'\s+-\s*(.*)', line)
+        if item and key:
+            meta[key] = (meta[key] if isinstance(meta[key], list) else []) + [unquote(item.group(1))]
+            continue
+        key, _, value = line.partition(':')
+        key, value = key.strip().lower(), value.strip()
+        if value.startswith('[') and value.endswith(']'):
+            value = [unquote(v) for v in value[1:-1].split(',') if v.strip()]
+        meta[key] = unquote(value) if isinstance(value, str) else value
+    return meta, text[match.end():]
+
+
+def unquote(value):
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1]
+    return value
+
+
+def render(text):
+    if markdown is not None:
+        return markdown.markdown(text, extensions=['extra'])
+    blocks = []
+    for block in re.split(r'\n\s*\n', text.strip()):
+        if block.startswith('```'):
+            code = block.split('\n', 1)[1] if '\n' in block else ''
+            blocks.append(f'<pre><code>{html.escape(code.rstrip().removesuffix("```").rstrip())}</code></pre>')
+        elif heading := re.match(r'(#{1,6})\s+(.*)', block):
+            level = len(heading.group(1))
+            blocks.append(f'<h{level}>{html.escape(heading.group(2).strip(" #"))}</h{level}>')
+        else:
+            blocks.append(f'<p>{html.escape(" ".join(block.split()))}</p>')
+    return '\n'.join(blocks)
+
+
+def parse_publish_date(value):
+    if not value:
+        return None
+    date = parse_datetime(value)
+    if date is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date {value!r}')
+        date = datetime.combine(day, time())
+    return timezone.make_aware(date) if timezone.is_naive(date) else date
+
+
+def tag_names(value):
+    names = value if isinstance(value, list) else value.split(',')
+    return list(dict.fromkeys(name.strip() for name in names if name.strip()))
+
+
+def parse(path, text):
+    """The post fields of the file at ``path``, as a dict; raises ValueError if it cannot be imported."""
+    meta, body = split_front_matter(text)
+    title = meta.get('title', '').strip()
+    if not title:
+        raise ValueError('No title in the front matter')
+    status = meta.get('status', 'published').lower()
+    access = meta.get('access', meta.get('access_level', 'free')).lower()
+    if status not in STATUSES or access not in ACCESS_LEVELS:
+        raise ValueError(f'Invalid status {status!r} or access level {access!r}')
+    image = meta.get('image')
+    return {
+        'title': title[:255],
+        'slug': slugify(meta.get('slug') or title)[:200] or 'post',
+        'author': meta.get('author', ''),
+        'category': meta.get('category', ''),
+        'tags': tag_names(meta.get('tags', [])),
+        'status': status,
+        'access_level': access,
+        'publish_date': parse_publish_date(meta.get('date') or meta.get('publish_date')),
+        'image': os.path.normpath(os.path.join(os.path.dirname(path), image)) if image else None,
+        'excerpt': meta.get('excerpt', ''),
+        'body': render(body),
+    }
+
+
+def read_files(root, files):
+    """
+    Read ``files``, (path, sha of the last import or None) pairs; returns (path, sha,
+    fields, error) for each changed file. Runs in the import processes.
+    """
+    results = []
+    for path, previous in files:
+        with open(os.path.join(root, path), 'rb') as f:
+            data = f.read()
+        sha = hashlib.sha256(data).hexdigest()
+        if sha == previous:
+            continue
+        try:
+            results.append((path, sha, parse(path, data.decode()), None))
+        except (ValueError, UnicodeDecodeError) as e:
+            results.append((path, sha, None, str(e)))
+    return results
+
+
+class Importer:
+    def __init__(self, root, author=None, batch_size=None, workers=None):
+        self.root = root
+        self.default_author = author
+        self.batch_size = batch_size or settings.MARKDOWN_IMPORT_BATCH_SIZE
+        self.workers = workers or settings.MARKDOWN_IMPORT_PROCESSES
+        self.stats = dict.fromkeys(('created', 'updated', 'unchanged', 'failed'), 0)
+        self.errors = []
+        self.warnings = []
+        self.taken_slugs = set()
+
+    def run(self):
+        """Import every file under the directory; returns the stats."""
+        paths = find_files(self.root)
+        imported = {path: (sha, post_id) for path, sha, post_id in ImportedPost.objects.values_list('path', 'sha', 'post_id')}
+        files = [(path, imported[path][0] if path in imported else None) for path in paths]
+        chunks = [files[i:i + CHUNK_SIZE] for i in range(0, len(files), CHUNK_SIZE)]
+        if self.workers > 1 and len(chunks) > 1:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(min(self.workers, len(chunks)), mp_context=context, initializer=processes.init) as pool:
+                results = [row for chunk in pool.map(processes.read_markdown, [self.root] * len(chunks), chunks) for row in chunk]
+        else:
+            results = [row for chunk in chunks for row in read_files(self.root, chunk)]
+        self.stats['unchanged'] = len(paths) - len(results)
+        rows = []
+        for path, sha, fields, error in results:
+            if error:
+                self.fail(path, error)
+            else:
+                rows.append((path, sha, fields))
+        self.load_lookups([fields for _, _, fields in rows])
+        new = []
+        for path, sha, fields in rows:
+            if path in imported:
+                self.update(imported[path][1], path, sha, fields)
+            else:
+                new.append((path, sha, fields))
+        for i in range(0, len(new), self.batch_size):
+            self.create(new[i:i + self.batch_size])
+        return self.stats
+
+    def fail(self, path, error):
+        self.stats['failed'] += 1
+        self.errors.append((path, error))
+
+    def load_lookups(self, rows):
+        """Map the authors, categories and tags the files name to ids, creating missing categories and tags."""
+        names = {row['author'] for row in rows} | {self.default_author}
+        self.authors = dict(User.objects.filter(username__in=names - {'', None}).values_list('username', 'pk'))
+        wanted = {row['category'] for row in rows} - {''}
+        self.categories = {}
+        for pk, name, slug in Category.objects.values_list('pk', 'name', 'slug'):
+            self.categories[name.lower()] = self.categories[slug] = pk
+        missing = {name.lower(): name for name in wanted if name.lower() not in self.categories and slugify(name) not in self.categories}
+        if missing:
+            Category.objects.bulk_create([Category(name=name, slug=slugify(name)) for name in missing.values()], ignore_conflicts=True)
+            for pk, name, slug in Category.objects.filter(name__in=missing.values()).values_list('pk', 'name', 'slug'):
+                self.categories[name.lower()] = self.categories[slug] = pk
+        tags = {name.lower(): name for row in rows for name in row['tags']}
+        # Tag names compare case-insensitively (TAGGIT_CASE_INSENSITIVE)
+        self.tags = dict(Tag.objects.annotate(key=Lower('name')).filter(key__in=tags).values_list('key', 'pk'))
+        missing = [name for key, name in tags.items() if key not in self.tags]
+        if missing:
+            taken = set(Tag.objects.filter(slug__in=[slugify(name) for name in missing]).values_list('slug', flat=True))
+            new = []
+            for name in missing:
+                slug = base = slugify(name) or 'tag'
+                n = 1
+                while slug in taken:
+                    slug = f'{base}_{n}'
+                    n += 1
+                taken.add(slug)
+                new.append(Tag(name=name, slug=slug))
+            Tag.objects.bulk_create(new, ignore_conflicts=True)
+            self.tags.update(Tag.objects.annotate(key=Lower('name')).filter(key__in=[n.lower() for n in missing]).values_list('key', 'pk'))
+
+    def resolve(self, path, fields):
+        """Post field values of a parsed file, or None when it names an unknown author or category."""
+        author = fields['author'] or self.default_author
+        if author not in self.authors:
+            self.fail(path, f'Unknown author {author!r}' if author else 'No author (pass --author)')
+            return None
+        category = fields['category']
+        category_id = (self.categories.get(category.lower()) or self.categories.get(slugify(category))) if category else None
+        if category and category_id is None:
+            self.fail(path, f'Could not create category {category!r}')
+            return None
+        values = {name: fields[name] for name in ('title', 'body', 'excerpt', 'status', 'access_level')}
+        values.update(author_id=self.authors[author], category_id=category_id)
+        if fields['publish_date']:
+            values['publish_date'] = fields['publish_date']
+        return values
+
+    def unique_slugs(self, wanted, exclude=None):
+        """{slug: free slug} for ``wanted`` slugs; post URLs are looked up by slug alone."""
+        stems = '|'.join(re.escape(slug) for slug in set(wanted))
+        taken = Post.objects.filter(slug__regex=rf'^({stems})(-[0-9]+)?$')
+        if exclude:
+            taken = taken.exclude(pk=exclude)
+        self.taken_slugs.update(taken.values_list('slug', flat=True))
+        result = []
+        for slug in wanted:
+            base, n = slug, 2
+            while slug in self.taken_slugs:
+                slug = f'{base}-{n}'
+                n += 1
+            self.taken_slugs.add(slug)
+            result.append(slug)
+        return result
+
+    def attach_image(self, post, image):
+        if not image:
+            return
+        source = os.path.join(self.root, image)
+        if not os.path.isfile(source):
+            self.warnings.append((image, 'Image not found'))
+            return
+        with open(source, 'rb') as f:
+            # Saves the file to storage under post_images/ without saving the post
+            post.featured_image.save(os.path.basename(image), File(f), save=False)
+
+    def create(self, batch):
+        resolved = [(path, sha, fields, self.resolve(path, fields)) for path, sha, fields in batch]
+        resolved = [row for row in resolved if row[3] is not None]
+        if not resolved:
+            return
+        slugs = self.unique_slugs([fields['slug'] for _, _, fields, _ in resolved])
+        posts = []
+        for (path, sha, fields, values), slug in zip(resolved, slugs):
+            post = Post(slug=slug, **values)
+            post.excerpt = post.get_excerpt()  # save() is bypassed by bulk_create
+            self.attach_image(post, fields['image'])
+            posts.append(post)
+        content_type = ContentType.objects.get_for_model(Post)
+        with transaction.atomic():
+            posts = Post.objects.bulk_create(posts)
+            TaggedItem.objects.bulk_create([
+                TaggedItem(content_type=content_type, object_id=post.pk, tag_id=self.tags[name.lower()])
+                for post, (_, _, fields, _) in zip(posts, resolved) for name in fields['tags']
+            ])
+            ImportedPost.objects.bulk_create([
+                ImportedPost(path=path, sha=sha, post=post) for post, (path, sha, _, _) in zip(posts, resolved)
+            ])
+            posts_created(posts)
+        self.stats['created'] += len(posts)
+
+    def update(self, post_id, path, sha, fields):
+        values = self.resolve(path, fields)
+        if values is None:
+            return
+        with transaction.atomic():
+            post = Post.objects.select_for_update().get(pk=post_id)
+            # A post keeps its slug, numbered or not, while the file asks for the same one
+            if not re.fullmatch(re.escape(fields['slug']) + r'(-[0-9]+)?', post.slug):
+                values['slug'] = self.unique_slugs([fields['slug']], exclude=post.pk)[0]
+            for name, value in values.items():
+                setattr(post, name, value)
+            self.attach_image(post, fields['image'])
+            post._editor = None
+            post.save()
+            post.tags.set(fields['tags'])
+            ImportedPost.objects.filter(path=path).update(sha=sha, imported_date=timezone.now())
+        self.stats['updated'] += 1
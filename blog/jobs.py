@@ -0,0 +1,222 @@
+"""
+A small job queue stored in the database, so no broker is needed.
+
+Functions decorated with ``@job`` are queued with ``enqueue()``, which inserts a Job row
+in the current transaction: the job exists if and only if the write that triggered it
+commits. ``manage.py worker`` claims due jobs in batches and runs them on a thread or
+process pool. A failed job is retried after an exponential backoff until it has used
+``max_attempts``; a job whose worker died is queued again once its lease expires.
+
+Claiming uses ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database supports it, so
+concurrent workers never wait on each other. Elsewhere (SQLite) a single conditional
+UPDATE stamps the candidates with a claim token; rows another worker took first are
+simply not updated.
+
+``@job(every=seconds)`` also runs the function periodically. Schedules are rows too,
+and each due run is claimed the same optimistic way, so any number of workers can run.
+"""
+import logging
+import multiprocessing
+import random
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import processes
+from .db import thread_connections
+from .models import Job, JobSchedule
+
+logger = logging.getLogger('blog.jobs')
+
+JOBS = {}
+
+
+def job(name=None, max_attempts=None, every=None):
+    """Register a function as a job; ``fn.enqueue(*args)`` queues it, ``fn.enqueue_many([args, ...])`` several."""
+    def register(fn):
+        fn.job_name = name or f'{fn.__module__}.{fn.__qualname__}'
+        fn.max_attempts = max_attempts or settings.JOB_MAX_ATTEMPTS
+        fn.every = every
+        fn.enqueue = lambda *args, **kwargs: enqueue(fn, *args, **kwargs)
+        fn.enqueue_many = lambda calls: enqueue_many(fn, calls)
+        JOBS[fn.job_name] = fn
+        return fn
+    return register
+
+
+def enqueue(fn, *args, run_at=None, **kwargs):
+    """Queue ``fn(*args, **kwargs)`` in the current transaction; arguments must be JSON-serializable."""
+    fn = JOBS[fn] if isinstance(fn, str) else fn
+    return Job.objects.create(
+        name=fn.job_name, args=list(args), kwargs=kwargs, max_attempts=fn.max_attempts,
+        run_at=run_at or timezone.now(),
+    )
+
+
+def enqueue_many(fn, calls):
+    """Queue one job per argument tuple in ``calls`` with a single INSERT."""
+    fn = JOBS[fn] if isinstance(fn, str) else fn
+    now = timezone.now()
+    return Job.objects.bulk_create([
+        Job(name=fn.job_name, args=list(args), kwargs={}, max_attempts=fn.max_attempts, run_at=now) for args in calls
+    ])
+
+
+def claim(worker_id, limit):
+    """Mark up to ``limit`` due jobs as running for ``worker_id`` and return their ids."""
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_at__lte=now).order_by('run_at', 'pk')
+    claimed = {'status': 'running', 'claimed_by': worker_id, 'claimed_at': now, 'attempts': F('attempts') + 1}
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(**claimed)
+        return ids
+    # Optimistic fallback: only rows still queued are stamped with our token
+    token = f'{worker_id}:{uuid.uuid4().hex[:8]}'
+    ids = list(due.values_list('pk', flat=True)[:limit])
+    if not ids or not Job.objects.filter(pk__in=ids, status='queued').update(**{**claimed, 'claimed_by': token}):
+        return []
+    return list(Job.objects.filter(pk__in=ids, claimed_by=token).values_list('pk', flat=True))
+
+
+def backoff(attempts):
+    """Seconds before retry number ``attempts``: JOB_RETRY_BACKOFF doubled per attempt, with jitter."""
+    return settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1) * random.uniform(0.75, 1.25)
+
+
+def run_job(job_id):
+    """Run one claimed job and record the outcome; returns the new status."""
+    job = Job.objects.get(pk=job_id)
+    fn = JOBS.get(job.name)
+    try:
+        if fn is None:
+            raise LookupError(f'Unknown job {job.name!r}')
+        fn(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s failed (attempt %s/%s)\n%s', job, job.attempts, job.max_attempts, error)
+        if fn is None or job.attempts >= job.max_attempts:
+            update = {'status': 'failed', 'finished_date': timezone.now()}
+        else:
+            update = {'status': 'queued', 'run_at': timezone.now() + timedelta(seconds=backoff(job.attempts))}
+        Job.objects.filter(pk=job.pk).update(last_error=error[-5000:], claimed_by='', **update)
+        return update['status']
+    Job.objects.filter(pk=job.pk).update(status='done', finished_date=timezone.now(), claimed_by='')
+    return 'done'
+
+
+def requeue_expired():
+    """Queue jobs again whose worker stopped without finishing them within JOB_LEASE_SECONDS."""
+    expired = timezone.now() - timedelta(seconds=settings.JOB_LEASE_SECONDS)
+    running = Job.objects.filter(status='running', claimed_at__lt=expired)
+    failed = running.filter(attempts__gte=F('max_attempts')).update(status='failed', last_error='Lease expired', claimed_by='')
+    return failed + running.update(status='queued', claimed_by='')
+
+
+def sync_schedules():
+    """Create a JobSchedule for every ``@job(every=...)``; intervals follow the code."""
+    for name, fn in JOBS.items():
+        if fn.every:
+            JobSchedule.objects.update_or_create(name=name, defaults={'interval': int(fn.every)})
+
+
+def enqueue_due_schedules():
+    now = timezone.now()
+    count = 0
+    for schedule in JobSchedule.objects.filter(enabled=True, next_run_at__lte=now, name__in=list(JOBS)):
+        with transaction.atomic():
+            # Whoever moves next_run_at first owns this run
+            moved = JobSchedule.objects.filter(pk=schedule.pk, next_run_at=schedule.next_run_at).update(
+                next_run_at=now + timedelta(seconds=schedule.interval), last_run_at=now,
+            )
+            if moved:
+                enqueue(schedule.name)
+                count += 1
+    return count
+
+
+def run_pending(worker_id='inline', limit=100):
+    """Claim and run due jobs in this thread until none are left; for tests and one-off drains."""
+    ran = 0
+    while ids := claim(worker_id, limit):
+        for job_id in ids:
+            run_job(job_id)
+        ran += len(ids)
+    return ran
+
+
+@job(every=3600)
+def prune_jobs():
+    """Delete finished jobs older than JOB_RETENTION_DAYS; failed ones are kept for inspection."""
+    cutoff = timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS)
+    Job.objects.filter(status='done', finished_date__lt=cutoff).delete()
+
+
+@job()
+def noop():
+    """Does nothing; for benchmarks and checking that a worker is running."""
+
+
+@thread_connections
+def run_claimed(job_id):
+    # Pool threads outlive their jobs, so each job gets the connection handling of a
+    # request: reused within DB_CONN_MAX_AGE or the pool, dropped once unusable
+    return run_job(job_id)
+
+
+class Worker:
+    def __init__(self, concurrency=None, pool=None, batch_size=None, poll_interval=None):
+        self.concurrency = concurrency or settings.JOB_CONCURRENCY
+        self.pool = pool or settings.JOB_POOL
+        self.batch_size = batch_size or settings.JOB_BATCH_SIZE
+        self.poll_interval = poll_interval if poll_interval is not None else settings.JOB_POLL_INTERVAL
+        self.id = f'{socket.gethostname()}:{uuid.uuid4().hex[:8]}'
+        self.stopping = False
+        self.processed = 0
+
+    def executor(self):
+        if self.pool == 'process':
+            # spawn: children never share the parent's database connections
+            return ProcessPoolExecutor(self.concurrency, mp_context=multiprocessing.get_context('spawn'), initializer=processes.init)
+        return ThreadPoolExecutor(self.concurrency, thread_name_prefix='job')
+
+    def run(self, once=False):
+        """Work until ``stop()`` is called, or with ``once`` until the queue is empty."""
+        sync_schedules()
+        in_flight = set()
+        housekeeping = 0.0
+        task = processes.run_job if self.pool == 'process' else run_claimed
+        with self.executor() as pool:
+            while not self.stopping:
+                if time.monotonic() - housekeeping > self.poll_interval:
+                    requeue_expired()
+                    enqueue_due_schedules()
+                    housekeeping = time.monotonic()
+                # Keep at most two jobs per pool slot claimed, so others can take the rest
+                room = min(self.batch_size, 2 * self.concurrency - len(in_flight))
+                ids = claim(self.id, room) if room > 0 else []
+                in_flight.update(pool.submit(task, job_id) for job_id in ids)
+                if in_flight:
+                    done, in_flight = wait(in_flight, timeout=0 if ids else self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception():
+                            # The job stays running until its lease expires and is retried then
+                            logger.error('Worker could not record a job result', exc_info=future.exception())
+                    self.processed += len(done)
+                elif once:
+                    break
+                else:
+                    close_old_connections()
+                    time.sleep(self.poll_interval)
+
+    def stop(self, *args):
+        self.stopping = True
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from blog.query_audit import audit_querysets, find_problems
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the querysets the views build and flag full scans and unindexed sorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sql', action='store_true', help='Print the SQL of each query')
+        parser.add_argument('--analyze', action='store_true', help='Refresh planner statistics (ANALYZE) first')
+        parser.add_argument('--fail', action='store_true', help='Exit with an error if any query is flagged')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'Unsupported database backend: {connection.vendor}')
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        flagged = 0
+        for label, qs in audit_querysets():
+            plan = qs.explain()
+            problems = find_problems(plan)
+            status = self.style.WARNING('FLAGGED') if problems else self.style.SUCCESS('ok')
+            self.stdout.write(f'\n== {label} [{status}]')
+            if options['sql']:
+                self.stdout.write(str(qs.query))
+            self.stdout.write(plan)
+            for problem in problems:
+                self.stdout.write(self.style.WARNING(f'  ! {problem}'))
+            flagged += bool(problems)
+
+        self.stdout.write(f'\n{flagged} flagged quer{"y" if flagged == 1 else "ies"}.')
+        if flagged and options['fail']:
+            raise CommandError('Query plan audit failed')
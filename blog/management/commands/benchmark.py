@@ -0,0 +1,109 @@
+import json
+import os
+import platform
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from blog import benchmarks
+from blog.models import Post, Comment, Like, Bookmark, User
+
+
+class Command(BaseCommand):
+    help = 'Measure throughput and p50/p95/p99 latency of the main views and compare against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Scenarios to run (default: all HTTP scenarios)')
+        parser.add_argument('--list', action='store_true', help='List available scenarios and exit')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, default=1, help='Client threads per scenario')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write JSON results here (default: benchmarks/results-<timestamp>.json)')
+        parser.add_argument('--baseline', default=os.path.join('benchmarks', 'baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression (0.2 = 20%%)')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, fn in benchmarks.SCENARIOS.items():
+                self.stdout.write(f'{name:<24} {fn.benchmark_group}')
+            return
+
+        names = options['scenarios'] or [n for n, fn in benchmarks.SCENARIOS.items() if fn.benchmark_group == 'http']
+        unknown = set(names) - set(benchmarks.SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+        if settings.DEBUG:
+            self.stderr.write(self.style.WARNING('DEBUG is on; query logging will skew results.'))
+
+        try:
+            ctx = benchmarks.BenchmarkContext(seed=options['seed'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        results = {}
+        self.stdout.write(f'{"scenario":<24}{"rps":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errors":>8}{"conns":>8}')
+        with override_settings(**benchmarks.RUN_SETTINGS):
+            for name in names:
+                stats = benchmarks.run_scenario(
+                    ctx, name, options['iterations'], warmup=options['warmup'], concurrency=options['concurrency'],
+                )
+                results[name] = stats
+                self.stdout.write(
+                    f'{name:<24}{stats["throughput_rps"]:>10.1f}{stats["p50_ms"]:>10.2f}'
+                    f'{stats["p95_ms"]:>10.2f}{stats["p99_ms"]:>10.2f}{stats["errors"]:>8}{stats["db_connections"]:>8}'
+                )
+
+        report = {'meta': self.metadata(options), 'results': results}
+        output = options['output'] or os.path.join('benchmarks', f'results-{datetime.now():%Y%m%d-%H%M%S}.json')
+        self.write_json(output, report)
+        self.stdout.write(f'Results written to {output}')
+
+        if options['save_baseline']:
+            self.write_json(options['baseline'], report)
+            self.stdout.write(self.style.SUCCESS(f'Baseline saved to {options["baseline"]}'))
+            return
+
+        if os.path.exists(options['baseline']):
+            self.compare(results, options)
+
+    def compare(self, results, options):
+        with open(options['baseline']) as fh:
+            baseline = json.load(fh)['results']
+        rows = benchmarks.compare(results, baseline, options['tolerance'])
+        regressions = [r for r in rows if r[5]]
+        self.stdout.write(f'\nCompared with {options["baseline"]}:')
+        for name, metric, old, new, change, regressed in rows:
+            line = f'  {name:<24}{metric:<16}{old:>10.2f} -> {new:>10.2f}  {change:+7.1%}'
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{len(regressions)} regression(s) beyond {options["tolerance"]:.0%}')
+
+    def metadata(self, options):
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'concurrency': options['concurrency'],
+            'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+            'db_pool': bool(connection.settings_dict.get('OPTIONS', {}).get('pool')),
+            'rows': {
+                'users': User.objects.count(),
+                'posts': Post.objects.count(),
+                'comments': Comment.objects.count(),
+                'likes': Like.objects.count(),
+                'bookmarks': Bookmark.objects.count(),
+            },
+        }
+
+    def write_json(self, path, data):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fh:
+            json.dump(data, fh, indent=2)
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from blog import analytics
+
+
+class Command(BaseCommand):
+    help = 'Fold old hourly analytics buckets into daily ones (the worker also does this hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ANALYTICS_HOURLY_DAYS, help='Days of hourly buckets to keep')
+
+    def handle(self, *args, **options):
+        cutoff = analytics.day_of(timezone.now()) - timedelta(days=options['days'])
+        folded = analytics.compact(cutoff)
+        self.stdout.write(self.style.SUCCESS(f'Folded {folded} hourly buckets into daily ones.'))
@@ -3,14 +3,20 @@ from django.contrib.auth import get_user_model
 import os
 
 
+def credentials():
+    return (
+        os.environ.get('DJANGO_SUPERUSER_EMAIL', 'admin@example.com'),
+        os.environ.get('DJANGO_SUPERUSER_USERNAME', 'admin'),
+        os.environ.get('DJANGO_SUPERUSER_PASSWORD', 'admin123'),
+    )
+
+
 class Command(BaseCommand):
     help = 'Create or update a superuser from environment variables'
 
     def handle(self, *args, **options):
         User = get_user_model()
-        email = os.environ.get('DJANGO_SUPERUSER_EMAIL', 'admin@example.com')
-        username = os.environ.get('DJANGO_SUPERUSER_USERNAME', 'admin')
-        password = os.environ.get('DJANGO_SUPERUSER_PASSWORD', 'admin123')
+        email, username, password = credentials()
 
         user, created = User.objects.get_or_create(
             email=email,
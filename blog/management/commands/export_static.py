@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import export
+
+
+class Command(BaseCommand):
+    help = 'Render every public page into STATIC_EXPORT_DIR, rewriting only pages that changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, help='Render processes (default: STATIC_EXPORT_PROCESSES)')
+
+    def handle(self, *args, **options):
+        if not settings.STATIC_EXPORT_DIR:
+            raise CommandError('Set STATIC_EXPORT_DIR to export.')
+        started = time.perf_counter()
+        stats = export.build(workers=options['processes'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {stats["rendered"]} pages in {time.perf_counter() - started:.1f}s: '
+            f'{stats["written"]} written, {stats["removed"]} removed, {stats["failed"]} failed.'
+        ))
+        if not export.brotli:
+            self.stdout.write('Install the brotli package to also write .br files.')
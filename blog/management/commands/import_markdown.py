@@ -0,0 +1,36 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import importer
+
+
+class Command(BaseCommand):
+    help = 'Import posts from a directory of Markdown files with front matter, skipping files unchanged since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--author', help='Username for files whose front matter names no author')
+        parser.add_argument('--processes', type=int, help='Parse processes (default: MARKDOWN_IMPORT_PROCESSES)')
+        parser.add_argument('--batch-size', type=int, help='Posts per INSERT (default: MARKDOWN_IMPORT_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['directory']):
+            raise CommandError(f'{options["directory"]} is not a directory.')
+        started = time.perf_counter()
+        run = importer.Importer(
+            options['directory'], author=options['author'], batch_size=options['batch_size'], workers=options['processes'],
+        )
+        stats = run.run()
+        for path, message in run.errors:
+            self.stderr.write(f'{path}: {message}')
+        for path, message in run.warnings:
+            self.stdout.write(self.style.WARNING(f'{path}: {message}'))
+        style = self.style.ERROR if stats['failed'] else self.style.SUCCESS
+        self.stdout.write(style(
+            f'Imported in {time.perf_counter() - started:.1f}s: {stats["created"]} created, {stats["updated"]} updated, '
+            f'{stats["unchanged"]} unchanged, {stats["failed"]} failed.'
+        ))
+        if not importer.markdown:
+            self.stdout.write('Install the markdown package for full Markdown; bodies were rendered as plain paragraphs.')
@@ -24,6 +24,9 @@ class Command(BaseCommand):
             self.stdout.write(f'Loading data from {fixture}...')
             try:
                 call_command('loaddata', fixture, verbosity=2)
+                # Fixture rows are saved raw, which the tag index and archive signals ignore
+                call_command('rebuild_tag_index')
+                call_command('rebuild_archive')
                 self.stdout.write(self.style.SUCCESS('Data loaded successfully!'))
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f'Error loading data: {e}'))
@@ -0,0 +1,102 @@
+import hashlib
+import hmac
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+from blog.models import DeploymentMarker, Post
+from .create_superuser_if_none import credentials
+
+# Data before the superuser: the fixture's user rows would overwrite a new superuser
+STEPS = ('migrate', 'static', 'data', 'superuser')
+STATIC_MARKER = '.prepare-fingerprint'
+
+
+def static_fingerprint():
+    """Hash of the name, size and mtime of every file collectstatic would copy, and the storage backend."""
+    digest = hashlib.sha256(settings.STORAGES['staticfiles']['BACKEND'].encode())
+    entries = []
+    for finder in get_finders():
+        for path, storage in finder.list(['CVS', '.*', '*~']):
+            stat = os.stat(storage.path(path))
+            entries.append(f'{getattr(storage, "prefix", None) or ""}/{path}\0{stat.st_size}\0{stat.st_mtime_ns}')
+    for entry in sorted(entries):
+        digest.update(entry.encode() + b'\n')
+    return digest.hexdigest()
+
+
+def superuser_fingerprint(user, username, password):
+    # Keyed, so the marker reveals nothing about the password; covers the stored hash too,
+    # so a password changed in the admin is reset on the next start as before
+    message = '\0'.join([username, password, user.username, user.password, str(user.is_staff), str(user.is_superuser)])
+    return hmac.new(settings.SECRET_KEY.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        'Get the app ready to serve in one process: migrate, collect static files, create the '
+        'superuser and load initial data, skipping each step whose work is already done'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', default=','.join(STEPS), help=f'Comma-separated subset of {", ".join(STEPS)}')
+        parser.add_argument('--force', action='store_true', help='Run migrate, static and superuser even when unchanged')
+
+    def handle(self, *args, **options):
+        steps = [step.strip() for step in options['steps'].split(',') if step.strip()]
+        unknown = set(steps) - set(STEPS)
+        if unknown:
+            raise CommandError(f'Unknown steps: {", ".join(sorted(unknown))}')
+        self.force = options['force']
+        self.verbosity = max(0, options['verbosity'] - 1)
+        started = time.perf_counter()
+        for step in steps:
+            step_started = time.perf_counter()
+            outcome = getattr(self, step)()
+            self.stdout.write(f'{step:<10} {outcome:<8} {(time.perf_counter() - step_started) * 1000:8.1f} ms')
+        self.stdout.write(self.style.SUCCESS(f'Prepared in {(time.perf_counter() - started) * 1000:.1f} ms'))
+
+    def migrate(self):
+        executor = MigrationExecutor(connections[DEFAULT_DB_ALIAS])
+        if not self.force and not executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            return 'skipped'
+        call_command('migrate', interactive=False, verbosity=self.verbosity, stdout=self.stdout)
+        return 'done'
+
+    def static(self):
+        marker = os.path.join(settings.STATIC_ROOT, STATIC_MARKER)
+        fingerprint = static_fingerprint()
+        if not self.force and os.path.exists(marker):
+            with open(marker) as f:
+                if f.read() == fingerprint:
+                    return 'skipped'
+        call_command('collectstatic', interactive=False, verbosity=self.verbosity, stdout=self.stdout)
+        # Written last: an interrupted collectstatic runs again on the next start
+        with open(marker, 'w') as f:
+            f.write(fingerprint)
+        return 'done'
+
+    def superuser(self):
+        email, username, password = credentials()
+        user = get_user_model().objects.filter(email=email).first()
+        marker = DeploymentMarker.objects.filter(name='superuser').values_list('value', flat=True).first()
+        if not self.force and user is not None and hmac.compare_digest(marker or '', superuser_fingerprint(user, username, password)):
+            return 'skipped'
+        call_command('create_superuser_if_none', verbosity=self.verbosity, stdout=self.stdout)
+        user = get_user_model().objects.get(email=email)
+        DeploymentMarker.objects.update_or_create(name='superuser', defaults={'value': superuser_fingerprint(user, username, password)})
+        return 'done'
+
+    def data(self):
+        # Never forced: reloading the fixture would overwrite live content
+        if Post.objects.exists():
+            return 'skipped'
+        call_command('load_initial_data', verbosity=self.verbosity, stdout=self.stdout)
+        return 'done'
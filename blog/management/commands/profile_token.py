@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core import signing
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Print a signed X-Profile-Token header value that enables request profiling'
+
+    def handle(self, *args, **options):
+        token = signing.TimestampSigner(salt='blog.profiling').sign('profile')
+        self.stdout.write(token)
+        self.stderr.write(f'Valid for {settings.PROFILE_TOKEN_MAX_AGE} seconds. Send as "X-Profile-Token: {token}".')
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from blog import revisions
+from blog.models import PostRevision
+
+
+class Command(BaseCommand):
+    help = 'Drop all but the newest revisions of each post and re-encode the rest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=settings.REVISION_KEEP, help='Revisions kept per post (0 keeps all)')
+        parser.add_argument('--post', help='Only this post (slug)')
+        parser.add_argument('--compact', action='store_true', help='Re-encode every post, e.g. after changing REVISION_SNAPSHOT_INTERVAL')
+
+    def handle(self, *args, **options):
+        keep = options['keep']
+        posts = PostRevision.objects.values('post').annotate(n=Count('pk')).order_by('post')
+        if options['post']:
+            posts = posts.filter(post__slug=options['post'])
+        if keep and not (options['compact'] or options['post']):
+            posts = posts.filter(n__gt=keep)
+        deleted = rewritten = 0
+        post_ids = list(posts.values_list('post', flat=True))
+        for post_id in post_ids:
+            d, r = revisions.compact(post_id, keep or None)
+            deleted += d
+            rewritten += r
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(post_ids)} posts: {deleted} revisions deleted, {rewritten} re-encoded.'
+        ))
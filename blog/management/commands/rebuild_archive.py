@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog import archive
+
+
+class Command(BaseCommand):
+    help = 'Recount the published posts of every month for the date archive'
+
+    def handle(self, *args, **options):
+        months = archive.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Counted posts in {months} months.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog import tagindex
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the tag -> post index and per-tag counts from the taggit tables'
+
+    def handle(self, *args, **options):
+        rows = tagindex.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {rows} post/tag pairs.'))
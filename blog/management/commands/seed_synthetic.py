@@ -0,0 +1,185 @@
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from taggit.models import Tag, TaggedItem
+
+from blog import archive, tagindex
+from blog.models import User, Profile, Category, Post, Comment, Like, Bookmark
+
+WORDS = (
+    'django python cache query index latency request template render async channel socket worker queue '
+    'design deploy cloud docker mobile layout career focus model train vector search feature release '
+    'the a of and to in is for on with that this it as are be by from at or an was have not'
+).split()
+
+
+class Command(BaseCommand):
+    help = 'Bulk-create synthetic users, posts, comments, likes and bookmarks for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--authors', type=int, default=100, help='How many of the new users are authors')
+        parser.add_argument('--categories', type=int, default=0, help='Extra categories on top of the seeded ones')
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--likes', type=int, default=100000)
+        parser.add_argument('--bookmarks', type=int, default=20000)
+        parser.add_argument('--words', type=int, default=300, help='Average words per post body')
+        parser.add_argument('--days', type=int, default=730, help='Spread publish dates over this many days')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='bench', help='Prefix for generated usernames, tags and slugs')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix']
+        self.now = timezone.now()
+
+        self.step('users', self.create_users, options['users'], options['authors'])
+        self.step('categories', self.create_categories, options['categories'])
+        self.step('tags', self.create_tags, options['tags'])
+        self.step('posts', self.create_posts, options['posts'], options['words'], options['days'])
+        self.step('comments', self.create_comments, options['comments'])
+        self.step('likes', self.create_pairs, Like, options['likes'])
+        self.step('bookmarks', self.create_pairs, Bookmark, options['bookmarks'])
+        # bulk_create skips the signals that maintain the tag index and the archive counts
+        self.step('tag index', tagindex.rebuild)
+        self.step('archive', archive.rebuild)
+
+    def step(self, label, fn, *args):
+        start = time.perf_counter()
+        created = fn(*args)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'{label:<10} {created:>10,} rows in {elapsed:7.2f}s')
+
+    def batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def create_users(self, count, authors):
+        start = User.objects.filter(username__startswith=f'{self.prefix}_user_').count()
+        password = make_password('benchmark')  # hash once, not per user
+        rows = (
+            User(
+                username=f'{self.prefix}_user_{i}', email=f'{self.prefix}_user_{i}@example.com',
+                password=password, role='author' if i - start < authors else 'reader',
+            )
+            for i in range(start, start + count)
+        )
+        created = 0
+        for batch in self.batches(rows):
+            with transaction.atomic():
+                users = User.objects.bulk_create(batch)
+                # bulk_create skips post_save, so profiles are created here
+                Profile.objects.bulk_create([Profile(user=u) for u in users])
+            created += len(users)
+        self.user_ids = list(User.objects.values_list('pk', flat=True))
+        self.author_ids = list(User.objects.filter(role='author').values_list('pk', flat=True)) or self.user_ids
+        return created
+
+    def create_categories(self, count):
+        start = Category.objects.count()
+        Category.objects.bulk_create([
+            Category(name=f'{self.prefix.title()} Category {i}', slug=f'{self.prefix}-category-{i}')
+            for i in range(start, start + count)
+        ], ignore_conflicts=True)
+        self.category_ids = list(Category.objects.values_list('pk', flat=True))
+        return count
+
+    def create_tags(self, count):
+        Tag.objects.bulk_create([
+            Tag(name=f'{self.prefix}{i}', slug=f'{self.prefix}{i}') for i in range(count)
+        ], ignore_conflicts=True)
+        self.tag_ids = list(Tag.objects.filter(name__startswith=self.prefix).values_list('pk', flat=True))
+        return count
+
+    def make_body(self, words):
+        n = max(20, int(self.rng.gauss(words, words / 3)))
+        text = ' '.join(self.rng.choices(WORDS, k=n))
+        return f'<p>{text}</p>'
+
+    def create_posts(self, count, words, days):
+        start = Post.objects.filter(slug__startswith=f'{self.prefix}-post-').count()
+        content_type = ContentType.objects.get_for_model(Post)
+        rows = (self.make_post(i, words, days) for i in range(start, start + count))
+        created = 0
+        for batch in self.batches(rows):
+            with transaction.atomic():
+                posts = Post.objects.bulk_create(batch)
+                TaggedItem.objects.bulk_create([
+                    TaggedItem(content_type=content_type, object_id=post.pk, tag_id=tag_id)
+                    for post in posts
+                    for tag_id in self.rng.sample(self.tag_ids, min(len(self.tag_ids), self.rng.randint(1, 4)))
+                ])
+            created += len(posts)
+        self.post_ids = list(Post.objects.values_list('pk', flat=True))
+        return created
+
+    def make_post(self, i, words, days):
+        title = ' '.join(self.rng.choices(WORDS, k=6)).title()
+        body = self.make_body(words)
+        post = Post(
+            title=title,
+            slug=f'{self.prefix}-post-{i}',
+            author_id=self.rng.choice(self.author_ids),
+            body=body,
+            category_id=self.rng.choice(self.category_ids) if self.category_ids else None,
+            publish_date=self.now - timedelta(seconds=self.rng.randint(0, days * 86400)),
+            status='published' if self.rng.random() < 0.9 else 'draft',
+            access_level='premium' if self.rng.random() < 0.2 else 'free',
+            view_count=int(self.rng.paretovariate(1.5) * 10),
+        )
+        post.excerpt = post.get_excerpt()  # save() is bypassed by bulk_create
+        return post
+
+    def create_comments(self, count):
+        if not self.post_ids:
+            return 0
+        created = 0
+        recent = []
+        for batch_start in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - batch_start)
+            batch = []
+            for _ in range(size):
+                parent = self.rng.choice(recent) if recent and self.rng.random() < 0.1 else None
+                batch.append(Comment(
+                    post_id=parent[1] if parent else self.rng.choice(self.post_ids),
+                    author_id=self.rng.choice(self.user_ids),
+                    body=' '.join(self.rng.choices(WORDS, k=self.rng.randint(5, 40))),
+                    parent_id=parent[0] if parent else None,
+                ))
+            with transaction.atomic():
+                comments = Comment.objects.bulk_create(batch)
+            recent = [(c.pk, c.post_id) for c in comments[-500:]]
+            created += len(comments)
+        return created
+
+    def create_pairs(self, model, count):
+        if not self.post_ids:
+            return 0
+        before = model.objects.count()
+        # Skew towards popular posts; duplicates are dropped by the unique constraint
+        cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(self.post_ids))))
+        for batch_start in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - batch_start)
+            posts = self.rng.choices(self.post_ids, cum_weights=cum_weights, k=size)
+            with transaction.atomic():
+                model.objects.bulk_create([
+                    model(post_id=post_id, user_id=self.rng.choice(self.user_ids)) for post_id in posts
+                ], ignore_conflicts=True)
+        return model.objects.count() - before
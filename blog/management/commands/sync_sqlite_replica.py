@@ -0,0 +1,39 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Copy the SQLite primary into the SQLite replicas (for trying DATABASE_REPLICA_URLS locally)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Keep copying every N seconds (simulates replication lag)')
+
+    def handle(self, *args, **options):
+        primary = connections['default'].settings_dict
+        targets = [connections[alias].settings_dict for alias in settings.DATABASE_REPLICAS]
+        if not targets:
+            raise CommandError('No replicas configured; set DATABASE_REPLICA_URLS.')
+        if any(db['ENGINE'] != 'django.db.backends.sqlite3' for db in [primary, *targets]):
+            raise CommandError('Only SQLite primaries and replicas can be synced this way.')
+
+        while True:
+            start = time.perf_counter()
+            source = sqlite3.connect(primary['NAME'])
+            try:
+                for target in targets:
+                    # The backup API takes a consistent snapshot even while the primary is written to
+                    dest = sqlite3.connect(target['NAME'])
+                    try:
+                        source.backup(dest)
+                    finally:
+                        dest.close()
+            finally:
+                source.close()
+            self.stdout.write(f'Synced {len(targets)} replica(s) in {(time.perf_counter() - start) * 1000:.0f} ms')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
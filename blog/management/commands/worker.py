@@ -0,0 +1,28 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from blog import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs and periodic schedules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='Jobs run at once (default: JOB_CONCURRENCY)')
+        parser.add_argument('--pool', choices=['thread', 'process'], help='Run jobs in threads or processes (default: JOB_POOL)')
+        parser.add_argument('--batch-size', type=int, help='Jobs claimed per query (default: JOB_BATCH_SIZE)')
+        parser.add_argument('--poll-interval', type=float, help='Seconds to wait when the queue is empty (default: JOB_POLL_INTERVAL)')
+        parser.add_argument('--once', action='store_true', help='Exit when no jobs are due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        worker = jobs.Worker(
+            concurrency=options['concurrency'], pool=options['pool'],
+            batch_size=options['batch_size'], poll_interval=options['poll_interval'],
+        )
+        # Finish the jobs in hand on SIGTERM/SIGINT, then exit
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        self.stdout.write(f'Worker {worker.id}: {worker.concurrency} {worker.pool}(s), jobs: {", ".join(sorted(jobs.JOBS))}')
+        worker.run(once=options['once'])
+        self.stdout.write(f'Worker {worker.id} stopped after {worker.processed} job(s)')
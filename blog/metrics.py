@@ -0,0 +1,277 @@
+"""
+Minimal Prometheus-style instrumentation.
+
+Each process keeps its metrics in memory. When ``METRICS_DIR`` is set, every
+process also writes a snapshot of its values to ``<METRICS_DIR>/<pid>.json`` (at
+most once per ``METRICS_WRITE_INTERVAL`` seconds) and the ``/metrics`` endpoint
+merges all snapshots: counters and histograms are summed across every process
+that ever wrote one, gauges only across processes that are still alive. Point
+``METRICS_DIR`` at a directory that is emptied on container start.
+"""
+import atexit
+import json
+import math
+import os
+import threading
+import time
+import weakref
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        registry.changed()
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if value:
+                self._values[key] = value
+            else:
+                self._values.pop(key, None)
+        registry.changed()
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            value = self._values.get(key, 0) + amount
+            if value:
+                self._values[key] = value
+            else:
+                # Drop children that fall back to zero so per-post labels don't pile up
+                self._values.pop(key, None)
+        registry.changed()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, n + 1)
+        registry.changed()
+
+    def samples(self):
+        with self._lock:
+            return [[list(k), [list(c), s, n]] for k, (c, s, n) in self._values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self._dirty = False
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def add_collector(self, fn):
+        """Register a callable run before every snapshot, e.g. to refresh gauges."""
+        self.collectors.append(fn)
+        return fn
+
+    def changed(self):
+        self._dirty = True
+        if self._writer is None and getattr(settings, 'METRICS_DIR', ''):
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name='metrics-writer', daemon=True)
+                    self._writer.start()
+                    atexit.register(self.write_snapshot)
+
+    def snapshot(self):
+        for fn in self.collectors:
+            fn()
+        return {
+            name: {
+                'kind': m.kind,
+                'help': m.documentation,
+                'labels': list(m.labelnames),
+                'buckets': [str(b) for b in getattr(m, 'buckets', ())],
+                'samples': m.samples(),
+            }
+            for name, m in self.metrics.items()
+        }
+
+    def write_snapshot(self):
+        directory = getattr(settings, 'METRICS_DIR', '')
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(tmp, path)
+
+    def _write_loop(self):
+        while True:
+            time.sleep(getattr(settings, 'METRICS_WRITE_INTERVAL', 1.0))
+            if self._dirty:
+                self._dirty = False
+                try:
+                    self.write_snapshot()
+                except OSError:
+                    self._dirty = True
+
+
+registry = Registry()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """Return this process's snapshot merged with those written by other workers."""
+    snapshots = [(os.getpid(), registry.snapshot())]
+    directory = getattr(settings, 'METRICS_DIR', '')
+    if directory and os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.json'):
+                continue
+            pid = int(entry.name[:-5]) if entry.name[:-5].isdigit() else None
+            if pid is None or pid == os.getpid():
+                continue
+            try:
+                with open(entry.path) as fh:
+                    snapshots.append((pid, json.load(fh)))
+            except (OSError, ValueError):
+                continue
+
+    merged = {}
+    for pid, snap in snapshots:
+        alive = pid == os.getpid() or _pid_alive(pid)
+        for name, data in snap.items():
+            target = merged.setdefault(name, dict(data, samples={}))
+            if data['kind'] == 'gauge' and not alive:
+                continue
+            for labels, value in data['samples']:
+                key = tuple(labels)
+                if data['kind'] == 'histogram':
+                    counts, total, n = target['samples'].get(key) or ([0] * len(value[0]), 0.0, 0)
+                    target['samples'][key] = ([a + b for a, b in zip(counts, value[0])], total + value[1], n + value[2])
+                else:
+                    target['samples'][key] = target['samples'].get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_text():
+    """Render all metrics in the Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for name, data in sorted(collect().items()):
+        lines.append(f'# HELP {name} {data["help"]}')
+        lines.append(f'# TYPE {name} {data["kind"]}')
+        for key, value in sorted(data['samples'].items()):
+            if data['kind'] == 'histogram':
+                counts, total, n = value
+                cumulative = 0
+                for bound, count in zip(data['buckets'], counts):
+                    cumulative += count
+                    le = '+Inf' if bound == 'inf' else bound
+                    lines.append(f'{name}_bucket{_labels(data["labels"], key, [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(data["labels"], key)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(data["labels"], key)} {n}')
+            else:
+                lines.append(f'{name}{_labels(data["labels"], key)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- Application metrics -----------------------------------------------------
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by view, method and status.', ('view', 'method', 'status'))
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency by view.', ('view',))
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests currently being served.')
+COMMENT_SOCKETS = Gauge('comment_websocket_connections', 'Open CommentConsumer connections per post.', ('post',))
+GROUP_SENDS = Counter('channel_group_send_total', 'Channel layer group_send calls by source and outcome.', ('source', 'outcome'))
+RATE_LIMITED = Counter('http_rate_limited_total', 'Requests answered 429 by the rate limiter, by view.', ('view',))
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by backend and result.', ('backend', 'result'))
+DB_CONNECTIONS_CREATED = Counter('db_connections_created_total', 'Database connections opened.', ('alias',))
+DB_CONNECTIONS_OPEN = Gauge('db_connections_open', 'Database connections currently open.', ('alias',))
+
+
+_tracked_connections = weakref.WeakSet()
+
+
+def track_connection(connection):
+    """Called from the connection_created signal for every new DB connection."""
+    DB_CONNECTIONS_CREATED.inc(alias=connection.alias)
+    _tracked_connections.add(connection)
+
+
+@registry.add_collector
+def _collect_db_connections():
+    # Connection wrappers are thread-local, so count the live ones across all threads
+    open_by_alias = {}
+    for conn in list(_tracked_connections):
+        if conn.connection is not None:
+            open_by_alias[conn.alias] = open_by_alias.get(conn.alias, 0) + 1
+    with DB_CONNECTIONS_OPEN._lock:
+        DB_CONNECTIONS_OPEN._values = {(alias,): n for alias, n in open_by_alias.items()}
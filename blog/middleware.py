@@ -1,6 +1,25 @@
+import cProfile
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
 from datetime import date
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.http import JsonResponse
+from django.shortcuts import render
 from django.utils.deprecation import MiddlewareMixin
+from . import metrics, ratelimit
 from .models import Profile
+from .profiling import save_profile
+from .routers import replicas, start_replica_reads, stop_replica_reads
+from .stats import record_request
+
+perf_logger = logging.getLogger('blog.perf')
+
 
 class SubscriptionMiddleware(MiddlewareMixin):
     def process_request(self, request):
@@ -14,4 +33,207 @@ class SubscriptionMiddleware(MiddlewareMixin):
                 (profile.subscription_end_date is None or profile.subscription_end_date >= date.today())
             )
         else:
-            request.is_premium_user = False
\ No newline at end of file
+            request.is_premium_user = False
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """Answer 429 to clients over the RATELIMITS rate of the view they post to."""
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = request.resolver_match.url_name
+        retry_after = ratelimit.check(request, name)
+        if not retry_after:
+            return None
+        metrics.RATE_LIMITED.inc(view=name)
+        message = 'Too many requests, please try again later.'
+        # Pages post forms that accept HTML; the like and bookmark buttons fetch JSON
+        if 'text/html' in request.headers.get('Accept', ''):
+            response = render(request, '429.html', {'retry_after': retry_after}, status=429)
+        else:
+            response = JsonResponse({'error': message, 'retry_after': retry_after}, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+
+
+class ReplicaMiddleware:
+    """
+    Route the reads of views marked ``read_from_replica`` to a replica, unless the
+    client wrote something in the last REPLICA_PIN_SECONDS: unsafe requests set a
+    short-lived cookie that keeps the client on the primary, so it reads its own writes.
+    """
+    cookie_name = 'db_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._replica_token = None
+        try:
+            response = self.get_response(request)
+        finally:
+            if request._replica_token is not None:
+                stop_replica_reads(request._replica_token)
+        if replicas() and request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            response.set_cookie(
+                self.cookie_name, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax', secure=request.is_secure(),
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        if getattr(view, 'read_from_replica', False) and self.cookie_name not in request.COOKIES:
+            request._replica_token = start_replica_reads()
+
+
+class QueryRecorder:
+    """Database execute wrapper that counts queries, their time and repeats."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+
+class RequestTimingMiddleware:
+    """
+    Record query count, DB time, duplicate queries, template and view time for a
+    sample of requests. Results go out as a Server-Timing header, a JSON log line
+    on the ``blog.perf`` logger and rolling per-URL-name totals (RequestStat).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = getattr(settings, 'REQUEST_TIMING_SAMPLE_RATE', 0)
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        request._render_time = 0.0
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        match = request.resolver_match
+        timing = {
+            'url_name': match.view_name if match else '<unresolved>',
+            'method': request.method,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'duplicate_queries': recorder.duplicates,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'render_ms': round(request._render_time * 1000, 2),
+            'view_ms': round((total - request._render_time) * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={timing["db_ms"]};desc="{recorder.count} queries, {recorder.duplicates} duplicate"',
+            f'tpl;dur={timing["render_ms"]}',
+            f'view;dur={timing["view_ms"]}',
+            f'total;dur={timing["total_ms"]}',
+        ])
+        perf_logger.info(json.dumps(timing))
+        record_request(timing)
+        return response
+
+    def process_template_response(self, request, response):
+        # Render here so template time (and the queries it triggers) can be separated
+        # from the view; later render() calls on the response are no-ops.
+        if hasattr(request, '_render_time'):
+            start = time.perf_counter()
+            response.render()
+            request._render_time += time.perf_counter() - start
+        return response
+
+
+class MetricsMiddleware:
+    """Count requests and observe latency per view for the /metrics endpoint."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics.HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.HTTP_IN_FLIGHT.dec()
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - start, view=view)
+        metrics.HTTP_REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Capture a cProfile profile of a request and keep it as a RequestProfile.
+
+    A request is profiled when a staff user adds ``?_profile=1``, when it carries a
+    valid ``X-Profile-Token`` header (see the ``profile_token`` command), or when it
+    falls in the PROFILE_SAMPLE_RATE sample and ends up slower than PROFILE_SLOW_MS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trigger = self.get_trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this thread
+            return self.get_response(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        if trigger == 'sampled' and duration_ms < getattr(settings, 'PROFILE_SLOW_MS', 500):
+            return response
+        profile = save_profile(request, response, profiler, duration_ms, trigger)
+        if trigger != 'sampled':
+            response.headers['X-Profile-Id'] = str(profile.pk)
+        return response
+
+    def get_trigger(self, request):
+        if request.GET.get('_profile') and request.user.is_staff:
+            return 'staff'
+        token = request.headers.get('X-Profile-Token')
+        if token:
+            try:
+                signing.TimestampSigner(salt='blog.profiling').unsign(
+                    token, max_age=getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 3600)
+                )
+                return 'token'
+            except signing.BadSignature:
+                pass
+        rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        if rate and random.random() < rate:
+            return 'sampled'
+        return None
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_seed_categories'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_name', models.CharField(max_length=200, unique=True)),
+                ('hits', models.PositiveBigIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('db_ms', models.FloatField(default=0)),
+                ('render_ms', models.FloatField(default=0)),
+                ('queries', models.PositiveBigIntegerField(default=0)),
+                ('max_queries', models.PositiveIntegerField(default=0)),
+                ('duplicate_queries', models.PositiveBigIntegerField(default=0)),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ('-total_ms',),
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Post = apps.get_model('blog', 'Post')
+    PostTag = apps.get_model('blog', 'PostTag')
+    TagCount = apps.get_model('blog', 'TagCount')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    content_type = ContentType.objects.filter(app_label='blog', model='post').first()
+    if content_type is None:
+        return
+    dates = dict(Post.objects.filter(status='published').values_list('pk', 'publish_date'))
+    rows = TaggedItem.objects.filter(content_type=content_type).values_list('object_id', 'tag_id')
+    PostTag.objects.bulk_create((
+        PostTag(post_id=post_id, tag_id=tag_id, publish_date=dates[post_id])
+        for post_id, tag_id in rows.iterator() if post_id in dates
+    ), batch_size=1000)
+    TagCount.objects.bulk_create([
+        TagCount(tag_id=row['tag'], post_count=row['n'])
+        for row in PostTag.objects.order_by().values('tag').annotate(n=Count('pk'))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_hot_filter_indexes'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagCount',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='published_count', serialize=False, to='taggit.tag')),
+                ('post_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-post_count', 'tag'], name='tagcount_count_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('publish_date', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_index', to='blog.post')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='taggit.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', '-publish_date'], name='posttag_tag_publish_idx')],
+                'unique_together': {('tag', 'post')},
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
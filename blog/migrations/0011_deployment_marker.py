@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeploymentMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.CharField(max_length=64)),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
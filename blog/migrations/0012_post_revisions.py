@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-19 19:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_deployment_marker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('title', models.CharField(max_length=255)),
+                ('size', models.PositiveIntegerField()),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('is_snapshot', models.BooleanField()),
+                ('data', models.BinaryField()),
+                ('created_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('editor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='blog.post')),
+            ],
+            options={
+                'unique_together': {('post', 'number')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-19 19:12
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+
+def backfill(apps, schema_editor):
+    ArchiveMonth = apps.get_model('blog', 'ArchiveMonth')
+    Post = apps.get_model('blog', 'Post')
+    rows = (
+        Post.objects.filter(status='published').annotate(m=TruncMonth('publish_date')).order_by()
+        .values('m').annotate(n=Count('pk')).values_list('m', 'n')
+    )
+    ArchiveMonth.objects.bulk_create([ArchiveMonth(year=m.year, month=m.month, post_count=n) for m, n in rows])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_post_revisions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('post_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('year', 'month')},
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
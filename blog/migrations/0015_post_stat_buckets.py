@@ -0,0 +1,51 @@
+# Generated by Django 5.2.1 on 2026-10-19 19:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDay
+
+
+def backfill(apps, schema_editor):
+    # Views were never timestamped; likes, comments and bookmarks start from their dates
+    PostStatBucket = apps.get_model('blog', 'PostStatBucket')
+    days = {}
+    for kind, model in (('likes', 'Like'), ('comments', 'Comment'), ('bookmarks', 'Bookmark')):
+        rows = (
+            apps.get_model('blog', model).objects.filter(created_date__isnull=False)
+            .annotate(day=TruncDay('created_date')).order_by().values('post_id', 'day')
+            .annotate(n=Count('pk')).values_list('post_id', 'day', 'n')
+        )
+        for post_id, day, n in rows.iterator():
+            days.setdefault((post_id, day), {})[kind] = n
+    PostStatBucket.objects.bulk_create([
+        PostStatBucket(post_id=post_id, period='day', start=day, **counts) for (post_id, day), counts in days.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_imported_posts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostStatBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('views', models.IntegerField(default=0)),
+                ('likes', models.IntegerField(default=0)),
+                ('comments', models.IntegerField(default=0)),
+                ('bookmarks', models.IntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'start'], name='poststat_period_start_idx')],
+                'unique_together': {('post', 'period', 'start')},
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,12 @@
 import math
+import os
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.urls import reverse
 from django.utils import timezone
 from taggit.managers import TaggableManager
+from taggit.models import Tag
 
 
 class User(AbstractUser):
@@ -25,10 +27,21 @@ class Profile(models.Model):
     follows = models.ManyToManyField('self', related_name='followed_by', symmetrical=False, blank=True)
     is_subscribed = models.BooleanField(default=False)
     subscription_end_date = models.DateField(null=True, blank=True)
+    # Kept in step with the unread Notification rows so the nav badge needs no query
+    unread_notifications = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        # The counter only changes through UPDATE ... F() (blog/notifications.py); writing
+        # back the value loaded with this instance would lose increments made since
+        if self.pk and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'unread_notifications'
+            ]
+        super().save(*args, **kwargs)
+
     @property
     def initials(self):
         name = self.user.get_full_name() or self.user.username
@@ -75,10 +88,25 @@ class Post(models.Model):
 
     class Meta:
         ordering = ('-publish_date',)
+        indexes = [
+            models.Index(fields=['status', '-publish_date'], name='post_status_publish_idx'),
+            models.Index(fields=['status', 'category', '-publish_date'], name='post_status_cat_publish_idx'),
+            models.Index(fields=['status', '-view_count'], name='post_status_views_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        # Lets signals tell a first publish apart from an edit, and a move within the
+        # listings apart from a change of content
+        instance._loaded_status = loaded.get('status')
+        instance._loaded_listing = (loaded.get('status'), loaded.get('category_id'), loaded.get('publish_date'))
+        return instance
+
     def get_absolute_url(self):
         return reverse('post_detail', args=[self.slug])
 
@@ -111,6 +139,9 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ('-created_date',)
+        indexes = [
+            models.Index(fields=['post', 'parent', '-created_date'], name='comment_post_parent_idx'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.author} on {self.post}'
@@ -133,6 +164,248 @@ class Bookmark(models.Model):
     class Meta:
         unique_together = ('post', 'user')
         ordering = ('-created_date',)
+        indexes = [
+            models.Index(fields=['user', '-created_date'], name='bookmark_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} bookmarked {self.post.title}'
+
+
+class Notification(models.Model):
+    KIND_CHOICES = (('post', 'New post'), ('reply', 'Reply'))
+
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    is_read = models.BooleanField(default=False)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['recipient', '-id'], name='notification_recipient_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} for {self.recipient}'
+
+    @property
+    def message(self):
+        if self.kind == 'reply':
+            return f'{self.actor.username} replied to your comment on "{self.post.title}"'
+        return f'{self.actor.username} published "{self.post.title}"'
+
+    @property
+    def url(self):
+        return self.post.get_absolute_url()
+
+
+class PostTag(models.Model):
+    """Tag -> published post index in list order, maintained by blog.tagindex."""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='tag_index')
+    publish_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('tag', 'post')
+        indexes = [
+            models.Index(fields=['tag', '-publish_date'], name='posttag_tag_publish_idx'),
+        ]
+
+
+class TagCount(models.Model):
+    """Number of published posts per tag, maintained by blog.tagindex."""
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True, related_name='published_count')
+    post_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-post_count', 'tag'], name='tagcount_count_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag} ({self.post_count})'
+
+
+class RequestStat(models.Model):
+    """Rolling request timing totals per URL name, fed by RequestTimingMiddleware."""
+    url_name = models.CharField(max_length=200, unique=True)
+    hits = models.PositiveBigIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    db_ms = models.FloatField(default=0)
+    render_ms = models.FloatField(default=0)
+    queries = models.PositiveBigIntegerField(default=0)
+    max_queries = models.PositiveIntegerField(default=0)
+    duplicate_queries = models.PositiveBigIntegerField(default=0)
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ('-total_ms',)
+
+    def __str__(self):
+        return self.url_name
+
+    def _avg(self, value):
+        return round(value / self.hits, 2) if self.hits else 0
+
+    @property
+    def avg_ms(self):
+        return self._avg(self.total_ms)
+
+    @property
+    def avg_db_ms(self):
+        return self._avg(self.db_ms)
+
+    @property
+    def avg_render_ms(self):
+        return self._avg(self.render_ms)
+
+    @property
+    def avg_queries(self):
+        return self._avg(self.queries)
+
+
+class RequestProfile(models.Model):
+    """A cProfile dump of one request, stored on disk under PROFILE_DIR."""
+    TRIGGER_CHOICES = (('staff', 'Staff flag'), ('token', 'Signed header'), ('sampled', 'Slow sample'))
+
+    url_name = models.CharField(max_length=200, db_index=True)
+    path = models.CharField(max_length=500)
+    method = models.CharField(max_length=10)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    filename = models.CharField(max_length=255)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ('-created_date',)
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.duration_ms:.0f} ms)'
+
+    @property
+    def file_path(self):
+        from .profiling import profile_dir
+        return os.path.join(profile_dir(), os.path.basename(self.filename))
+
+    def delete(self, *args, **kwargs):
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+        return super().delete(*args, **kwargs)
+
+
+class Job(models.Model):
+    """A unit of background work, run by ``manage.py worker`` (see blog.jobs)."""
+    STATUS_CHOICES = (('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'))
+
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    claimed_by = models.CharField(max_length=64, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    finished_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
+
+class JobSchedule(models.Model):
+    """When a periodic job next runs; rows are created from ``@job(every=...)`` by the worker."""
+    name = models.CharField(max_length=100, unique=True)
+    interval = models.PositiveIntegerField(help_text='Seconds between runs')
+    next_run_at = models.DateTimeField(default=timezone.now)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    enabled = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f'{self.name} every {self.interval}s'
+
+
+class DeploymentMarker(models.Model):
+    """A fingerprint of setup work done by ``manage.py prepare``, so unchanged steps are skipped."""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.CharField(max_length=64)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class PostRevision(models.Model):
+    """A saved version of a post's title and body; see blog.revisions for the encoding."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='revisions')
+    number = models.PositiveIntegerField()
+    editor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    title = models.CharField(max_length=255)
+    # Length of the body, so listings need not rebuild it
+    size = models.PositiveIntegerField()
+    fingerprint = models.CharField(max_length=40)
+    is_snapshot = models.BooleanField()
+    data = models.BinaryField()
+    created_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('post', 'number')
+
+    def __str__(self):
+        return f'{self.post_id} r{self.number}'
+
+
+class ArchiveMonth(models.Model):
+    """Number of published posts per calendar month (TIME_ZONE), maintained by blog.archive."""
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    post_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('year', 'month')
+
+    def __str__(self):
+        return f'{self.year}-{self.month:02} ({self.post_count})'
+
+
+class ImportedPost(models.Model):
+    """The Markdown file a post was imported from, and its hash, so unchanged files are skipped on re-runs."""
+    path = models.CharField(max_length=500, unique=True, help_text='Relative to the imported directory')
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='+')
+    sha = models.CharField(max_length=64)
+    imported_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.path
+
+
+class PostStatBucket(models.Model):
+    """Events of a post in one hour or day, maintained by blog.analytics."""
+    PERIOD_CHOICES = (('hour', 'Hour'), ('day', 'Day'))
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    views = models.IntegerField(default=0)
+    # Net of removals, so these can be negative
+    likes = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+    bookmarks = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('post', 'period', 'start')
+        indexes = [models.Index(fields=['period', 'start'], name='poststat_period_start_idx')]
 
     def __str__(self):
-        return f'{self.user.username} bookmarked {self.post.title}'
\ No newline at end of file
+        return f'{self.post_id} {self.period} {self.start:%Y-%m-%d %H:00}'
@@ -0,0 +1,106 @@
+"""
+Notifications for new posts by followed authors and for replies to comments.
+
+Fan-out is a background job (blog.jobs) queued in the publishing transaction, so a
+large follower base never holds up the request. Rows are written with ``bulk_create``
+in batches of NOTIFICATION_BATCH_SIZE; each batch bumps the recipients' denormalized
+``Profile.unread_notifications`` in the same transaction. With NOTIFICATION_LIVE the
+new rows are also pushed to the "notifications_<user id>" channel group, which only
+reaches the web processes when they share a channel layer with the worker (Redis), so
+it is off by default with the in-memory layer and pages then open no socket for it.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+
+from . import metrics
+from .jobs import job
+from .models import Comment, Notification, Post, Profile
+
+
+def post_published(post):
+    fan_out_post.enqueue(post.pk)
+
+
+def posts_published(post_ids):
+    fan_out_post.enqueue_many([(pk,) for pk in post_ids])
+
+
+def comment_added(comment):
+    if comment.parent_id:
+        notify_reply.enqueue(comment.pk)
+
+
+@job()
+def fan_out_post(post_id):
+    post = Post.objects.select_related('author').filter(pk=post_id, status='published').first()
+    if post is None:
+        return
+    followers = Profile.objects.filter(follows__user_id=post.author_id).order_by('user_id').values_list('user_id', flat=True)
+    # Batches commit in user id order, so a retried job carries on after the last one
+    done_until = Notification.objects.filter(post=post, kind='post').aggregate(m=Max('recipient_id'))['m']
+    if done_until:
+        followers = followers.filter(user_id__gt=done_until)
+    batch = []
+    for user_id in followers.iterator(chunk_size=settings.NOTIFICATION_BATCH_SIZE):
+        batch.append(user_id)
+        if len(batch) == settings.NOTIFICATION_BATCH_SIZE:
+            deliver(batch, 'post', post.author, post)
+            batch = []
+    if batch:
+        deliver(batch, 'post', post.author, post)
+
+
+@job()
+def notify_reply(comment_id):
+    comment = Comment.objects.select_related('author', 'post', 'parent').filter(pk=comment_id).first()
+    if comment and comment.parent and comment.parent.author_id != comment.author_id:
+        deliver([comment.parent.author_id], 'reply', comment.author, comment.post, comment)
+
+
+def deliver(recipient_ids, kind, actor, post, comment=None):
+    with transaction.atomic():
+        created = Notification.objects.bulk_create([
+            Notification(recipient_id=user_id, kind=kind, actor=actor, post=post, comment=comment)
+            for user_id in recipient_ids
+        ])
+        Profile.objects.filter(user_id__in=recipient_ids).update(unread_notifications=F('unread_notifications') + 1)
+    if settings.NOTIFICATION_LIVE:
+        push(created)
+    return created
+
+
+def as_dict(notification):
+    return {
+        'id': notification.pk,
+        'kind': notification.kind,
+        'message': notification.message,
+        'url': notification.url,
+        'is_read': notification.is_read,
+        'created_date': notification.created_date.isoformat(),
+    }
+
+
+def push(notifications):
+    layer = get_channel_layer()
+
+    async def send_all():
+        for n in notifications:
+            await layer.group_send(f'notifications_{n.recipient_id}', {'type': 'notification_message', 'notification': as_dict(n)})
+
+    try:
+        async_to_sync(send_all)()
+        metrics.GROUP_SENDS.inc(len(notifications), source='notifications', outcome='ok')
+    except Exception:
+        metrics.GROUP_SENDS.inc(source='notifications', outcome='error')
+
+
+def mark_read(user):
+    with transaction.atomic():
+        # Lock the counter first so a concurrent fan-out batch is either fully counted
+        # here or applies its increment after the reset
+        Profile.objects.select_for_update().filter(user=user).exists()
+        Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+        Profile.objects.filter(user=user).update(unread_notifications=0)
@@ -0,0 +1,27 @@
+"""
+Entry points for spawned worker processes: ``JOB_POOL=process`` job workers and the
+static export's render pool.
+
+Spawned children unpickle these before Django is set up, so this module must not
+import models at import time.
+"""
+import django
+
+
+def init():
+    django.setup()
+
+
+def run_job(job_id):
+    from .jobs import run_claimed
+    return run_claimed(job_id)
+
+
+def export_pages(urls, previous):
+    from .export import export_pages
+    return export_pages(urls, previous)
+
+
+def read_markdown(root, files):
+    from .importer import read_files
+    return read_files(root, files)
@@ -0,0 +1,41 @@
+import io
+import os
+import pstats
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.text import slugify
+
+
+def profile_dir():
+    return getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def save_profile(request, response, profiler, duration_ms, trigger):
+    """Dump ``profiler`` to PROFILE_DIR and record it as a RequestProfile."""
+    from .models import RequestProfile
+
+    match = request.resolver_match
+    url_name = match.view_name if match else '<unresolved>'
+    now = timezone.now()
+    filename = f'{now:%Y%m%d-%H%M%S-%f}-{slugify(url_name) or "unresolved"}-{int(duration_ms)}ms.prof'
+    os.makedirs(profile_dir(), exist_ok=True)
+    profiler.dump_stats(os.path.join(profile_dir(), filename))
+    return RequestProfile.objects.create(
+        url_name=url_name,
+        path=request.get_full_path()[:500],
+        method=request.method,
+        status_code=response.status_code,
+        duration_ms=round(duration_ms, 2),
+        trigger=trigger,
+        filename=filename,
+        created_date=now,
+    )
+
+
+def summarize(path, sort='cumulative', limit=40):
+    """Return the top ``limit`` functions of a stored profile as text."""
+    out = io.StringIO()
+    stats = pstats.Stats(path, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
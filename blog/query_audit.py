@@ -0,0 +1,70 @@
+"""
+EXPLAIN the querysets built by the blog views and flag plans that will not scale:
+full table scans and sorts that cannot use an index. Used by ``manage.py audit_queries``.
+"""
+import re
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+
+from . import handlers, tagindex, views
+from .models import Post, Bookmark, Category
+
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?! USING (?:COVERING )?INDEX)(?:\s|$)')
+# "RIGHT PART OF ORDER BY": an index gives the leading ORDER BY terms, the rest are sorted
+SQLITE_TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR ((?:RIGHT PART OF )?ORDER BY|GROUP BY|DISTINCT)')
+PG_SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+PG_SORT = re.compile(r'(?:->\s*)?(?:Incremental )?Sort\s+\(')
+
+
+def _list_queryset(view_class, params=None, user=None, **kwargs):
+    request = handlers.get_request('/?' + urlencode(params or {}))
+    request.user = user or AnonymousUser()
+    view = view_class()
+    view.setup(request, **kwargs)
+    return view.get_queryset()[:view.paginate_by]
+
+
+def audit_querysets():
+    """Yield (label, queryset) for the hot queries, built through the views' own code."""
+    post = Post.objects.filter(status='published').order_by('-view_count').first()
+    category = Category.objects.filter(posts__status='published').first()
+    tag = post.tags.first() if post else None
+    bookmark = Bookmark.objects.order_by('-pk').first()
+
+    yield 'post_list', _list_queryset(views.PostListView)
+    yield 'post_list search', _list_queryset(views.PostListView, {'q': 'cache'})
+    if category:
+        yield 'post_list category', _list_queryset(views.PostListView, {'category': category.slug})
+        yield 'category_posts', _list_queryset(views.CategoryPostsView, slug=category.slug)
+    if tag:
+        yield 'post_list tag', _list_queryset(views.PostListView, {'tag': tag.name})
+    yield 'sidebar categories', views.sidebar_categories()
+    yield 'tag cloud', tagindex.cloud_queryset()
+    yield 'featured post', views.featured_posts()[:1]
+    if post:
+        yield 'post_detail comments', views.top_level_comments(post)
+        yield 'post_detail related', views.related_posts(post)
+    if bookmark:
+        yield 'bookmarks', _list_queryset(views.BookmarkListView, user=bookmark.user)
+
+
+def find_problems(plan, vendor=None):
+    vendor = vendor or connection.vendor
+    problems = []
+    for line in plan.splitlines():
+        if vendor == 'sqlite':
+            scan = SQLITE_SCAN.search(line)
+            if scan:
+                problems.append(f'full scan of {scan.group(1)}')
+            sort = SQLITE_TEMP_SORT.search(line)
+            if sort:
+                problems.append(f'temp B-tree for {sort.group(1)}')
+        elif vendor == 'postgresql':
+            scan = PG_SEQ_SCAN.search(line)
+            if scan:
+                problems.append(f'sequential scan of {scan.group(1)}')
+            if PG_SORT.search(line):
+                problems.append('explicit sort')
+    return problems
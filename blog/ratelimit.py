@@ -0,0 +1,83 @@
+"""
+Request rate limits per URL name, shared by all worker processes through the cache.
+
+RATELIMITS maps URL names to rates such as ``'10/m'`` (per second, minute, hour or
+day). ``RateLimitMiddleware`` counts the unsafe requests (POST and the like) to those
+views per signed-in user, or per client address for anonymous ones, and answers
+429 with Retry-After once a client is over its rate.
+
+This is a sliding-window counter rather than a token bucket. Each client has a counter
+per fixed window of the rate's period, bumped with the cache's atomic ``incr``. The
+count over the last period is estimated from it and the previous window's counter,
+weighted by how much of that window is still in range. A token bucket would need a
+read-modify-write of its tokens and timestamp, which the cache API cannot make atomic
+across processes. The sliding window limits the same rolling rate without a burst at
+window edges, and it costs two cache round trips and no query. Limits only hold across
+processes with a shared cache (Redis); the local memory cache keeps them per process.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+KEY = 'blog:ratelimit:{}:{}:{}'
+
+
+def parse(rate):
+    """'30/m' -> (30, 60)."""
+    count, _, period = rate.partition('/')
+    return int(count), PERIODS[period[:1].lower()]
+
+
+def client_ip(request):
+    """The client address, taking RATELIMIT_PROXY_COUNT trusted proxies' X-Forwarded-For into account."""
+    proxies = settings.RATELIMIT_PROXY_COUNT
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if proxies and len(forwarded) >= proxies:
+        return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def client(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'ip:{client_ip(request)}'
+
+
+def hit(name, who, rate, now=None):
+    """
+    Count a request of ``who`` to ``name``; returns 0 if it is within ``rate``, else the
+    seconds until it would be.
+    """
+    limit, period = parse(rate)
+    now = time.time() if now is None else now
+    window, offset = divmod(now, period)
+    window = int(window)
+    key = KEY.format(name, who, window)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # Two periods, so the next window can still read this one
+        if cache.add(key, 1, 2 * period):
+            count = 1
+        else:
+            count = cache.incr(key)
+    if count > limit:
+        return math.ceil(period - offset)
+    previous = cache.get(KEY.format(name, who, window - 1), 0)
+    remaining = 1 - offset / period
+    if previous * remaining + count <= limit:
+        return 0
+    # The previous window's weight drops until the estimate is back within the limit
+    return max(1, math.ceil((remaining - (limit - count) / previous) * period))
+
+
+def check(request, name):
+    """Seconds ``request`` has to wait if view ``name`` is rate limited and it is over the rate, else 0."""
+    rate = settings.RATELIMITS.get(name)
+    if not settings.RATELIMIT_ENABLED or not rate or request.method in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+        return 0
+    return hit(name, client(request), rate)
@@ -0,0 +1,149 @@
+"""
+Revision history of posts, stored as zlib-compressed line deltas.
+
+Every save that changes a post's title or body adds a PostRevision. The first one is
+a full snapshot; later ones hold only the changes from the revision before, as a list
+of ``[start, end]`` ranges copied from its lines and strings of new text. A fresh
+snapshot is taken every REVISION_SNAPSHOT_INTERVAL revisions, or sooner when the
+delta would not be smaller, so any revision is rebuilt from one query of at most that
+many rows.
+
+``manage.py prune_revisions`` drops old revisions and re-encodes the rest.
+"""
+import difflib
+import hashlib
+import json
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Post, PostRevision
+
+
+def fingerprint(title, body):
+    return hashlib.sha1(f'{title}\0{body}'.encode()).hexdigest()
+
+
+def encode_delta(old, new):
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(new_lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, separators=(',', ':')).encode(), 9)
+
+
+def apply_delta(old, data):
+    old_lines = old.splitlines(keepends=True)
+    return ''.join(''.join(old_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in json.loads(zlib.decompress(data)))
+
+
+def chain(post_id, lowest, highest=None):
+    """
+    The rows needed to rebuild revisions ``lowest``..``highest``: from the last snapshot
+    before ``lowest``, or from the oldest kept revision (a snapshot) if it was pruned.
+    """
+    snapshot = (
+        PostRevision.objects.filter(post_id=post_id, number__lte=lowest, is_snapshot=True)
+        .values('post').annotate(n=Max('number')).values('n')
+    )
+    return PostRevision.objects.filter(
+        post_id=post_id, number__lte=highest or lowest, number__gte=Coalesce(Subquery(snapshot), 0),
+    ).order_by('number')
+
+
+def rebuild(rows, numbers):
+    """Apply ``rows`` in order; returns {number: revision with ``body`` set} for ``numbers``."""
+    found = {}
+    body = ''
+    for revision in rows:
+        body = zlib.decompress(revision.data).decode() if revision.is_snapshot else apply_delta(body, revision.data)
+        if revision.number in numbers:
+            revision.body = body
+            found[revision.number] = revision
+    return found
+
+
+def get(post_id, *numbers):
+    """Revisions of a post with their ``body`` rebuilt, as {number: revision}; one query."""
+    if not numbers:
+        return {}
+    return rebuild(chain(post_id, min(numbers), max(numbers)).select_related('editor'), set(numbers))
+
+
+def record(post, editor=None):
+    """Add a revision if the title or body changed since the last one; returns it or None."""
+    with transaction.atomic():
+        # Concurrent saves of the same post number their revisions one after the other
+        Post.objects.select_for_update().filter(pk=post.pk).exists()
+        last = PostRevision.objects.filter(post=post).order_by('-number').values('number', 'fingerprint').first()
+        digest = fingerprint(post.title, post.body)
+        if last and last['fingerprint'] == digest:
+            return None
+        number = last['number'] + 1 if last else 1
+        previous_body, since_snapshot = None, 0
+        if last:
+            rows = list(chain(post.pk, last['number']))
+            previous_body, since_snapshot = rebuild(rows, {last['number']})[last['number']].body, len(rows)
+        data, is_snapshot = encode(previous_body, post.body, since_snapshot)
+        return PostRevision.objects.create(
+            post=post, number=number, editor=editor, title=post.title, size=len(post.body),
+            fingerprint=digest, is_snapshot=is_snapshot, data=data,
+        )
+
+
+def encode(previous_body, body, since_snapshot):
+    """
+    (data, is_snapshot) for ``body`` following ``previous_body`` (None for the first
+    revision), ``since_snapshot`` being the length of the chain it would extend.
+    """
+    snapshot = zlib.compress(body.encode(), 9)
+    if previous_body is None or since_snapshot >= settings.REVISION_SNAPSHOT_INTERVAL:
+        return snapshot, True
+    delta = encode_delta(previous_body, body)
+    if len(delta) >= len(snapshot):
+        return snapshot, True
+    return delta, False
+
+
+def compact(post_id, keep=None):
+    """
+    Re-encode the revisions of a post, keeping only the newest ``keep`` if given; the
+    oldest kept one becomes a snapshot. Returns (deleted, rewritten).
+    """
+    with transaction.atomic():
+        rows = list(PostRevision.objects.select_for_update().filter(post_id=post_id).order_by('number'))
+        revisions = rebuild(rows, {row.number for row in rows})
+        kept = rows[-keep:] if keep else rows
+        deleted = len(rows) - len(kept)
+        if deleted:
+            PostRevision.objects.filter(post_id=post_id, number__lt=kept[0].number).delete()
+        changed = []
+        previous_body, since_snapshot = None, 0
+        for row in kept:
+            body = revisions[row.number].body
+            data, is_snapshot = encode(previous_body, body, since_snapshot)
+            since_snapshot = 1 if is_snapshot else since_snapshot + 1
+            if bytes(row.data) != data or row.is_snapshot != is_snapshot:
+                row.data, row.is_snapshot = data, is_snapshot
+                changed.append(row)
+            previous_body = body
+        PostRevision.objects.bulk_update(changed, ['data', 'is_snapshot'], batch_size=100)
+    return deleted, len(changed)
+
+
+def diff(old, new):
+    """The lines of ``old`` and ``new`` as (kind, text) pairs, kind being ' ', '-' or '+'."""
+    old_lines, new_lines = old.splitlines(), new.splitlines()
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            yield from ((' ', line) for line in old_lines[i1:i2])
+        else:
+            yield from (('-', line) for line in old_lines[i1:i2])
+            yield from (('+', line) for line in new_lines[j1:j2])
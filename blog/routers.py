@@ -0,0 +1,49 @@
+"""
+Send reads from opted-in views to the read replicas listed in DATABASE_REPLICAS.
+
+Views opt in with a ``read_from_replica = True`` attribute; ReplicaMiddleware then
+turns replica reads on for the rest of the request, template rendering included. The
+replica is picked once per request, so its reads all see the same point of replication.
+Writes, reads inside a transaction on the primary, and everything else use ``default``.
+"""
+import contextvars
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Alias of the replica the current request reads from, or None
+_replica = contextvars.ContextVar('replica', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def start_replica_reads():
+    """Send reads in the current context to one replica; returns a token for ``stop_replica_reads``."""
+    aliases = replicas()
+    return _replica.set(random.choice(aliases) if aliases else None)
+
+
+def stop_replica_reads(token):
+    _replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        if replica and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema from the primary
+        return db not in replicas()
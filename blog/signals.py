@@ -1,14 +1,242 @@
-from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.conf import settings
-from .models import Profile
+from taggit.models import Tag
+from . import analytics, archive, autocomplete, bulk, export, facets, feed, fragments, metrics, notifications, revisions, tagindex
+from .models import Profile, Post, PostTag, Category, Comment, Like, Bookmark
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
-def create_or_update_user_profile(sender, instance, created, **kwargs):
+def create_or_update_user_profile(sender, instance, created, raw=False, update_fields=None, **kwargs):
     """
     Create a Profile for a new user, or just save the existing one.
     """
+    if raw:
+        # Fixtures bring their own profiles
+        return
     if created:
         Profile.objects.create(user=instance)
+    elif update_fields == frozenset({'last_login'}):
+        # Nothing on the profile changes with a login
+        return
 
-    instance.profile.save()
\ No newline at end of file
+    instance.profile.save()
+
+
+@receiver(connection_created)
+def count_db_connection(sender, connection, **kwargs):
+    metrics.track_connection(connection)
+
+
+@receiver(post_save, sender=Post)
+@receiver(m2m_changed, sender=Post.tags.through)
+def sync_tag_index(sender, instance, action=None, raw=False, **kwargs):
+    # m2m_changed fires for both the post and tag side; only the post side carries the post
+    if not raw and action in (None, 'post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        tagindex.sync_post(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def remember_indexed_tags(sender, instance, **kwargs):
+    instance._indexed_tag_ids = list(PostTag.objects.filter(post=instance).values_list('tag_id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def recount_tags_of_deleted_post(sender, instance, **kwargs):
+    tagindex.refresh_counts(getattr(instance, '_indexed_tag_ids', ()))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def refresh_tag_cloud(sender, **kwargs):
+    tagindex.invalidate_cloud()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def refresh_post_suggestions(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.changed(post=[instance.pk], author=[instance.author_id], category=[instance.category_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def refresh_named_suggestions(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.changed(**{'tag' if sender is Tag else 'category': [instance.pk]})
+
+
+@receiver(tagindex.tag_counts_changed)
+def refresh_tag_suggestions(sender, tag_ids, **kwargs):
+    autocomplete.changed(tag=tag_ids)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def refresh_author_suggestions(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Logins only touch last_login; new users have no posts yet
+    if not (raw or created or update_fields == frozenset({'last_login'})):
+        autocomplete.changed(author=[instance.pk])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(tagindex.tag_counts_changed)
+@receiver(bulk.posts_bulk_updated)
+def refresh_search_facets(sender, instance=None, raw=False, **kwargs):
+    # Drafts are never counted
+    if isinstance(instance, Post) and 'published' not in (instance.status, getattr(instance, '_loaded_status', None)):
+        return
+    if not raw:
+        facets.invalidate()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def refresh_post_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        fragments.bump([instance.pk if sender is Post else instance.post_id])
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_cards(sender, instance, raw=False, **kwargs):
+    if not raw:
+        fragments.bump(instance.posts.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def refresh_author_cards(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if not (raw or created or update_fields == frozenset({'last_login'})):
+        fragments.bump(instance.blog_posts.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def refresh_author_feed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        feed.forget_author_posts([instance.author_id])
+
+
+@receiver(m2m_changed, sender=Profile.follows.through)
+def refresh_following(sender, instance, action, reverse, pk_set, **kwargs):
+    # reverse: the followers of ``instance`` changed rather than the authors it follows
+    if action == 'pre_clear' and reverse:
+        instance._former_follower_ids = list(instance.followed_by.values_list('user_id', flat=True))
+    elif action in ('post_add', 'post_remove') and not reverse:
+        authors = Profile.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)
+        feed.follow_changed(instance.user_id, authors, action == 'post_add')
+    elif action == 'post_clear':
+        feed.forget_following(getattr(instance, '_former_follower_ids', []) if reverse else [instance.user_id])
+    elif action in ('post_add', 'post_remove'):
+        feed.forget_following(Profile.objects.filter(pk__in=pk_set).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=Post)
+def notify_followers(sender, instance, raw=False, **kwargs):
+    if not raw and instance.status == 'published' and getattr(instance, '_loaded_status', None) != 'published':
+        notifications.post_published(instance)
+    instance._loaded_status = instance.status
+
+
+@receiver(post_save, sender=Post)
+def record_revision(sender, instance, raw=False, **kwargs):
+    # Views and the admin say who edited; fixtures bring no history
+    if not raw:
+        revisions.record(instance, getattr(instance, '_editor', None))
+
+
+@receiver(post_save, sender=Comment)
+def notify_reply(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        notifications.comment_added(instance)
+
+
+@receiver(bulk.posts_bulk_updated)
+def sync_bulk_updated_posts(sender, rows, values, **kwargs):
+    post_ids = [row[0] for row in rows]
+    authors = {row[2] for row in rows}
+    tagindex.sync_posts(post_ids)
+    autocomplete.changed(post=post_ids, author=authors, category={row[3] for row in rows} | {values.get('category_id')})
+    fragments.bump(post_ids)
+    feed.forget_author_posts(authors)
+
+
+@receiver(bulk.posts_bulk_updated)
+def notify_followers_of_bulk_published(sender, rows, values, created, **kwargs):
+    # Imported posts were written elsewhere and are often backdated, so they notify nobody
+    if values.get('status') == 'published' and not created:
+        notifications.posts_published([row[0] for row in rows if row[1] != 'published'])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def export_post(sender, instance, signal, raw=False, **kwargs):
+    listing = (instance.status, instance.category_id, instance.publish_date)
+    loaded = getattr(instance, '_loaded_listing', None)
+    # Drafts are never exported
+    if raw or 'published' not in (listing[0], loaded and loaded[0]):
+        return
+    if signal is post_delete or loaded != listing:
+        export.changed(posts=[instance.pk], categories=[instance.category_id, loaded and loaded[1]], home=True)
+    else:
+        export.changed(posts=[instance.pk], pages_of=[instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def export_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        export.changed(posts=[instance.post_id], pages_of=[instance.post_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def export_category(sender, instance, raw=False, **kwargs):
+    # Category names appear on every listing page and on the category's post pages
+    if not raw:
+        export.changed(posts=instance.posts.values_list('pk', flat=True), categories=[instance.pk], home=True)
+
+
+@receiver(bulk.posts_bulk_updated)
+def export_bulk_updated_posts(sender, rows, values, **kwargs):
+    export.changed(posts=[row[0] for row in rows], categories={row[3] for row in rows} | {values.get('category_id')}, home=True)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def count_archive_months(sender, instance, signal, raw=False, **kwargs):
+    loaded = getattr(instance, '_loaded_listing', None)
+    before = archive.month_of(loaded[2]) if loaded and loaded[0] == 'published' else None
+    after = archive.month_of(instance.publish_date) if instance.status == 'published' and signal is post_save else None
+    if not raw and before != after:
+        archive.refresh({before, after} - {None})
+
+
+@receiver(bulk.posts_bulk_updated)
+def count_bulk_updated_archive_months(sender, rows, values, **kwargs):
+    if 'status' in values:
+        archive.posts_changed([row[0] for row in rows])
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Bookmark)
+@receiver(post_delete, sender=Bookmark)
+def count_post_event(sender, instance, signal, created=False, raw=False, **kwargs):
+    if not raw and (created or signal is post_delete):
+        kind = {Like: 'likes', Comment: 'comments', Bookmark: 'bookmarks'}[sender]
+        analytics.record_on_commit(instance.post_id, kind, 1 if created else -1)
+
+
+@receiver(post_save, sender=Post)
+def remember_saved_listing(sender, instance, **kwargs):
+    # Connected last: the receivers above compare against the state loaded from the database
+    instance._loaded_listing = (instance.status, instance.category_id, instance.publish_date)
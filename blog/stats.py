@@ -0,0 +1,61 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+# Per-process buffer of request timings, flushed to RequestStat periodically so the
+# sampled fast path never writes to the database itself.
+_buffer = {}
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def record_request(timing):
+    global _last_flush
+    with _lock:
+        agg = _buffer.setdefault(timing['url_name'], {
+            'hits': 0, 'total_ms': 0.0, 'db_ms': 0.0, 'render_ms': 0.0,
+            'queries': 0, 'max_queries': 0, 'duplicate_queries': 0,
+        })
+        agg['hits'] += 1
+        agg['total_ms'] += timing['total_ms']
+        agg['db_ms'] += timing['db_ms']
+        agg['render_ms'] += timing['render_ms']
+        agg['queries'] += timing['queries']
+        agg['max_queries'] = max(agg['max_queries'], timing['queries'])
+        agg['duplicate_queries'] += timing['duplicate_queries']
+        interval = getattr(settings, 'REQUEST_TIMING_FLUSH_INTERVAL', 60)
+        if time.monotonic() - _last_flush < interval:
+            return
+        pending = dict(_buffer)
+        _buffer.clear()
+        _last_flush = time.monotonic()
+    flush(pending)
+
+
+def flush(pending=None):
+    """Add buffered per-URL-name totals to the RequestStat table."""
+    from .models import RequestStat
+
+    if pending is None:
+        with _lock:
+            pending = dict(_buffer)
+            _buffer.clear()
+    now = timezone.now()
+    for url_name, agg in pending.items():
+        stat, created = RequestStat.objects.get_or_create(url_name=url_name, defaults=dict(agg, last_seen=now))
+        if created:
+            continue
+        RequestStat.objects.filter(pk=stat.pk).update(
+            hits=F('hits') + agg['hits'],
+            total_ms=F('total_ms') + agg['total_ms'],
+            db_ms=F('db_ms') + agg['db_ms'],
+            render_ms=F('render_ms') + agg['render_ms'],
+            queries=F('queries') + agg['queries'],
+            max_queries=Greatest('max_queries', agg['max_queries']),
+            duplicate_queries=F('duplicate_queries') + agg['duplicate_queries'],
+            last_seen=now,
+        )
@@ -0,0 +1,144 @@
+"""
+Tag index: published posts per tag (PostTag) and per-tag counts (TagCount),
+kept in step with taggit's TaggedItem rows by the signals in blog/signals.py.
+
+Tag pages read PostTag instead of joining through taggit's generic relation,
+and the sidebar tag cloud is served from the cache.
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.dispatch import Signal
+from taggit.models import Tag, TaggedItem
+
+from .models import Post, PostTag, TagCount
+
+CLOUD_KEY = 'blog:tag-cloud'
+CLOUD_WEIGHTS = 5
+
+# Sent with the ids of the tags whose counts were recomputed, or None after a rebuild
+tag_counts_changed = Signal()
+
+
+def _tag_ids(post):
+    return set(
+        TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Post), object_id=post.pk)
+        .values_list('tag_id', flat=True)
+    )
+
+
+def sync_post(post):
+    """Bring the index rows of one post in line with its tags and status."""
+    wanted = _tag_ids(post) if post.status == 'published' else set()
+    with transaction.atomic():
+        current = dict(PostTag.objects.filter(post=post).values_list('tag_id', 'publish_date'))
+        stale = current.keys() - wanted
+        if stale:
+            PostTag.objects.filter(post=post, tag_id__in=stale).delete()
+        PostTag.objects.bulk_create([
+            PostTag(post=post, tag_id=tag_id, publish_date=post.publish_date) for tag_id in wanted - current.keys()
+        ])
+        if any(current[tag_id] != post.publish_date for tag_id in wanted & current.keys()):
+            PostTag.objects.filter(post=post).update(publish_date=post.publish_date)
+        refresh_counts(stale | (wanted - current.keys()))
+
+
+def sync_posts(post_ids):
+    """``sync_post`` for many posts with a fixed number of queries, after a bulk update."""
+    post_ids = set(post_ids)
+    dates = dict(Post.objects.filter(pk__in=post_ids, status='published').values_list('pk', 'publish_date'))
+    wanted = set(
+        TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Post), object_id__in=dates)
+        .values_list('object_id', 'tag_id')
+    )
+    with transaction.atomic():
+        current = {(post_id, tag_id): (pk, date) for pk, post_id, tag_id, date in
+                   PostTag.objects.filter(post_id__in=post_ids).values_list('pk', 'post_id', 'tag_id', 'publish_date')}
+        stale = current.keys() - wanted
+        if stale:
+            PostTag.objects.filter(pk__in=[current[key][0] for key in stale]).delete()
+        PostTag.objects.bulk_create([
+            PostTag(post_id=post_id, tag_id=tag_id, publish_date=dates[post_id]) for post_id, tag_id in wanted - current.keys()
+        ])
+        moved = {post_id for (post_id, tag_id), (pk, date) in current.items() if post_id in dates and date != dates[post_id]}
+        for post_id in moved:
+            PostTag.objects.filter(post_id=post_id).update(publish_date=dates[post_id])
+        refresh_counts({tag_id for _, tag_id in stale | (wanted - current.keys())})
+
+
+def refresh_counts(tag_ids):
+    """Recount the given tags from the index (an indexed COUNT per tag)."""
+    tag_ids = set(tag_ids)
+    if not tag_ids:
+        return
+    counts = dict(
+        PostTag.objects.filter(tag_id__in=tag_ids).order_by().values('tag').annotate(n=Count('pk')).values_list('tag', 'n')
+    )
+    TagCount.objects.filter(tag_id__in=tag_ids - counts.keys()).delete()
+    TagCount.objects.bulk_create(
+        [TagCount(tag_id=tag_id, post_count=n) for tag_id, n in counts.items()],
+        update_conflicts=True, unique_fields=['tag'], update_fields=['post_count'],
+    )
+    transaction.on_commit(invalidate_cloud)
+    tag_counts_changed.send(sender=TagCount, tag_ids=tag_ids)
+
+
+def rebuild():
+    """Recreate the whole index from TaggedItem; returns the number of index rows."""
+    content_type = ContentType.objects.get_for_model(Post)
+    published = Post.objects.filter(status='published')
+    rows = (
+        TaggedItem.objects.filter(content_type=content_type, object_id__in=published.values('pk'))
+        .values_list('object_id', 'tag_id')
+    )
+    dates = dict(published.values_list('pk', 'publish_date'))
+    with transaction.atomic():
+        PostTag.objects.all().delete()
+        TagCount.objects.all().delete()
+        PostTag.objects.bulk_create(
+            (PostTag(post_id=post_id, tag_id=tag_id, publish_date=dates[post_id]) for post_id, tag_id in rows.iterator()),
+            batch_size=1000,
+        )
+        TagCount.objects.bulk_create([
+            TagCount(tag_id=row['tag'], post_count=row['n'])
+            for row in PostTag.objects.order_by().values('tag').annotate(n=Count('pk'))
+        ], batch_size=1000)
+        transaction.on_commit(invalidate_cloud)
+        tag_counts_changed.send(sender=TagCount, tag_ids=None)
+    return PostTag.objects.count()
+
+
+def resolve(name):
+    """The tag matching ``name``, case-insensitively if TAGGIT_CASE_INSENSITIVE is set."""
+    lookup = 'name__iexact' if getattr(settings, 'TAGGIT_CASE_INSENSITIVE', False) else 'name'
+    return Tag.objects.filter(**{lookup: name}).order_by('pk').first()
+
+
+def cloud_queryset():
+    return TagCount.objects.filter(post_count__gt=0).select_related('tag').order_by('-post_count', 'tag')[:settings.TAG_CLOUD_SIZE]
+
+
+def tag_cloud():
+    """The most used tags as dicts with name, slug, count and a 1..5 weight; cached."""
+    cloud = cache.get(CLOUD_KEY)
+    if cloud is None:
+        rows = list(cloud_queryset())
+        high = rows[0].post_count if rows else 1
+        low = rows[-1].post_count if rows else 1
+        cloud = sorted((
+            {
+                'name': row.tag.name,
+                'slug': row.tag.slug,
+                'count': row.post_count,
+                'weight': 1 + (row.post_count - low) * (CLOUD_WEIGHTS - 1) // max(1, high - low),
+            }
+            for row in rows
+        ), key=lambda t: t['name'].lower())
+        cache.set(CLOUD_KEY, cloud, settings.TAG_CLOUD_TIMEOUT)
+    return cloud
+
+
+def invalidate_cloud():
+    cache.delete(CLOUD_KEY)
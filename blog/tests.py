@@ -1,3 +1,906 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import re
+import runpy
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import analytics, archive, autocomplete, export, importer, jobs, notifications, profiling, query_audit, ratelimit, revisions, routers, stats, urls as blog_urls
+from .bulk import update_posts
+from .models import ArchiveMonth, Profile, User, Category, Post, PostRevision, PostStatBucket, PostTag, RequestProfile, RequestStat, Comment, Like, Bookmark, Job
+
+
+# url name -> (method, anonymous query budget, authenticated query budget, max response bytes).
+# Anonymous requests to login-protected URLs are redirects and must not touch the DB.
+# Raise a budget only together with the change that needs it. The cache starts
+# empty in every test, so budgets include cache misses.
+BUDGETS = {
+    'post_list': ('get', 6, 10, 84_000),
+    'post_create': ('get', 0, 4, 36_000),
+    'post_detail': ('get', 7, 11, 54_000),
+    'post_update': ('get', 0, 8, 38_000),
+    'post_delete': ('get', 0, 6, 30_000),
+    'post_revisions': ('get', 0, 7, 30_000),
+    'post_revision': ('get', 0, 6, 36_000),
+    'category_posts': ('get', 4, 8, 57_000),
+    'archive_year': ('get', 2, 6, 86_000),
+    'archive_month': ('get', 2, 6, 86_000),
+    'subscribe': ('get', 0, 3, 35_000),
+    'process_subscription': ('post', 0, 5, 100),
+    'add_comment': ('post', 0, 5, 100),
+    'like_post': ('post', 0, 9, 100),
+    'search_suggest': ('get', 4, 7, 5_000),
+    'toggle_bookmark': ('post', 0, 6, 100),
+    'toggle_follow': ('post', 0, 8, 100),
+    'following': ('get', 0, 8, 70_000),
+    'notifications': ('get', 0, 10, 60_000),
+    'notifications_api': ('get', 0, 4, 10_000),
+    'bookmarks': ('get', 0, 5, 52_000),
+    'profile': ('get', 0, 9, 42_000),
+    'post_feed': ('get', 1, 4, 12_000),
+    'category_feed': ('get', 2, 5, 12_000),
+}
+
+# Variants of post_list that take a different code path
+LIST_VARIANTS = {
+    'search': {'q': 'word'},
+    'category': {'category': 'web-development'},
+    'tag': {'tag': 'python'},
+    'tag (case-insensitive)': {'tag': 'PYTHON'},
+    'page 2': {'page': 2},
+}
+
+
+def format_queries(queries):
+    """Numbered list of captured queries, marking repeats to make N+1s obvious."""
+    seen = {}
+    lines = []
+    for i, query in enumerate(queries, 1):
+        sql = query['sql']
+        repeat = f'  [repeat of #{seen[sql]}]' if sql in seen else ''
+        seen.setdefault(sql, i)
+        lines.append(f'{i:>3}. ({query["time"]}s) {sql}{repeat}')
+    return '\n'.join(lines)
+
+
+def flaky(fail):
+    if fail:
+        raise ValueError('try again')
+
+
+# Analytics are only flushed where a test asks, so budgets never include a flush
+@override_settings(REQUEST_TIMING_SAMPLE_RATE=0, PROFILE_SAMPLE_RATE=0, ANALYTICS_FLUSH_INTERVAL=86400)
+class BlogTestCase(TestCase):
+    """Two dozen posts by one author, with comments, likes, bookmarks and a follower."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', email='author@example.com', password='pw', role='author')
+        cls.reader = User.objects.create_user(username='reader', email='reader@example.com', password='pw')
+        others = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='pw')
+            for i in range(6)
+        ]
+        categories = list(Category.objects.order_by('pk'))
+        for i in range(24):
+            post = Post.objects.create(
+                title=f'Post number {i}', slug=f'post-{i}', author=cls.author, body='word ' * 600,
+                category=categories[i % len(categories)], access_level='premium' if i % 4 == 0 else 'free',
+                status='draft' if i % 10 == 9 else 'published',
+            )
+            post.tags.add('python', 'django', f'topic{i % 5}')
+            for user in others[:4]:
+                comment = Comment.objects.create(post=post, author=user, body='Nice post')
+                Comment.objects.create(post=post, author=cls.author, body='Thanks', parent=comment)
+                Like.objects.create(post=post, user=user)
+            Bookmark.objects.create(post=post, user=cls.reader)
+            Bookmark.objects.create(post=post, user=cls.author)
+        cls.reader.profile.follows.add(cls.author.profile)
+        cls.post = Post.objects.get(slug='post-1')
+        cls.category = categories[0]
+
+    def setUp(self):
+        cache.clear()
+        # Counts left in the buffer would be flushed at exit, after the test database is gone
+        self.addCleanup(analytics._buffer.clear)
+
+    def url_for(self, name):
+        if name == 'toggle_follow':
+            return reverse(name, args=['user0'])
+        if name in ('archive_year', 'archive_month'):
+            date = timezone.localtime(self.post.publish_date)
+            return reverse(name, args=[date.year, date.month][:2 if name == 'archive_month' else 1])
+        if name == 'post_revision':
+            return reverse(name, args=[self.post.slug, 1])
+        if name in ('post_detail', 'post_update', 'post_delete', 'post_revisions', 'add_comment', 'like_post', 'toggle_bookmark'):
+            return reverse(name, args=[self.post.slug])
+        if name in ('category_posts', 'category_feed'):
+            return reverse(name, args=[self.category.slug])
+        if name == 'search_suggest':
+            return reverse(name) + '?q=post'
+        return reverse(name)
+
+    def request(self, method, url, data=None):
+        data = data or ({'body': 'A comment'} if method == 'post' else {})
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data)
+        return response, ctx.captured_queries
+
+    def assertWithinBudget(self, label, response, queries, max_queries, max_bytes):
+        self.assertLess(response.status_code, 400, f'{label}: unexpected status {response.status_code}')
+        if len(queries) > max_queries:
+            self.fail(
+                f'{label}: {len(queries)} queries, budget is {max_queries}\n{format_queries(queries)}'
+            )
+        size = len(response.content)
+        self.assertLessEqual(size, max_bytes, f'{label}: {size} bytes rendered, budget is {max_bytes}')
+
+
+class QueryBudgetTests(BlogTestCase):
+    """Upper bounds on queries and response size for every URL in blog/urls.py."""
+
+    def test_every_url_has_a_budget(self):
+        names = {p.name for p in blog_urls.urlpatterns if p.name}
+        self.assertEqual(names - set(BUDGETS), set(), 'Add a query budget for new URLs')
+
+    def test_anonymous_budgets(self):
+        for name, (method, anon_budget, _, max_bytes) in BUDGETS.items():
+            with self.subTest(url=name):
+                response, queries = self.request(method, self.url_for(name))
+                self.assertWithinBudget(f'{name} (anonymous)', response, queries, anon_budget, max_bytes)
+
+    def test_authenticated_budgets(self):
+        self.client.force_login(self.author)
+        for name, (method, _, auth_budget, max_bytes) in BUDGETS.items():
+            with self.subTest(url=name):
+                response, queries = self.request(method, self.url_for(name))
+                self.assertWithinBudget(f'{name} (authenticated)', response, queries, auth_budget, max_bytes)
+
+    def test_post_list_variants(self):
+        _, anon_budget, auth_budget, max_bytes = BUDGETS['post_list']
+        for user in (None, self.reader):
+            if user:
+                self.client.force_login(user)
+            for label, params in LIST_VARIANTS.items():
+                with self.subTest(variant=label, authenticated=bool(user)):
+                    response, queries = self.request('get', reverse('post_list'), params)
+                    budget = auth_budget if user else anon_budget
+                    self.assertWithinBudget(f'post_list {label}', response, queries, budget, max_bytes)
+
+    def test_post_detail_revalidation_skips_rendering(self):
+        url = self.url_for('post_detail')
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # validators + view count only
+        self.assertLessEqual(len(ctx.captured_queries), 2, format_queries(ctx.captured_queries))
+
+
+class RequestTimingTests(BlogTestCase):
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1, REQUEST_TIMING_FLUSH_INTERVAL=86400)
+    def test_sampled_requests_get_server_timing_and_buffered_stats(self):
+        stats.flush()
+        url = reverse('post_detail', args=[self.post.slug])
+        self.client.force_login(self.reader)
+        with CaptureQueriesContext(connection) as ctx, self.assertLogs('blog.perf', 'INFO') as logs:
+            response = self.client.get(url)
+        # Including the session, user and profile queries of the middleware
+        queries = len(ctx.captured_queries)
+        header = response['Server-Timing']
+        self.assertEqual(re.findall(r'(\w+);dur=', header), ['db', 'tpl', 'view', 'total'])
+        self.assertIn(f'desc="{queries} queries, 0 duplicate"', header)
+        self.assertEqual(json.loads(logs.records[0].getMessage())['queries'], queries)
+        self.assertFalse(RequestStat.objects.exists())  # buffered until the flush interval passes
+
+        with self.assertLogs('blog.perf', 'INFO'):
+            self.client.get(url)
+        stats.flush()
+        stat = RequestStat.objects.get(url_name='post_detail')
+        self.assertEqual((stat.hits, stat.max_queries), (2, queries))
+        with self.settings(REQUEST_TIMING_SAMPLE_RATE=0):
+            self.assertNotIn('Server-Timing', self.client.get(url))
+
+
+class MetricsTests(BlogTestCase):
+    def sample(self, text, series):
+        for line in text.splitlines():
+            if line.startswith(series + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_are_exposed_behind_the_bearer_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        series = 'http_requests_total{view="post_list",method="GET",status="200"}'
+        before = self.sample(self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret').content.decode(), series)
+        self.client.get(reverse('post_list'))
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertEqual(self.sample(text, series), before + 1)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="post_list",le="+Inf"}', text)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_without_a_token_are_for_staff(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ProfilingTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.enterContext(self.settings(PROFILE_DIR=root))
+
+    def test_profiles_need_staff_or_a_signed_token(self):
+        url = reverse('post_list')
+        token = io.StringIO()
+        call_command('profile_token', stdout=token, stderr=io.StringIO())
+        token = token.getvalue().strip()
+        self.assertNotIn('X-Profile-Id', self.client.get(url, HTTP_X_PROFILE_TOKEN=token + 'x'))
+        self.client.force_login(self.reader)
+        self.assertNotIn('X-Profile-Id', self.client.get(url, {'_profile': 1}))
+        self.assertFalse(RequestProfile.objects.exists())
+
+        profile = RequestProfile.objects.get(pk=self.client.get(url, HTTP_X_PROFILE_TOKEN=token)['X-Profile-Id'])
+        self.assertEqual((profile.trigger, profile.url_name, profile.status_code), ('token', 'post_list', 200))
+        self.assertIn('cumulative', profiling.summarize(os.path.join(settings.PROFILE_DIR, profile.filename)))
+        with self.settings(PROFILE_TOKEN_MAX_AGE=-1):
+            self.assertNotIn('X-Profile-Id', self.client.get(url, HTTP_X_PROFILE_TOKEN=token))
+
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True))
+        profile = RequestProfile.objects.get(pk=self.client.get(url, {'_profile': 1})['X-Profile-Id'])
+        self.assertEqual(profile.trigger, 'staff')
+
+
+class BenchmarkTests(BlogTestCase):
+    @override_settings(RATELIMITS={'like_post': '3/m', 'toggle_bookmark': '3/m'})
+    def test_benchmark_scenarios_succeed(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        output = os.path.join(root, 'results.json')
+        # post_list pages past the fixture's few would 404
+        call_command(
+            'benchmark', 'post_detail', 'like_post', 'toggle_bookmark', iterations=10, warmup=0, output=output, baseline=os.path.join(root, 'none.json'),
+            stdout=io.StringIO(),
+        )
+        with open(output) as f:
+            results = json.load(f)['results']
+        self.assertEqual({name: stats['errors'] for name, stats in results.items() if stats['errors']}, {})
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REQUEST_TIMING_SAMPLE_RATE=0, PROFILE_SAMPLE_RATE=0, ANALYTICS_FLUSH_INTERVAL=86400)
+class ReplicaRoutingTests(TransactionTestCase):
+    """A SQLite primary and a SQLite file replica; not a TestCase, whose transaction keeps every read on the primary."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added after the test databases are set up, so the runner leaves the file alone
+        cls.root = tempfile.mkdtemp()
+        connections.settings['replica1'] = {
+            **connections['default'].settings_dict, 'NAME': os.path.join(cls.root, 'replica.sqlite3'),
+        }
+        cls.databases = {'default', 'replica1'}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica1'].close()
+        del connections['replica1']
+        del connections.settings['replica1']
+        shutil.rmtree(cls.root)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(analytics._buffer.clear)
+        author = User.objects.create_user(username='author', email='author@example.com', password='pw', role='author')
+        self.reader = User.objects.create_user(username='reader', email='reader@example.com', password='pw')
+        self.post = Post.objects.create(title='Primary title', slug='routed', author=author, body='Body', status='published')
+        # The replica is a snapshot of the primary that then lags behind it
+        connections['default'].ensure_connection()
+        replica = sqlite3.connect(connections['replica1'].settings_dict['NAME'])
+        connections['default'].connection.backup(replica)
+        replica.execute("UPDATE blog_post SET title = 'Replica title'")
+        replica.commit()
+        replica.close()
+
+    def test_marked_views_read_from_the_replica_until_the_client_writes(self):
+        url = reverse('post_detail', args=[self.post.slug])
+        with CaptureQueriesContext(connections['replica1']) as ctx:
+            self.assertContains(self.client.get(url), 'Replica title')
+        self.assertTrue(ctx.captured_queries)
+        self.assertContains(self.client.get(reverse('post_feed')), 'Replica title')
+
+        self.client.force_login(self.reader)
+        response = self.client.post(reverse('like_post', args=[self.post.slug]))
+        self.assertEqual(response.cookies['db_pin']['max-age'], settings.REPLICA_PIN_SECONDS)
+        with CaptureQueriesContext(connections['replica1']) as ctx:
+            self.assertContains(self.client.get(url), 'Primary title')
+        self.assertEqual(ctx.captured_queries, [])
+
+    @override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+    def test_reads_stay_on_the_replica_picked_for_the_request(self):
+        router = routers.ReplicaRouter()
+        picked = []
+        for _ in range(20):
+            token = routers.start_replica_reads()
+            try:
+                aliases = {router.db_for_read(Post) for _ in range(10)}
+            finally:
+                routers.stop_replica_reads(token)
+            self.assertEqual(len(aliases), 1)
+            picked.extend(aliases)
+        self.assertEqual(set(picked), {'replica1', 'replica2'})
+        self.assertIsNone(router.db_for_read(Post))
+
+
+class QueryAuditTests(BlogTestCase):
+    def test_plans_with_scans_and_temp_sorts_are_flagged(self):
+        plan = '\n'.join([
+            '3 0 0 SCAN blog_comment',
+            '7 0 0 SEARCH blog_post USING INDEX post_status_date_idx (status=?)',
+            '12 0 0 USE TEMP B-TREE FOR RIGHT PART OF ORDER BY',
+            '15 0 0 USE TEMP B-TREE FOR GROUP BY',
+        ])
+        self.assertEqual(query_audit.find_problems(plan, 'sqlite'), [
+            'full scan of blog_comment', 'temp B-tree for RIGHT PART OF ORDER BY', 'temp B-tree for GROUP BY',
+        ])
+        plans = {label: queryset.explain() for label, queryset in query_audit.audit_querysets()}
+        self.assertIn('post_list search', plans)
+
+
+class SearchTests(BlogTestCase):
+    def test_search_suggestions_are_served_from_memory(self):
+        url = reverse('search_suggest')
+        self.client.get(url, {'q': 'po'})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'q': 'NUMBER 1'})
+        self.assertEqual(len(ctx.captured_queries), 0, format_queries(ctx.captured_queries))
+        labels = [r['label'] for r in response.json()['results']]
+        self.assertIn('Post number 1', labels)
+        self.assertNotIn('Post number 9', labels)  # draft
+
+    def test_search_suggestions_rank_every_kind(self):
+        autocomplete.suggest('de')
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                Post.objects.create(title=f'Deploy step {i}', slug=f'deploy-{i}', author=self.author, body='Steps')
+        with mock.patch.object(autocomplete, 'MAX_SCAN', 5):
+            response = self.client.get(reverse('search_suggest'), {'q': 'de'})
+        results = [(r['type'], r['label']) for r in response.json()['results']]
+        # Categories rank first however many posts share the prefix
+        self.assertEqual(results[0], ('category', 'DevOps & Cloud'))
+        self.assertIn(('post', 'Deploy step 0'), results)
+
+    def test_search_facets_are_counted_once_per_query(self):
+        url = reverse('post_list')
+
+        def counts(response, name):
+            group = next(g for g in response.context['facets'] if g['name'] == name)
+            return {v['value']: v['count'] for v in group['values']}
+
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(url, {'q': 'Post number'})
+        self.assertEqual(response.context['paginator'].count, 22)
+        self.assertEqual(counts(response, 'access'), {'free': 16, 'premium': 6})
+        self.assertEqual(counts(response, 'author'), {'author': 22})
+        with CaptureQueriesContext(connection) as again:
+            response = self.client.get(url, {'q': '  post NUMBER', 'page': 2})
+        # The page and the featured post; the facet counts and the total come from the cache
+        self.assertLessEqual(len(again), 2, format_queries(again.captured_queries))
+        # Drilling down counts from the same cached posts
+        with CaptureQueriesContext(connection) as drill:
+            response = self.client.get(url, {'q': 'post number', 'access': 'premium'})
+        self.assertLessEqual(len(drill), 2, format_queries(drill.captured_queries))
+        self.assertEqual(response.context['paginator'].count, 6)
+        self.assertEqual(len(response.context['posts']), 6)
+        # A facet is not narrowed by its own filter
+        self.assertEqual(counts(response, 'access'), {'free': 16, 'premium': 6})
+        self.assertEqual(counts(response, 'tag')['python'], 6)
+        response = self.client.get(url, {'q': 'post number', 'access': 'premium', 'tag': 'Topic0'})
+        self.assertEqual(response.context['paginator'].count, 2)
+        self.assertEqual(counts(response, 'access'), {'free': 3, 'premium': 2})
+        self.assertEqual(counts(response, 'tag')['topic1'], 1)
+
+        # Draft edits leave the cached posts alone
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.get(slug='post-9').save()
+        with CaptureQueriesContext(connection) as drill:
+            self.client.get(url, {'q': 'post number', 'access': 'premium'})
+        self.assertLessEqual(len(drill), 2, format_queries(drill.captured_queries))
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.get(slug='post-1')
+            post.access_level = 'premium'
+            post.save()
+        response = self.client.get(url, {'q': 'post number', 'access': 'premium'})
+        self.assertEqual(counts(response, 'access'), {'free': 15, 'premium': 7})
+
+
+class RevisionTests(BlogTestCase):
+    def test_revisions_are_stored_as_deltas_between_snapshots(self):
+        paragraphs = [' '.join(hashlib.md5(f'{i}:{j}'.encode()).hexdigest() for j in range(20)) for i in range(30)]
+        post = Post.objects.create(title='History', slug='history', author=self.author, body='\n'.join(paragraphs))
+        texts = [post.body]
+        for i in range(24):
+            paragraphs[i] = f'Edited paragraph {i}'
+            post.body = '\n'.join(paragraphs)
+            post.save()
+            texts.append(post.body)
+        post.save()  # nothing changed
+        stored = list(post.revisions.order_by('number'))
+        self.assertEqual(len(stored), 25)
+        self.assertEqual([r.number for r in stored if r.is_snapshot], [1, 11, 21])
+        self.assertLess(max(len(r.data) for r in stored if not r.is_snapshot) * 50, len(stored[0].data))
+        with self.assertNumQueries(1):
+            found = revisions.get(post.pk, 9, 10)
+        self.assertEqual((found[9].body, found[10].body), (texts[8], texts[9]))
+
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('post_revision', args=[post.slug, 10]))
+        self.assertEqual(response.context['lines'].count(('+', 'Edited paragraph 8')), 1)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(reverse('post_revisions', args=[post.slug])).status_code, 403)
+
+        call_command('prune_revisions', keep=5, stdout=io.StringIO())
+        kept = list(post.revisions.order_by('number'))
+        self.assertEqual([(r.number, r.is_snapshot) for r in kept[:2]], [(21, True), (22, False)])
+        self.assertEqual(revisions.get(post.pk, 25)[25].body, texts[24])
+        self.client.force_login(self.author)
+        url = reverse('post_revision', args=[post.slug, 23])
+        for against in ('-3', '0', '23', '40', '5'):
+            response = self.client.get(url, {'against': against})
+            self.assertEqual(response.context['base'].number, 22, against)
+        # Diffed against nothing once the revision before it is pruned
+        self.assertIsNone(self.client.get(reverse('post_revision', args=[post.slug, 21])).context['base'])
+        self.assertEqual(PostRevision.objects.filter(post=self.post).count(), 1)
+
+
+class ArchiveTests(BlogTestCase):
+    def test_synthetic_posts_are_counted_in_the_archive(self):
+        call_command(
+            'seed_synthetic', users=4, authors=2, tags=3, posts=40, comments=5, likes=5, bookmarks=5, stdout=io.StringIO(),
+        )
+        months = ArchiveMonth.objects.values_list('year', 'month', 'post_count')
+        published = Post.objects.filter(status='published')
+        self.assertEqual(
+            {(year, month): n for year, month, n in months},
+            {(m.year, m.month): n for m, n in archive.per_month(published)},
+        )
+        self.assertEqual(sum(n for _, _, n in months), published.count())
+
+    def test_archive_counts_follow_publishing_and_redating(self):
+        def counts():
+            return {(m.year, m.month): m.post_count for m in ArchiveMonth.objects.all()}
+
+        self.assertEqual(sum(counts().values()), 22)
+        self.assertEqual(counts(), {(m.year, m.month): n for m, n in archive.per_month(Post.objects.filter(status='published'))})
+        now = timezone.localtime(self.post.publish_date)
+        earlier = (2020, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.publish_date = self.post.publish_date.replace(year=2020, month=2, day=10)
+            self.post.save()
+        self.assertEqual(counts()[earlier], 1)
+        self.assertEqual(counts()[(now.year, now.month)], 21)
+        self.assertEqual([y['year'] for y in archive.months()], [now.year, 2020])
+
+        draft = Post.objects.get(slug='post-9')
+        with self.captureOnCommitCallbacks(execute=True):
+            draft.publish_date = self.post.publish_date
+            draft.status = 'published'
+            draft.save()
+            self.post.delete()
+        self.assertEqual(counts()[earlier], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            update_posts(Post.objects.filter(pk=draft.pk), status='draft')
+        self.assertNotIn(earlier, counts())
+
+        url = reverse('archive_month', args=[now.year, now.month])
+        response = self.client.get(url)
+        self.assertEqual(len(response.context['posts']), settings.ARCHIVE_PAGE_SIZE)
+        older = self.client.get(url, {'before': response.context['next_cursor']}).context['posts']
+        self.assertEqual(len(older), 21 - settings.ARCHIVE_PAGE_SIZE)
+        self.assertLess(older[0].publish_date, response.context['posts'][-1].publish_date)
+        self.assertEqual(self.client.get(reverse('archive_month', args=[now.year, 13])).status_code, 404)
+
+    def test_archive_urls_out_of_range_are_not_errors(self):
+        self.assertEqual(self.client.get(reverse('archive_year', args=[9999])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('archive_month', args=[9999, 12])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('archive_month', args=[9998, 12])).status_code, 200)
+        for before in ('99999999999999999999-1', '1-99999999999999999999', 'junk'):
+            with self.subTest(before=before):
+                response = self.client.get(reverse('archive_month', args=[2024, 1]), {'before': before})
+                self.assertEqual(response.status_code, 200)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(reverse('following'), {'before': '99999999999999999999-1'}).status_code, 200)
+
+
+class PostCardTests(BlogTestCase):
+    def test_post_cards_are_rerendered_after_a_change(self):
+        url = reverse('post_list')
+        first, second = self.client.get(url).context['posts'][:2]
+        self.assertNotIn('5\n', first.card_html)
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=first, user=self.reader)
+        first_card, second_card = [p.card_html for p in self.client.get(url).context['posts'][:2]]
+        self.assertIn('5\n', first_card)
+        self.assertEqual(second_card, second.card_html)
+        self.client.force_login(self.reader)
+        response = self.client.get(url)
+        self.assertEqual(response.context['bookmarked_ids'], {p.pk for p in response.context['posts']})
+
+
+class FollowingFeedTests(BlogTestCase):
+    def test_following_feed_pages_by_cursor(self):
+        self.client.force_login(self.reader)
+        _, _, auth_budget, max_bytes = BUDGETS['following']
+        expected = list(Post.objects.filter(status='published').order_by('-publish_date', '-pk').values_list('pk', flat=True))
+        for depth in (200, 5):
+            cache.clear()
+            with self.subTest(author_depth=depth), self.settings(FEED_AUTHOR_DEPTH=depth):
+                seen, params = [], {}
+                while True:
+                    response, queries = self.request('get', reverse('following'), params)
+                    self.assertWithinBudget('following', response, queries, auth_budget, max_bytes)
+                    seen += [p.pk for p in response.context['posts']]
+                    if not response.context['next_cursor']:
+                        break
+                    params = {'before': response.context['next_cursor']}
+                self.assertEqual(seen, expected)
+
+    def test_follow_toggle_updates_the_cached_feed(self):
+        self.client.force_login(self.reader)
+        self.client.get(reverse('following'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('toggle_follow', args=[self.author.username]))
+        self.assertEqual(response.json(), {'following': False})
+        response = self.client.get(reverse('following'))
+        self.assertEqual(response.context['posts'], [])
+        self.assertEqual(response.context['following_count'], 0)
+
+
+class NotificationTests(BlogTestCase):
+    def test_publishing_and_replying_notify_in_batches(self):
+        Job.objects.all().delete()  # fan-outs queued by the fixtures
+        self.client.force_login(self.author)
+        comment = Comment.objects.filter(post=self.post, parent__isnull=True).exclude(author=self.author).first()
+        with self.settings(NOTIFICATION_BATCH_SIZE=1):
+            self.client.post(reverse('post_create'), {
+                'title': 'Fresh post', 'body': 'Body', 'category': self.category.pk, 'status': 'published', 'access_level': 'free',
+            })
+            self.client.post(reverse('add_comment', args=[self.post.slug]), {'body': 'Agreed', 'parent': comment.pk})
+            self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual(comment.replies.filter(body='Agreed').count(), 1)
+        self.assertEqual(User.objects.get(pk=comment.author_id).profile.unread_notifications, 1)
+        self.assertEqual(self.reader.notifications.get().kind, 'post')
+
+        self.client.force_login(self.reader)
+        self.reader.refresh_from_db()
+        data = self.client.get(reverse('notifications_api')).json()
+        self.assertEqual((data['unread'], data['results'][0]['message']), (1, 'author published "Fresh post"'))
+        _, _, auth_budget, max_bytes = BUDGETS['notifications']
+        response, queries = self.request('get', reverse('notifications'))
+        self.assertWithinBudget('notifications', response, queries, auth_budget, max_bytes)
+        self.assertEqual(self.client.get(reverse('notifications_api')).json()['unread'], 0)
+
+    def test_profile_saves_keep_concurrent_unread_counts(self):
+        self.client.force_login(self.reader)
+        user = User.objects.get(pk=self.reader.pk)
+        user.profile.bio = 'Loaded before the fan-out'
+        notifications.deliver([self.reader.pk], 'post', self.author, self.post)
+        user.profile.save()
+        user.save()
+        self.client.post(reverse('process_subscription'))
+        profile = Profile.objects.get(user=self.reader)
+        self.assertEqual((profile.unread_notifications, profile.bio, profile.is_subscribed), (1, 'Loaded before the fan-out', True))
+
+    def test_pages_open_the_notification_socket_only_with_live_delivery(self):
+        self.assertFalse(settings.NOTIFICATION_LIVE)  # the in-memory channel layer
+        self.client.force_login(self.reader)
+        self.assertNotContains(self.client.get(reverse('post_list')), '/ws/notifications/')
+        with self.settings(NOTIFICATION_LIVE=True):
+            self.assertContains(self.client.get(reverse('post_list')), '/ws/notifications/')
+
+
+class JobQueueTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        # Registered only while these tests run, so no other test sees it in JOBS
+        self.flaky_job = jobs.job(name='tests.flaky', max_attempts=2)(flaky)
+        self.addCleanup(jobs.JOBS.pop, 'tests.flaky')
+
+    def test_jobs_are_claimed_once_and_retried_with_backoff(self):
+        Job.objects.all().delete()
+        self.flaky_job.enqueue(True)
+        self.flaky_job.enqueue(fail=False)
+        ids = jobs.claim('a', 10)
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(jobs.claim('b', 10), [])
+        self.assertEqual([jobs.run_job(pk) for pk in ids], ['queued', 'done'])
+        retry = Job.objects.get(status='queued')
+        self.assertGreater(retry.run_at, retry.created_date)
+        self.assertEqual(jobs.run_pending(), 0)  # not due yet
+        Job.objects.filter(pk=retry.pk).update(run_at=retry.created_date)
+        self.assertEqual(jobs.run_pending(), 1)
+        retry.refresh_from_db()
+        self.assertEqual((retry.status, retry.attempts), ('failed', 2))
+        self.assertIn('try again', retry.last_error)
+
+
+class WorkerPoolTests(TransactionTestCase):
+    """Not a TestCase: the pool threads need the jobs committed to see them."""
+
+    def test_thread_pool_runs_claimed_jobs(self):
+        user = User.objects.create_user(username='worker', email='worker@example.com', password='pw')
+        post = Post.objects.create(title='Queued', slug='queued', author=user, body='Body', status='published')
+        Job.objects.all().delete()
+        for _ in range(4):
+            notifications.fan_out_post.enqueue(post.pk)
+        worker = jobs.Worker(concurrency=2, pool='thread', batch_size=4, poll_interval=0)
+        worker.run(once=True)
+        fan_outs = Job.objects.filter(name=notifications.fan_out_post.job_name)
+        self.assertEqual(list(fan_outs.values_list('status', flat=True).distinct()), ['done'])
+        self.assertGreaterEqual(worker.processed, 4)  # and any periodic jobs that came due
+
+
+class ConnectionSettingsTests(SimpleTestCase):
+    def database(self, **env):
+        with mock.patch.dict(os.environ, env):
+            for name in ('DB_POOL', 'DB_CONN_MAX_AGE', 'DB_CONN_HEALTH_CHECKS', 'DATABASE_URL', 'DATABASE_REPLICA_URLS'):
+                if name not in env:
+                    os.environ.pop(name, None)
+            return runpy.run_path(os.path.join(settings.BASE_DIR, 'core', 'settings.py'))['DATABASES']
+
+    def test_connections_are_closed_per_request_and_health_checked_by_default(self):
+        db = self.database()['default']
+        self.assertEqual((db['CONN_MAX_AGE'], db['CONN_HEALTH_CHECKS']), (0, True))
+        self.assertNotIn('pool', db.get('OPTIONS', {}))
+
+    def test_persistent_connections(self):
+        db = self.database(DB_CONN_MAX_AGE='60', DB_CONN_HEALTH_CHECKS='False')['default']
+        self.assertEqual((db['CONN_MAX_AGE'], db['CONN_HEALTH_CHECKS']), (60, False))
+
+    def test_pool_on_postgresql_only(self):
+        databases = self.database(
+            DB_POOL='True', DB_CONN_MAX_AGE='60', DB_POOL_MAX_SIZE='5',
+            DATABASE_URL='postgres://blog:pw@db/blog', DATABASE_REPLICA_URLS='sqlite:////tmp/replica.sqlite3',
+        )
+        primary, replica = databases['default'], databases['replica1']
+        self.assertEqual(primary['CONN_MAX_AGE'], 0)
+        self.assertEqual(primary['OPTIONS']['pool'], {'min_size': 2, 'max_size': 5, 'timeout': 10.0})
+        self.assertEqual(replica['CONN_MAX_AGE'], 60)
+        self.assertNotIn('pool', replica.get('OPTIONS', {}))
+
+
+class AdminTests(BlogTestCase):
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=10, STORAGES={
+        **settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_admin_changelists_page_by_key_and_bulk_update_posts(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        comments = reverse('admin:blog_comment_changelist')
+        with CaptureQueriesContext(connection) as ctx:
+            cl = self.client.get(comments).context['cl']
+        self.assertLessEqual(len(ctx), 6, format_queries(ctx.captured_queries))
+        self.assertTrue(cl.paginator.estimated)
+        older = self.client.get(comments + cl.next_url).context['cl']
+        self.assertLess(list(older.result_list)[0].pk, list(cl.result_list)[-1].pk)
+        response = self.client.get(reverse('admin:blog_post_changelist'), {'author__id__exact': self.author.pk})
+        self.assertContains(response, 'data-field-name="author"')
+
+        Job.objects.all().delete()
+        posts = reverse('admin:blog_post_changelist')
+        ids = list(Post.objects.filter(status='published').values_list('pk', flat=True)[:3])
+        self.client.post(posts, {'action': 'unpublish', '_selected_action': ids})
+        self.assertFalse(PostTag.objects.filter(post_id__in=ids).exists())
+        self.client.post(posts, {'action': 'publish', '_selected_action': ids})
+        self.assertEqual(PostTag.objects.filter(post_id__in=ids).count(), 9)
+        self.assertEqual(Job.objects.filter(name=notifications.fan_out_post.job_name).count(), 3)
+        category = Category.objects.exclude(posts__in=ids).first()
+        self.client.post(posts, {'action': 'recategorise', '_selected_action': ids, 'category': category.pk})
+        self.assertEqual(category.posts.filter(pk__in=ids).count(), 3)
+
+
+class PrepareTests(BlogTestCase):
+    def test_prepare_skips_steps_that_are_done(self):
+        def prepare():
+            out = io.StringIO()
+            call_command('prepare', steps='migrate,data,superuser', stdout=out)
+            return dict(line.split()[:2] for line in out.getvalue().splitlines() if line.endswith(' ms') and ' in ' not in line)
+
+        self.assertEqual(prepare(), {'migrate': 'skipped', 'data': 'skipped', 'superuser': 'done'})
+        self.assertEqual(prepare()['superuser'], 'skipped')
+        User.objects.filter(username='admin').update(password='changed-in-the-admin')
+        self.assertEqual(prepare()['superuser'], 'done')
+
+
+class StaticExportTests(BlogTestCase):
+    def test_static_export_rerenders_only_affected_pages(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with self.settings(STATIC_EXPORT_DIR=root):
+            premium = Post.objects.filter(status='published', access_level='premium').first()
+            stats = export.build(workers=1)
+            self.assertEqual(stats['failed'], 0)
+            page = os.path.join(root, 'post', premium.slug, 'index.html')
+            self.assertTrue(os.path.exists(page + '.gz'))
+            self.assertTrue(os.path.exists(os.path.join(root, 'feed', 'index.xml')))
+            with open(page) as f:
+                self.assertIn('Subscribe to unlock this article', f.read())
+            self.assertEqual(Post.objects.get(pk=premium.pk).view_count, 0)
+
+            Job.objects.all().delete()
+            Comment.objects.create(post=self.post, author=self.reader, body='Exported comment')
+            stats = export.export_changed(**Job.objects.get().kwargs)
+            self.assertLess(stats['rendered'], 10)
+            self.assertEqual(stats['written'], 1)
+            with open(os.path.join(root, 'post', self.post.slug, 'index.html')) as f:
+                self.assertIn('Exported comment', f.read())
+
+            self.post.status = 'draft'
+            self.post.save()
+            jobs.run_pending()
+            self.assertFalse(os.path.exists(os.path.join(root, 'post', self.post.slug, 'index.html')))
+
+
+class RateLimitTests(BlogTestCase):
+    @override_settings(RATELIMITS={'like_post': '3/m', 'login': '2/m'})
+    def test_rate_limits_answer_429_per_client(self):
+        url = reverse('like_post', args=[self.post.slug])
+        self.client.force_login(self.reader)
+        statuses = [self.client.post(url).status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        with self.assertNumQueries(3):
+            # Only the session, user and profile the other middleware load: the counters live in the cache
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(response.json()['retry_after'], int(response['Retry-After']))
+
+        # Other users and unlimited views are unaffected
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.assertEqual(self.client.post(reverse('toggle_bookmark', args=[self.post.slug])).status_code, 200)
+
+        # Anonymous clients are counted per address; GETs are never counted
+        self.client.logout()
+        login = reverse('login')
+        for _ in range(3):
+            self.assertEqual(self.client.get(login).status_code, 200)
+        data = {'username': 'reader', 'password': 'wrong'}
+        self.assertEqual(self.client.post(login, data).status_code, 200)
+        self.assertEqual(self.client.post(login, data, REMOTE_ADDR='10.0.0.2').status_code, 200)
+        self.assertEqual(self.client.post(login, data).status_code, 200)
+        response = self.client.post(login, data, HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 429)
+        self.assertContains(response, 'too many requests', status_code=429)
+        self.assertIn('Retry-After', response)
+
+        self.assertEqual(ratelimit.parse('100/hour'), (100, 3600))
+        # Half way into a window, half the previous window's requests (denied ones too) still count
+        self.assertEqual([ratelimit.hit('test', 'x', '4/m', now=119) for _ in range(5)], [0, 0, 0, 0, 1])
+        self.assertEqual([ratelimit.hit('test', 'x', '4/m', now=150) for _ in range(3)], [0, 6, 18])
+
+
+class MarkdownImportTests(BlogTestCase):
+    def test_markdown_import_is_bulk_and_idempotent(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(root, 'guides'))
+        for i in range(30):
+            with open(os.path.join(root, 'guides' if i % 2 else '', f'post-{i}.md'), 'w') as f:
+                f.write(
+                    f'---\ntitle: "Imported {i}"\ncategory: {"Offline Writing" if i % 3 else self.category.name}\n'
+                    f'tags: [python, Imported{i % 4}]\ndate: 2021-0{i % 9 + 1}-15\naccess: {"premium" if i == 0 else "free"}\n---\n'
+                    f'# Heading\n\nFirst paragraph of {i}.\n\n```\ncode <b>\n```\n'
+                )
+        with open(os.path.join(root, 'broken.md'), 'w') as f:
+            f.write('No front matter')
+        fan_outs = Job.objects.filter(name='blog.notifications.fan_out_post')
+        before = fan_outs.count()
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            stats = importer.Importer(root, author='author', workers=1).run()
+        self.assertEqual(stats, {'created': 30, 'updated': 0, 'unchanged': 0, 'failed': 1})
+        # Lookups, inserts and the bulk signal receivers, not a query per post
+        self.assertLess(len(queries), 60)
+        post = Post.objects.get(title='Imported 3')
+        self.assertEqual((post.slug, post.category, post.publish_date.month), ('imported-3', self.category, 4))
+        self.assertEqual(Category.objects.get(name='Offline Writing').posts.count(), 20)
+        self.assertIn('<pre><code>code &lt;b&gt;</code></pre>', post.body)
+        self.assertEqual(set(post.tags.names()), {'python', 'Imported3'})
+        self.assertTrue(PostTag.objects.filter(post=post, tag__name='Imported3').exists())
+        self.assertEqual(ArchiveMonth.objects.get(year=2021, month=4).post_count, 3)
+        self.assertEqual(fan_outs.count(), before)
+
+        with open(os.path.join(root, 'guides', 'post-3.md'), 'a') as f:
+            f.write('\nAn edit.\n')
+        stats = importer.Importer(root, author='author', workers=1).run()
+        self.assertEqual(stats, {'created': 0, 'updated': 1, 'unchanged': 29, 'failed': 1})
+        post = Post.objects.get(pk=post.pk)
+        self.assertEqual(post.slug, 'imported-3')
+        self.assertIn('An edit.', post.body)
+        self.assertEqual(Post.objects.filter(title__startswith='Imported').count(), 30)
+
+
+class AnalyticsTests(BlogTestCase):
+    def test_quiet_processes_still_flush_their_analytics(self):
+        class Stop(Exception):
+            pass
+
+        analytics.flush()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.url_for('post_detail'))
+        self.assertTrue(analytics._buffer)
+        # No more events come, but the interval passes
+        with mock.patch.object(analytics, '_last_flush', analytics._last_flush - 86400), \
+                mock.patch.object(analytics.time, 'sleep', side_effect=[None, Stop]), \
+                mock.patch.object(analytics, 'thread_connections', lambda fn: fn), \
+                mock.patch.object(analytics, 'flush') as flush:
+            with self.assertRaises(Stop):
+                analytics._flush_loop()
+        flush.assert_called_once_with()
+        self.assertTrue(analytics._flusher.is_alive())
+        analytics.flush()
+
+    def test_analytics_are_buffered_and_compacted_into_days(self):
+        analytics.flush()
+        before = PostStatBucket.objects.filter(post=self.post).count()
+        self.client.force_login(self.reader)
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                self.client.get(self.url_for('post_detail'))
+            self.client.post(self.url_for('like_post'))
+            self.client.post(self.url_for('add_comment'), {'body': 'Counted'})
+            self.client.post(self.url_for('toggle_bookmark'))
+        # Nothing is written until the buffer is flushed
+        self.assertEqual(PostStatBucket.objects.filter(post=self.post).count(), before)
+        with self.assertNumQueries(2):
+            analytics.flush()
+        hour = PostStatBucket.objects.get(post=self.post, period='hour', start=analytics.hour_of(timezone.now()))
+        self.assertEqual((hour.views, hour.likes, hour.comments, hour.bookmarks), (3, 1, 1, -1))
+
+        # Three days ago, in two hours of the same day
+        old = analytics.hour_of(timezone.now() - timezone.timedelta(days=3))
+        analytics.add('hour', {(self.post.pk, old): {'views': 5, 'likes': 1, 'comments': 0, 'bookmarks': 0}})
+        analytics.add('hour', {(self.post.pk, old.replace(hour=0)): {'views': 2, 'likes': 0, 'comments': 1, 'bookmarks': 0}})
+        analytics.add('hour', {(self.post.pk, old): {'views': 1, 'likes': 0, 'comments': 0, 'bookmarks': 0}})
+        self.assertEqual(analytics.compact(), 2)
+        day = PostStatBucket.objects.get(post=self.post, period='day')
+        self.assertEqual((day.start, day.views, day.likes, day.comments), (analytics.day_of(old), 8, 1, 1))
+
+        self.client.force_login(self.author)
+        with self.assertNumQueries(BUDGETS['profile'][2]):
+            response = self.client.get(reverse('profile') + f'?post={self.post.pk}')
+        dashboard = response.context['analytics']
+        self.assertEqual(dashboard['selected']['post_id'], self.post.pk)
+        self.assertEqual(dashboard['totals']['views'], 11)
+        self.assertEqual(dashboard['series'][-1]['views'], 3)
+        self.assertEqual(dashboard['series'][-4]['height'], 100)
+        self.assertIsNone(self.client.get(reverse('profile') + '?post=%C2%B2').context['analytics']['selected'])
+
+        self.client.force_login(User.objects.create_user('editor', 'editor@example.com', 'pw', role='admin'))
+        self.assertIn('analytics', self.client.get(reverse('profile')).context)
+        self.client.force_login(self.reader)
+        self.assertNotIn('analytics', self.client.get(reverse('profile')).context)
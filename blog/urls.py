@@ -1,6 +1,6 @@
 from django.urls import path
 from django.contrib.auth.decorators import login_required
-from . import views
+from . import feeds, views
 
 urlpatterns = [
     path('', views.PostListView.as_view(), name='post_list'),
@@ -8,12 +8,23 @@ urlpatterns = [
     path('post/<slug:slug>/', views.PostDetailView.as_view(), name='post_detail'),
     path('post/<slug:slug>/update/', login_required(views.PostUpdateView.as_view()), name='post_update'),
     path('post/<slug:slug>/delete/', login_required(views.PostDeleteView.as_view()), name='post_delete'),
+    path('post/<slug:slug>/revisions/', login_required(views.PostRevisionListView.as_view()), name='post_revisions'),
+    path('post/<slug:slug>/revisions/<int:number>/', login_required(views.PostRevisionDiffView.as_view()), name='post_revision'),
     path('category/<slug:slug>/', views.CategoryPostsView.as_view(), name='category_posts'),
+    path('archive/<int:year>/', views.ArchiveView.as_view(), name='archive_year'),
+    path('archive/<int:year>/<int:month>/', views.ArchiveView.as_view(), name='archive_month'),
+    path('feed/', feeds.LatestPostsFeed(), name='post_feed'),
+    path('category/<slug:slug>/feed/', feeds.CategoryFeed(), name='category_feed'),
     path('subscribe/', login_required(views.SubscribeView.as_view()), name='subscribe'),
     path('subscribe/process/', login_required(views.process_subscription), name='process_subscription'),
     path('post/<slug:slug>/comment/', login_required(views.add_comment), name='add_comment'),
+    path('api/search/suggest/', views.search_suggest, name='search_suggest'),
     path('api/post/<slug:slug>/like/', login_required(views.like_post), name='like_post'),
     path('api/post/<slug:slug>/bookmark/', login_required(views.toggle_bookmark), name='toggle_bookmark'),
+    path('api/author/<str:username>/follow/', login_required(views.toggle_follow), name='toggle_follow'),
+    path('following/', login_required(views.FollowingFeedView.as_view()), name='following'),
+    path('notifications/', login_required(views.NotificationListView.as_view()), name='notifications'),
+    path('api/notifications/', login_required(views.notifications_api), name='notifications_api'),
     path('bookmarks/', login_required(views.BookmarkListView.as_view()), name='bookmarks'),
     path('profile/', login_required(views.ProfileView.as_view()), name='profile'),
 ]
\ No newline at end of file
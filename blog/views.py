@@ -3,79 +3,238 @@ from django.views.generic import ListView, DetailView, CreateView, UpdateView, D
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse_lazy, reverse
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404, HttpResponse
 from django.views.decorators.http import require_POST
 from django.contrib import messages
-from django.db.models import Q, Count
+from django.conf import settings
+from django.db.models import Count, F, Max, Exists, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.crypto import constant_time_compare
 from datetime import date, timedelta
+import hashlib
 
-from .models import Post, Comment, Like, Profile, Category, Bookmark
+from . import analytics, archive, autocomplete, facets, feed, fragments, metrics, notifications, revisions, tagindex
+from .models import Post, Comment, Like, Profile, Category, Bookmark, Notification, User
 from .forms import CommentForm, PostForm, CustomUserCreationForm
 
 
+# Set in request.META by the static export (blog.export), whose renders are not views
+EXPORT_META = 'blog.static_export'
+
+
 def custom_403(request, exception=None):
     return render(request, '403.html', status=403)
 
 
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=401)
+    elif not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def with_counts(qs):
+    # Correlated subqueries instead of Count() joins: no GROUP BY over every matching
+    # post, so ORDER BY publish_date ... LIMIT can walk the (status, publish_date) index.
+    likes = Like.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(n=Count('pk')).values('n')
+    comments = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(n=Count('pk')).values('n')
+    return qs.annotate(
+        like_count=Coalesce(Subquery(likes), 0),
+        comment_count=Coalesce(Subquery(comments), 0),
+    )
+
+
+def sidebar_categories():
+    return Category.objects.annotate(post_count=Count('posts')).filter(post_count__gt=0)
+
+
+def featured_posts():
+    return Post.objects.filter(status='published').order_by('-view_count')
+
+
+def top_level_comments(post):
+    replies = Prefetch('replies', queryset=Comment.objects.select_related('author').order_by('created_date'))
+    return post.comments.filter(parent__isnull=True).select_related('author').prefetch_related(replies)
+
+
+def related_posts(post):
+    qs = Post.objects.filter(status='published').exclude(pk=post.pk)
+    if post.category_id:
+        qs = qs.filter(category_id=post.category_id)
+    return qs[:3]
+
+
 class UserRegisterView(CreateView):
     form_class = CustomUserCreationForm
     template_name = 'registration/register.html'
     success_url = reverse_lazy('login')
 
 
+def page_cards(request, posts):
+    """Attach cached card markup to ``posts``; returns the ids the user has bookmarked among them."""
+    fragments.attach_cards(posts, 'blog/includes/post_card.html')
+    if not (request.user.is_authenticated and posts):
+        return set()
+    return set(Bookmark.objects.filter(user=request.user, post__in=[p.pk for p in posts]).values_list('post_id', flat=True))
+
+
 class PostListView(ListView):
+    read_from_replica = True
     model = Post
     template_name = 'blog/post_list.html'
     context_object_name = 'posts'
     paginate_by = 9
 
     def get_queryset(self):
-        qs = Post.objects.filter(status='published').select_related('author', 'category').annotate(
-            like_count=Count('likes'),
-            comment_count=Count('comments'),
-        )
+        qs = with_counts(Post.objects.filter(status='published').select_related('author', 'category'))
         # Search
-        query = self.request.GET.get('q')
+        query = facets.clean(self.request.GET.get('q', ''))
+        self.facets = None
         if query:
-            qs = qs.filter(Q(title__icontains=query) | Q(body__icontains=query) | Q(tags__name__icontains=query)).distinct()
+            qs = qs.filter(facets.matching(query)).distinct()
         # Category filter
         cat = self.request.GET.get('category')
         if cat:
             qs = qs.filter(category__slug=cat)
-        # Tag filter
-        tag = self.request.GET.get('tag')
-        if tag:
-            qs = qs.filter(tags__name__in=[tag])
+        # Author filter
+        author = self.request.GET.get('author')
+        if author:
+            qs = qs.filter(author__username=author)
+        access = self.request.GET.get('access')
+        if access:
+            qs = qs.filter(access_level=access)
+        # Tag filter, through the tag index rather than taggit's generic relation
+        self.tag = None
+        name = self.request.GET.get('tag')
+        if name:
+            self.tag = tagindex.resolve(name)
+            if self.tag is None:
+                qs = qs.none()
+            else:
+                qs = qs.filter(tag_index__tag=self.tag).order_by('-tag_index__publish_date', '-pk')
+        if query:
+            # Counts for the results instead of the whole blog; they also give the page count
+            active = {name: self.request.GET.get(name) for name in facets.FACETS}
+            self.facets, self.result_count = facets.facets(query, {**active, 'tag': self.tag.name if self.tag else name})
         return qs
 
+    def get_paginator(self, *args, **kwargs):
+        paginator = super().get_paginator(*args, **kwargs)
+        if self.facets is not None:
+            paginator.count = self.result_count
+        return paginator
+
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx['categories'] = Category.objects.annotate(post_count=Count('posts')).filter(post_count__gt=0)
         ctx['search_query'] = self.request.GET.get('q', '')
+        ctx['facets'] = self.facets
+        if self.facets is None:
+            ctx['categories'] = sidebar_categories()
         ctx['active_category'] = self.request.GET.get('category', '')
-        ctx['active_tag'] = self.request.GET.get('tag', '')
+        ctx['active_tag'] = self.tag.name if self.tag else self.request.GET.get('tag', '')
+        ctx['active_author'] = self.request.GET.get('author', '')
+        ctx['active_access'] = self.request.GET.get('access', '')
+        ctx['tag_cloud'] = tagindex.tag_cloud()
+        ctx['archive'] = archive.months()
         # Featured post (most viewed)
-        ctx['featured_post'] = Post.objects.filter(status='published').order_by('-view_count').first()
-        if self.request.user.is_authenticated:
-            ctx['bookmarked_ids'] = list(Bookmark.objects.filter(user=self.request.user).values_list('post_id', flat=True))
-        else:
-            ctx['bookmarked_ids'] = []
+        ctx['featured_post'] = featured_posts().first()
+        ctx['bookmarked_ids'] = page_cards(self.request, ctx['posts'])
         return ctx
 
 
 class PostDetailView(DetailView):
+    read_from_replica = True
     model = Post
     template_name = 'blog/post_detail.html'
 
+    def get(self, request, *args, **kwargs):
+        # Revalidate against cheap validators before loading and rendering the page
+        validators = self.get_validators()
+        if validators is None:
+            raise Http404('No post found matching the query')
+        etag, last_modified = validators
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        else:
+            self.count_view(self.pk)
+        response.headers['ETag'] = etag
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(last_modified)
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    def get_validators(self):
+        """
+        Return ``(etag, last_modified)`` for the page, or None if the post does not exist.
+
+        The public part of the page depends on the post itself, its comments and its
+        like counter, so those are folded into one query. Signed-in readers also see
+        their own like/bookmark/paywall state, which is mixed into the ETag only.
+        View counts are deliberately left out, hence the weak ETag.
+        """
+        likes = Like.objects.filter(post=OuterRef('pk')).order_by().values('post')
+        comments = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post')
+        qs = Post.objects.filter(slug=self.kwargs['slug']).annotate(
+            like_total=Subquery(likes.annotate(n=Count('pk')).values('n')),
+            like_latest=Subquery(likes.annotate(m=Max('created_date')).values('m')),
+            comment_total=Subquery(comments.annotate(n=Count('pk')).values('n')),
+            comment_latest=Subquery(comments.annotate(m=Max('pk')).values('m')),
+            comment_latest_date=Subquery(comments.annotate(m=Max('created_date')).values('m')),
+        )
+        user = self.request.user
+        fields = ['pk', 'updated_date', 'like_total', 'like_latest', 'comment_total', 'comment_latest', 'comment_latest_date']
+        if user.is_authenticated:
+            qs = qs.annotate(
+                user_liked=Exists(Like.objects.filter(post=OuterRef('pk'), user=user)),
+                user_bookmarked=Exists(Bookmark.objects.filter(post=OuterRef('pk'), user=user)),
+            )
+            fields += ['author_id', 'user_liked', 'user_bookmarked']
+        row = qs.values(*fields).first()
+        if row is None:
+            return None
+        self.pk = row['pk']
+        self.validator_row = row
+        parts = [
+            row['pk'], row['updated_date'].isoformat(),
+            row['comment_total'] or 0, row['comment_latest'] or 0, row['like_total'] or 0,
+        ]
+        last_modified = None
+        if user.is_authenticated:
+            parts += [
+                user.pk, getattr(self.request, 'is_premium_user', False), row['author_id'] == user.pk,
+                row['user_liked'], row['user_bookmarked'], row['author_id'] in feed.following(user),
+            ]
+        else:
+            last_modified = int(max(d for d in (row['updated_date'], row['like_latest'], row['comment_latest_date']) if d).timestamp())
+        digest = hashlib.md5(':'.join(str(p) for p in parts).encode(), usedforsecurity=False).hexdigest()
+        return f'W/"{digest}"', last_modified
+
+    def get_queryset(self):
+        return Post.objects.select_related('author', 'category').prefetch_related('tags')
+
+    def count_view(self, pk):
+        if not self.request.META.get(EXPORT_META):
+            Post.objects.filter(pk=pk).update(view_count=F('view_count') + 1)
+            analytics.record(pk, 'views')
+
     def get_object(self, queryset=None):
         obj = super().get_object(queryset)
-        # Increment view count
-        Post.objects.filter(pk=obj.pk).update(view_count=obj.view_count + 1)
+        self.count_view(obj.pk)
         return obj
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        post = self.get_object()
+        post = self.object
         is_premium = getattr(self.request, 'is_premium_user', False)
         ctx['is_premium'] = is_premium
         if post.access_level == 'premium' and not is_premium and (not self.request.user.is_authenticated or post.author != self.request.user):
@@ -84,14 +243,14 @@ class PostDetailView(DetailView):
         else:
             ctx['paywall'] = False
         ctx['comment_form'] = CommentForm()
-        ctx['comments'] = post.comments.filter(parent__isnull=True).select_related('author')
-        ctx['is_liked'] = self.request.user.is_authenticated and post.likes.filter(user=self.request.user).exists()
-        ctx['is_bookmarked'] = self.request.user.is_authenticated and post.bookmarks.filter(user=self.request.user).exists()
-        ctx['like_count'] = post.likes.count()
-        # Related posts
-        ctx['related_posts'] = Post.objects.filter(
-            status='published', category=post.category
-        ).exclude(pk=post.pk)[:3] if post.category else Post.objects.filter(status='published').exclude(pk=post.pk)[:3]
+        ctx['comments'] = list(top_level_comments(post))
+        # Counters and the reader's like/bookmark state were already fetched with the validators
+        row = self.validator_row
+        ctx['is_liked'] = bool(row.get('user_liked'))
+        ctx['is_bookmarked'] = bool(row.get('user_bookmarked'))
+        ctx['is_following'] = self.request.user.is_authenticated and post.author_id in feed.following(self.request.user)
+        ctx['like_count'] = row['like_total'] or 0
+        ctx['related_posts'] = related_posts(post)
         return ctx
 
 
@@ -107,6 +266,7 @@ class PostCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
         from django.utils.text import slugify
         form.instance.author = self.request.user
         form.instance.slug = slugify(form.instance.title)
+        form.instance._editor = self.request.user
         messages.success(self.request, 'Post published successfully!')
         return super().form_valid(form)
 
@@ -120,6 +280,7 @@ class PostUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return self.request.user == self.get_object().author
 
     def form_valid(self, form):
+        form.instance._editor = self.request.user
         messages.success(self.request, 'Post updated successfully!')
         return super().form_valid(form)
 
@@ -137,6 +298,52 @@ class PostDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 
+class PostHistoryMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """Revision pages, for the post's author only."""
+
+    def test_func(self):
+        self.post = get_object_or_404(Post, slug=self.kwargs['slug'])
+        return self.request.user == self.post.author
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['post'] = self.post
+        return ctx
+
+
+class PostRevisionListView(PostHistoryMixin, ListView):
+    template_name = 'blog/post_revisions.html'
+    context_object_name = 'revisions'
+    paginate_by = 50
+
+    def get_queryset(self):
+        # Listings never need the stored text
+        return self.post.revisions.defer('data').select_related('editor').order_by('-number')
+
+
+class PostRevisionDiffView(PostHistoryMixin, TemplateView):
+    template_name = 'blog/post_revision_diff.html'
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        number = self.kwargs['number']
+        try:
+            against = int(self.request.GET.get('against', number - 1))
+        except ValueError:
+            against = number - 1
+        if not 0 < against < number:
+            against = number - 1
+        found = revisions.get(self.post.pk, *{number, number - 1, against} - {0})
+        if number not in found:
+            raise Http404('No such revision')
+        ctx['revision'] = found[number]
+        # The one before it when the requested base was pruned
+        ctx['base'] = found.get(against) or found.get(number - 1)
+        old = ctx['base'].body if ctx['base'] else ''
+        ctx['lines'] = list(revisions.diff(old, ctx['revision'].body))
+        return ctx
+
+
 class SubscribeView(LoginRequiredMixin, TemplateView):
     template_name = 'blog/subscribe.html'
 
@@ -150,6 +357,68 @@ class BookmarkListView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         return Bookmark.objects.filter(user=self.request.user).select_related('post', 'post__author', 'post__category')
 
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        fragments.attach_cards([b.post for b in ctx['bookmarks']], 'blog/includes/bookmark_card.html')
+        return ctx
+
+
+class ArchiveView(TemplateView):
+    """Published posts of a year or a month, newest first, paged by cursor."""
+    read_from_replica = True
+    template_name = 'blog/archive.html'
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        year, month = self.kwargs['year'], self.kwargs.get('month')
+        # The period ends at the start of the next one, which must still be a valid date
+        if not (1 <= year <= 9998 and (month is None or 1 <= month <= 12)):
+            raise Http404('No such month')
+        posts, next_cursor = archive.page(
+            with_counts(Post.objects.select_related('author', 'category')), year, month,
+            feed.decode_cursor(self.request.GET.get('before')),
+        )
+        ctx['posts'] = posts
+        ctx['next_cursor'] = next_cursor
+        ctx['year'] = year
+        ctx['month'] = date(year, month, 1) if month else None
+        ctx['archive'] = archive.months()
+        ctx['bookmarked_ids'] = page_cards(self.request, posts)
+        return ctx
+
+
+class FollowingFeedView(LoginRequiredMixin, TemplateView):
+    read_from_replica = True
+    template_name = 'blog/following.html'
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ids, next_cursor = feed.page(self.request.user, feed.decode_cursor(self.request.GET.get('before')))
+        found = with_counts(Post.objects.filter(status='published').select_related('author', 'category')).in_bulk(ids)
+        posts = [found[pk] for pk in ids if pk in found]
+        ctx['posts'] = posts
+        ctx['next_cursor'] = next_cursor
+        ctx['following_count'] = len(feed.following(self.request.user))
+        ctx['bookmarked_ids'] = page_cards(self.request, posts)
+        return ctx
+
+
+class NotificationListView(LoginRequiredMixin, ListView):
+    template_name = 'blog/notifications.html'
+    context_object_name = 'notifications'
+    paginate_by = 20
+
+    def get_queryset(self):
+        return Notification.objects.filter(recipient=self.request.user).select_related('actor', 'post')
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        # The page shows which ones were new, then the badge is cleared
+        if request.user.profile.unread_notifications:
+            response.render()
+            notifications.mark_read(request.user)
+        return response
+
 
 class ProfileView(LoginRequiredMixin, DetailView):
     model = Profile
@@ -163,10 +432,15 @@ class ProfileView(LoginRequiredMixin, DetailView):
         ctx['user_posts'] = Post.objects.filter(author=self.request.user, status='published')[:5]
         ctx['bookmark_count'] = Bookmark.objects.filter(user=self.request.user).count()
         ctx['post_count'] = Post.objects.filter(author=self.request.user).count()
+        if self.request.user.role in ['author', 'admin']:
+            post_id = self.request.GET.get('post', '')
+            # isdigit() alone also takes digits such as '²' that int() rejects
+            ctx['analytics'] = analytics.dashboard(self.request.user, int(post_id) if post_id.isascii() and post_id.isdigit() else None)
         return ctx
 
 
 class CategoryPostsView(ListView):
+    read_from_replica = True
     model = Post
     template_name = 'blog/post_list.html'
     context_object_name = 'posts'
@@ -174,21 +448,17 @@ class CategoryPostsView(ListView):
 
     def get_queryset(self):
         self.category = get_object_or_404(Category, slug=self.kwargs['slug'])
-        return Post.objects.filter(status='published', category=self.category).select_related('author', 'category').annotate(
-            like_count=Count('likes'), comment_count=Count('comments'),
-        )
+        return with_counts(Post.objects.filter(status='published', category=self.category).select_related('author', 'category'))
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx['categories'] = Category.objects.annotate(post_count=Count('posts')).filter(post_count__gt=0)
+        ctx['categories'] = sidebar_categories()
         ctx['active_category'] = self.category.slug
         ctx['search_query'] = ''
         ctx['active_tag'] = ''
         ctx['featured_post'] = None
-        if self.request.user.is_authenticated:
-            ctx['bookmarked_ids'] = list(Bookmark.objects.filter(user=self.request.user).values_list('post_id', flat=True))
-        else:
-            ctx['bookmarked_ids'] = []
+        ctx['archive'] = archive.months()
+        ctx['bookmarked_ids'] = page_cards(self.request, ctx['posts'])
         return ctx
 
 
@@ -198,7 +468,7 @@ def process_subscription(request):
     profile, _ = Profile.objects.get_or_create(user=request.user)
     profile.is_subscribed = True
     profile.subscription_end_date = date.today() + timedelta(days=30)
-    profile.save()
+    profile.save(update_fields=['is_subscribed', 'subscription_end_date'])
     messages.success(request, f"Subscribed until {profile.subscription_end_date:%b %d, %Y}")
     return redirect('post_list')
 
@@ -212,7 +482,13 @@ def add_comment(request, slug):
         c = form.save(commit=False)
         c.post = post
         c.author = request.user
+        parent_id = request.POST.get('parent')
+        if parent_id and parent_id.isdigit():
+            c.parent = post.comments.filter(pk=parent_id, parent__isnull=True).first()
         c.save()
+        if c.parent_id:
+            # Replies are not part of the live top-level list
+            return redirect('post_detail', slug=slug)
         try:
             from asgiref.sync import async_to_sync
             from channels.layers import get_channel_layer
@@ -225,8 +501,9 @@ def add_comment(request, slug):
                     'created_date': c.created_date.strftime('%b %d, %Y, %I:%M %p'),
                 }
             })
+            metrics.GROUP_SENDS.inc(source='add_comment', outcome='ok')
         except Exception:
-            pass
+            metrics.GROUP_SENDS.inc(source='add_comment', outcome='error')
     return redirect('post_detail', slug=slug)
 
 
@@ -255,3 +532,42 @@ def toggle_bookmark(request, slug):
         bookmarked = True
     return JsonResponse({'bookmarked': bookmarked})
 
+
+@login_required
+@require_POST
+def toggle_follow(request, username):
+    author = get_object_or_404(User.objects.select_related('profile'), username=username)
+    if author == request.user:
+        return JsonResponse({'error': 'You cannot follow yourself.'}, status=400)
+    follows = request.user.profile.follows
+    # The follows signal updates the reader's cached following set in place
+    if follows.filter(pk=author.profile.pk).exists():
+        follows.remove(author.profile)
+        following = False
+    else:
+        follows.add(author.profile)
+        following = True
+    return JsonResponse({'following': following})
+
+
+def search_suggest(request):
+    query = request.GET.get('q', '').strip()
+    results = autocomplete.suggest(query) if len(query) >= 2 else []
+    response = JsonResponse({'query': query, 'results': results})
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
+
+@login_required
+def notifications_api(request):
+    """The reader's notifications, newest first; pass the returned ``next`` as ``before`` for older ones."""
+    qs = Notification.objects.filter(recipient=request.user).select_related('actor', 'post')
+    before = request.GET.get('before', '')
+    if before.isdigit():
+        qs = qs.filter(pk__lt=before)
+    page = list(qs[:21])
+    return JsonResponse({
+        'unread': request.user.profile.unread_notifications,
+        'results': [notifications.as_dict(n) for n in page[:20]],
+        'next': page[19].pk if len(page) > 20 else None,
+    })
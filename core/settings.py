@@ -50,6 +50,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blog.middleware.MetricsMiddleware',
+    # Early, so the session, user and profile queries of a request are timed too
+    'blog.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -57,8 +60,11 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'blog.middleware.RateLimitMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'blog.middleware.SubscriptionMiddleware',
+    'blog.middleware.ReplicaMiddleware',
+    'blog.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -74,6 +80,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'blog.context_processors.notifications',
             ],
         },
     },
@@ -88,6 +95,33 @@ DATABASES = {
     )
 }
 
+# Read replicas: comma-separated database URLs in DATABASE_REPLICA_URLS. Views marked
+# read_from_replica read from them, except for REPLICA_PIN_SECONDS after the same
+# client made a write. Locally: two SQLite files kept in step by "sync_sqlite_replica".
+DATABASE_REPLICAS = []
+for i, url in enumerate(u.strip() for u in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if u.strip()):
+    DATABASES[f'replica{i + 1}'] = {**dj_database_url.parse(url), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{i + 1}')
+DATABASE_ROUTERS = ['blog.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', '5'))
+
+# Connection reuse. Daphne runs every request in a fresh thread and Django connections
+# are per thread, so persistent connections (DB_CONN_MAX_AGE seconds) only pay off under
+# a WSGI server. Under Daphne on PostgreSQL use DB_POOL=1 instead: a psycopg 3 pool shared
+# by all threads, which also needs DB_CONN_MAX_AGE=0. Health checks apply to both.
+DB_POOL = os.environ.get('DB_POOL', 'False') == 'True'
+for db in DATABASES.values():
+    db['CONN_HEALTH_CHECKS'] = os.environ.get('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+    if DB_POOL and db['ENGINE'] == 'django.db.backends.postgresql':
+        db['CONN_MAX_AGE'] = 0
+        db.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '20')),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+        }
+    else:
+        db['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', '0'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -164,3 +198,134 @@ CHANNEL_LAYERS = {
 }
 
 TAGGIT_CASE_INSENSITIVE = True
+
+# Sidebar tag cloud: number of tags shown and how long it is cached (seconds). It is
+# also dropped whenever a tag count changes, which only reaches other workers via Redis.
+TAG_CLOUD_SIZE = int(os.environ.get('TAG_CLOUD_SIZE', '30'))
+TAG_CLOUD_TIMEOUT = int(os.environ.get('TAG_CLOUD_TIMEOUT', '300'))
+
+# Search suggestions: how often (seconds) each worker checks the cache for index
+# changes made by other workers
+AUTOCOMPLETE_CHECK_INTERVAL = float(os.environ.get('AUTOCOMPLETE_CHECK_INTERVAL', '1'))
+
+# Search facets: values shown per facet, and how long the matching posts of a search are
+# cached for counting (seconds); any published post, tag or category change also
+# invalidates them
+SEARCH_FACET_SIZE = int(os.environ.get('SEARCH_FACET_SIZE', '10'))
+SEARCH_FACET_TIMEOUT = int(os.environ.get('SEARCH_FACET_TIMEOUT', '300'))
+
+# Post revisions: a full snapshot is stored at least every this many revisions (the most
+# deltas applied to rebuild one), and "manage.py prune_revisions" keeps this many per post
+REVISION_SNAPSHOT_INTERVAL = int(os.environ.get('REVISION_SNAPSHOT_INTERVAL', '10'))
+REVISION_KEEP = int(os.environ.get('REVISION_KEEP', '100'))
+
+# Date archive: posts per page, and how long the sidebar month list is cached (seconds);
+# it is also dropped whenever a month's count changes
+ARCHIVE_PAGE_SIZE = int(os.environ.get('ARCHIVE_PAGE_SIZE', '12'))
+ARCHIVE_CACHE_TIMEOUT = int(os.environ.get('ARCHIVE_CACHE_TIMEOUT', '3600'))
+
+# Rate limits of unsafe requests per URL name, per signed-in user or else per client
+# address, as "<count>/<s|m|h|d>"; shared across workers only through Redis. Client
+# addresses are read from X-Forwarded-For behind RATELIMIT_PROXY_COUNT trusted proxies.
+RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'True') == 'True'
+RATELIMITS = {
+    'like_post': os.environ.get('RATELIMIT_LIKE', '60/m'),
+    'toggle_bookmark': os.environ.get('RATELIMIT_BOOKMARK', '60/m'),
+    'add_comment': os.environ.get('RATELIMIT_COMMENT', '10/m'),
+    'login': os.environ.get('RATELIMIT_LOGIN', '10/m'),
+}
+RATELIMIT_PROXY_COUNT = int(os.environ.get('RATELIMIT_PROXY_COUNT', '0'))
+
+# Markdown import ("manage.py import_markdown"): parse processes and posts per INSERT batch
+MARKDOWN_IMPORT_PROCESSES = int(os.environ.get('MARKDOWN_IMPORT_PROCESSES', '4'))
+MARKDOWN_IMPORT_BATCH_SIZE = int(os.environ.get('MARKDOWN_IMPORT_BATCH_SIZE', '500'))
+
+# Post analytics: how often each process adds its buffered counts to the database
+# (seconds), days hourly buckets are kept before being folded into daily ones, and
+# days charted on the author dashboard
+ANALYTICS_FLUSH_INTERVAL = int(os.environ.get('ANALYTICS_FLUSH_INTERVAL', '10'))
+ANALYTICS_HOURLY_DAYS = int(os.environ.get('ANALYTICS_HOURLY_DAYS', '2'))
+ANALYTICS_DASHBOARD_DAYS = int(os.environ.get('ANALYTICS_DASHBOARD_DAYS', '30'))
+
+# Rendered post cards are reused until the post changes; this only bounds how long
+# unused cards stay in the cache (seconds)
+FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('FRAGMENT_CACHE_TIMEOUT', '86400'))
+
+# Following feed: posts per page, how many recent posts are cached per author (older
+# pages are read from the database), and how long cached lists live (seconds)
+FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', '9'))
+FEED_AUTHOR_DEPTH = int(os.environ.get('FEED_AUTHOR_DEPTH', '200'))
+FEED_CACHE_TIMEOUT = int(os.environ.get('FEED_CACHE_TIMEOUT', '86400'))
+
+# Notifications: rows per bulk_create batch of a fan-out job, and whether new ones are
+# pushed over Channels. The fan-out runs in "manage.py worker" (see the job queue below),
+# which the in-memory channel layer cannot reach web processes from, so pushes are on by
+# default only with a shared layer such as Redis
+NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', '500'))
+NOTIFICATION_LIVE = os.environ.get(
+    'NOTIFICATION_LIVE', str(CHANNEL_LAYERS['default']['BACKEND'] != 'channels.layers.InMemoryChannelLayer'),
+) == 'True'
+
+# Job queue ("manage.py worker"): jobs run at once and in threads or processes, jobs
+# claimed per query, idle poll interval, attempts with a JOB_RETRY_BACKOFF (seconds)
+# that doubles per retry, how long a claimed job may run before it is retried, and
+# how many days finished jobs are kept
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', '4'))
+JOB_POOL = os.environ.get('JOB_POOL', 'thread')
+JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', '10'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+JOB_RETRY_BACKOFF = float(os.environ.get('JOB_RETRY_BACKOFF', '10'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '600'))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+
+# Static export ("manage.py export_static"): output directory (empty disables it), the
+# host pages are rendered for, and render processes. After a first full export, changes
+# re-render the affected pages through the job queue.
+STATIC_EXPORT_DIR = os.environ.get('STATIC_EXPORT_DIR', '')
+STATIC_EXPORT_HOST = os.environ.get('STATIC_EXPORT_HOST', 'localhost')
+STATIC_EXPORT_PROCESSES = int(os.environ.get('STATIC_EXPORT_PROCESSES', '4'))
+
+# Admin changelists of large tables count rows exactly only up to this many; above it
+# an unfiltered count is estimated and a filtered one shown as "~limit"
+ADMIN_EXACT_COUNT_LIMIT = int(os.environ.get('ADMIN_EXACT_COUNT_LIMIT', '10000'))
+
+# Cache: in-process by default, Redis when REDIS_URL is set. Both report hit/miss counts.
+CACHES = {
+    'default': {'BACKEND': 'blog.cache_backends.LocMemCache'},
+}
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {'BACKEND': 'blog.cache_backends.RedisCache', 'LOCATION': os.environ['REDIS_URL']}
+
+# Metrics: /metrics requires "Authorization: Bearer <METRICS_TOKEN>" when a token is set,
+# otherwise a staff session. With several worker processes, point METRICS_DIR at a
+# directory shared by them (emptied on boot) so their values are aggregated.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_WRITE_INTERVAL = float(os.environ.get('METRICS_WRITE_INTERVAL', '1'))
+
+# Request timing: fraction of requests instrumented (0 disables), and how often the
+# per-process totals are written to the RequestStat table (seconds)
+REQUEST_TIMING_SAMPLE_RATE = float(os.environ.get('REQUEST_TIMING_SAMPLE_RATE', '0.05'))
+REQUEST_TIMING_FLUSH_INTERVAL = int(os.environ.get('REQUEST_TIMING_FLUSH_INTERVAL', '60'))
+
+# Profiling: staff can add ?_profile=1, scripts can send an X-Profile-Token header
+# (manage.py profile_token); a PROFILE_SAMPLE_RATE fraction of requests is profiled
+# and kept when slower than PROFILE_SLOW_MS. Dumps are browsable in the admin.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SLOW_MS = int(os.environ.get('PROFILE_SLOW_MS', '500'))
+PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', '3600'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'blog.perf': {'handlers': ['console'], 'level': os.environ.get('PERF_LOG_LEVEL', 'INFO'), 'propagate': False},
+        'blog.jobs': {'handlers': ['console'], 'level': os.environ.get('JOB_LOG_LEVEL', 'INFO'), 'propagate': False},
+        'blog.export': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
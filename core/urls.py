@@ -19,13 +19,14 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
-from blog.views import UserRegisterView
+from blog.views import UserRegisterView, metrics_view
 
 # Custom error handler
 handler403 = 'blog.views.custom_403'
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
 
     # Auth URLs
     path('register/', UserRegisterView.as_view(), name='register'),
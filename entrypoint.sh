@@ -1,17 +1,38 @@
 #!/bin/sh
 set -e
 
-echo "Applying migrations..."
-python manage.py migrate --noinput
+if [ -n "$METRICS_DIR" ]; then
+    echo "Resetting metrics directory..."
+    mkdir -p "$METRICS_DIR"
+    rm -f "$METRICS_DIR"/*.json
+fi
 
-echo "Collecting static files..."
-python manage.py collectstatic --noinput
+if [ "$STARTUP_MODE" = "legacy" ]; then
+    echo "Applying migrations..."
+    python manage.py migrate --noinput
 
-echo "Creating superuser if needed..."
-python manage.py create_superuser_if_none
+    echo "Collecting static files..."
+    python manage.py collectstatic --noinput
 
-echo "Loading initial data if needed..."
-python manage.py load_initial_data
+    echo "Creating superuser if needed..."
+    python manage.py create_superuser_if_none
+
+    echo "Loading initial data if needed..."
+    python manage.py load_initial_data
+else
+    # One process for all setup steps; each is skipped when already done
+    echo "Preparing..."
+    python manage.py prepare
+fi
+
+# Single-container deploys (Railway) have no separate worker service, so the job
+# worker runs beside the server, restarted if it exits. Jobs it holds when the
+# container stops are claimed again after JOB_LEASE_SECONDS. Set RUN_WORKER=False
+# where "manage.py worker" runs on its own (docker-compose.yml).
+if [ "$1" = "daphne" ] && [ "$RUN_WORKER" != "False" ]; then
+    echo "Starting job worker..."
+    (while true; do python manage.py worker; sleep 5; done) &
+fi
 
 echo "Starting server..."
 exec "$@"